@@ -1,40 +1,71 @@
 import streamlit as st
+import functools
 import os
-from modules import video_analyzer, font_manager, video_editor
-import google.generativeai as genai
+import pathlib
+import time
+import urllib.parse
+from modules import video_analyzer, font_manager, video_editor, render_jobs, metrics, subtitles, ffmpeg_tools, clip_state, storage_manager, media_index, filmstrip
+from modules.clip_state import ClipState
 
 # Streamlitページ設定
 st.set_page_config(layout="wide", page_title="QuickClip Pro")
 st.title("QuickClip Pro: AI動画エディター")
 
-# ImageMagickのバイナリパスが設定されているか確認し、設定を促す
-if "IMAGEMAGICK_BINARY" not in os.environ:
-    st.warning("MoviePyのTextClipにはImageMagickが必要です。環境変数 IMAGEMAGICK_BINARY を設定するか、sidebarでパスを入力してください。")
-    # 例: macOS/Linuxの場合: /usr/local/bin/magick, Windowsの場合: C:\Program Files\ImageMagick-7.1.1-Q16-HDRI\magick.exe
-
 # 環境変数からGemini APIキーを取得
 GEMINI_API_KEY = os.environ.get("GEMINI_API_KEY") or st.secrets.get("GEMINI_API_KEY")
 if not GEMINI_API_KEY:
     st.error("Gemini APIキーが設定されていません。環境変数 'GEMINI_API_KEY' または Streamlit Secrets に設定してください。")
     st.stop()
 else:
-    genai.configure(api_key=GEMINI_API_KEY)
+    video_analyzer.configure_gemini(GEMINI_API_KEY) # SDK自体は初めてAPIを呼び出す時点で読み込まれる
+
+# QUICKCLIP_METRICS=1 と METRICS_PORT が設定されている場合、/metrics を公開する（プロセスごとに一度だけ起動）
+metrics.start_metrics_server()
+# 作業ディレクトリの容量上限とTTLを定期的に適用する（プロセスごとに一度だけ起動）
+storage_manager.start_janitor()
+# 200MBを超えるレンダリング結果も静的ファイル配信（チャンク単位の送信）でダウンロードできるようにする
+storage_manager.configure_static_serving()
 
 # Session Stateの初期化
 if 'uploaded_video_file_id' not in st.session_state:
     st.session_state.uploaded_video_file_id = None
 if 'uploaded_video_name' not in st.session_state:
     st.session_state.uploaded_video_name = None
+if 'uploaded_video_path' not in st.session_state:
+    st.session_state.uploaded_video_path = None # ソースストアに保存された動画のパス
+if 'uploaded_video_hash' not in st.session_state:
+    st.session_state.uploaded_video_hash = None # 動画のコンテンツハッシュ (SHA-256)
 if 'video_analysis_result' not in st.session_state:
     st.session_state.video_analysis_result = [] # AI解析によるシーン抽出結果
 if 'edited_clips' not in st.session_state:
-    st.session_state.edited_clips = [] # ユーザーが編集したクリップリスト
+    st.session_state.edited_clips = [] # ユーザーが編集したクリップリスト (ClipState)
+elif any(isinstance(clip, dict) for clip in st.session_state.edited_clips):
+    # 更新前から続いているセッションでは、クリップが辞書形式のまま残っているためClipStateに変換する
+    st.session_state.edited_clips = [ClipState.from_dict(clip) if isinstance(clip, dict) else clip for clip in st.session_state.edited_clips]
+if 'clip_page' not in st.session_state:
+    st.session_state.clip_page = 0 # 編集ワークスペースで表示中のページ
 if 'available_fonts' not in st.session_state:
     st.session_state.available_fonts = font_manager.get_available_fonts()
 if 'selected_font_path' not in st.session_state:
     st.session_state.selected_font_path = None
 if 'temp_output_video' not in st.session_state:
     st.session_state.temp_output_video = None
+if 'rendered_outputs' not in st.session_state:
+    st.session_state.rendered_outputs = {} # 複数形式で書き出した場合の {形式名: パス}
+if 'render_job_id' not in st.session_state:
+    st.session_state.render_job_id = None # 実行中のバックグラウンドレンダリングジョブのID
+if 'preview_video' not in st.session_state:
+    st.session_state.preview_video = None # 低解像度プレビューのパス
+if 'gemini_file_state' not in st.session_state:
+    st.session_state.gemini_file_state = None # Gemini File API上の処理状態 (PROCESSING / ACTIVE / FAILED)
+if 'gemini_poll_delay' not in st.session_state:
+    st.session_state.gemini_poll_delay = 1.0 # 状態ポーリングの間隔（指数バックオフ）
+if 'gemini_next_poll_at' not in st.session_state:
+    st.session_state.gemini_next_poll_at = 0.0
+
+# このセッションが使っているソース動画とレンダリング結果は、空き容量の確保や容量上限で削除されないよう再実行ごとに登録を延長する
+for leased_path in [st.session_state.uploaded_video_path, st.session_state.temp_output_video, *st.session_state.rendered_outputs.values()]:
+    storage_manager.lease(leased_path)
 
 # ============================================================================
 # サイドバー：設定とリソース
@@ -47,29 +78,71 @@ uploaded_file = st.sidebar.file_uploader("動画ファイルを選択 (最大1GB
 
 if uploaded_file and st.session_state.uploaded_video_file_id is None:
     st.session_state.uploaded_video_name = uploaded_file.name
-    file_id = video_analyzer.upload_video_to_gemini(uploaded_file)
+    ingested = video_analyzer.ingest_uploaded_video(uploaded_file)
+    if ingested:
+        # プレビュー用の低解像度プロキシ、シーク・区間の検証に使うメディアインデックス、
+        # 区間の端のサムネイルに使うフィルムストリップを、Geminiへのアップロードの成否に関わらずバックグラウンドで作成しておく
+        content_hash, source_path = ingested
+        video_editor.start_proxy_build(source_path, content_hash)
+        media_index.start_index_build(source_path, content_hash)
+        filmstrip.start_filmstrip_build(source_path, content_hash)
+    file_id = video_analyzer.upload_video_to_gemini(ingested[1], uploaded_file.name, ingested[0]) if ingested else None
     if file_id:
         st.session_state.uploaded_video_file_id = file_id
+        st.session_state.gemini_file_state = None
+        st.session_state.gemini_poll_delay = 1.0
+        st.session_state.gemini_next_poll_at = 0.0
+        st.session_state.uploaded_video_hash, st.session_state.uploaded_video_path = ingested
         # アップロード後、再解析が必要な場合があるため、既存の解析結果をクリア
         st.session_state.video_analysis_result = []
         st.session_state.edited_clips = []
-        st.experimental_rerun()
+        st.rerun()
+
+@st.fragment(run_every=1)
+def gemini_file_status():
+    """
+    Gemini File APIの処理状態をスクリプト全体をブロックせずに確認します。
+    問い合わせ間隔は指数バックオフで伸ばし、ACTIVEになった時点でアプリ全体を再実行します。
+    """
+    state = st.session_state.gemini_file_state
+    if state not in ("ACTIVE", "FAILED", "MISSING") and time.time() >= st.session_state.gemini_next_poll_at:
+        state = video_analyzer.refresh_gemini_file_state(st.session_state.uploaded_video_file_id, st.session_state.uploaded_video_hash)
+        st.session_state.gemini_file_state = state
+        st.session_state.gemini_next_poll_at = time.time() + st.session_state.gemini_poll_delay
+        st.session_state.gemini_poll_delay = min(st.session_state.gemini_poll_delay * 2, 30.0)
+        if state == "ACTIVE":
+            st.rerun(scope="app")
+    if state == "ACTIVE":
+        st.caption("Gemini: 解析の準備ができています。")
+    elif state in ("FAILED", "MISSING"):
+        st.error("Gemini側での動画の処理に失敗しました。動画を再アップロードしてください。", icon="\u274C")
+    else:
+        st.caption("Gemini: 動画を処理中です...")
 
 if st.session_state.uploaded_video_file_id:
     st.sidebar.write(f"**アップロード済み動画:** {st.session_state.uploaded_video_name}")
+    with st.sidebar:
+        gemini_file_status()
     # st.sidebar.write(f"ファイルID: {st.session_state.uploaded_video_file_id}")
     if st.sidebar.button("動画を再アップロード / 別の動画を選択"):
         st.session_state.uploaded_video_file_id = None
         st.session_state.uploaded_video_name = None
+        st.session_state.uploaded_video_path = None
+        st.session_state.uploaded_video_hash = None
+        st.session_state.gemini_file_state = None
         st.session_state.video_analysis_result = []
         st.session_state.edited_clips = []
         st.session_state.temp_output_video = None
-        st.experimental_rerun()
+        st.session_state.rendered_outputs = {}
+        st.session_state.preview_video = None
+        st.rerun()
 
 # フォント管理
 st.sidebar.subheader("フォント管理")
 
 # Google Fontsの選択とダウンロード
+# イメージに同梱されていないフォントはバックグラウンドで取得しておく（プロセスごとに一度だけ）
+font_manager.start_missing_font_fetch()
 google_fonts_list = font_manager.get_google_fonts_list()
 google_font_names = list(google_fonts_list.keys())
 selected_google_font_name = st.sidebar.selectbox(
@@ -84,7 +157,7 @@ if selected_google_font_name != "--- 選択してください ---":
         downloaded_path = font_manager.download_google_font(selected_google_font_name, font_file_name)
         if downloaded_path and downloaded_path not in st.session_state.available_fonts:
             st.session_state.available_fonts = font_manager.get_available_fonts() # 更新
-            st.experimental_rerun()
+            st.rerun()
 
 # カスタムフォントのアップロード
 custom_font_file = st.sidebar.file_uploader("カスタムフォントをアップロード (.ttf / .otf)", type=["ttf", "otf"])
@@ -92,9 +165,11 @@ if custom_font_file:
     uploaded_path = font_manager.upload_custom_font(custom_font_file)
     if uploaded_path and uploaded_path not in st.session_state.available_fonts:
         st.session_state.available_fonts = font_manager.get_available_fonts() # 更新
-        st.experimental_rerun()
+        st.rerun()
 
 # 利用可能なフォントの表示と選択
+# レジストリはフォントディレクトリに変更があった場合のみ再走査するため、毎回の再実行で呼び出しても軽量
+st.session_state.available_fonts = font_manager.get_available_fonts()
 font_display_names = [font_manager.get_font_display_name(f) for f in st.session_state.available_fonts]
 selected_font_display_name = st.sidebar.selectbox(
     "使用するフォントを選択",
@@ -103,185 +178,405 @@ selected_font_display_name = st.sidebar.selectbox(
 )
 
 if selected_font_display_name != "--- 選択してください ---":
-    st.session_state.selected_font_path = next(
-        (f for f in st.session_state.available_fonts if font_manager.get_font_display_name(f) == selected_font_display_name),
-        None
-    )
+    st.session_state.selected_font_path = font_manager.get_font_path_by_display_name(selected_font_display_name)
 else:
     st.session_state.selected_font_path = None
 
 if st.session_state.selected_font_path:
     st.sidebar.write(f"選択中のフォント: **{font_manager.get_font_display_name(st.session_state.selected_font_path)}**")
+    selected_font_info = font_manager.get_font_info(st.session_state.selected_font_path)
+    if selected_font_info and not selected_font_info["supports_japanese"]:
+        st.sidebar.warning("このフォントは日本語の文字を十分に含んでいません。テロップが正しく表示されない可能性があります。")
 
 # テロップスタイル設定
 st.sidebar.subheader("テロップスタイル設定 (デフォルト)")
 default_font_size = st.sidebar.slider("フォントサイズ", 10, 100, 50)
 default_font_color = st.sidebar.color_picker("フォント色", "#FFFFFF")
-default_text_position_options = {"下部中央": ("center", "bottom"), "中央": ("center", "center"), "上部中央": ("center", "top"), "下部左": ("left", "bottom"), "下部右": ("right", "bottom")}
-default_text_position_label = st.sidebar.selectbox("位置", list(default_text_position_options.keys()))
-default_text_position = default_text_position_options[default_text_position_label]
+default_text_position_label = st.sidebar.selectbox("位置", list(clip_state.TEXT_POSITION_OPTIONS.keys()))
+default_text_position = clip_state.TEXT_POSITION_OPTIONS[default_text_position_label]
 default_bg_enabled = st.sidebar.checkbox("背景を有効にする (テロップ)", value=False)
 default_bg_color = st.sidebar.color_picker("背景色", "#000000") if default_bg_enabled else None
 
-# ImageMagickのパス設定（サイドバー）
-st.sidebar.subheader("ImageMagick設定")
-current_imagemagick_path = os.environ.get("IMAGEMAGICK_BINARY", "")
-imagemagick_path_input = st.sidebar.text_input("ImageMagickバイナリパス", value=current_imagemagick_path, help="例: /usr/local/bin/magick (macOS/Linux) または C:\\Program Files\\ImageMagick-7.1.1-Q16-HDRI\\magick.exe (Windows)")
-if st.sidebar.button("ImageMagickパスを設定"): # ユーザーがボタンを押したときのみ設定
-    if os.path.exists(imagemagick_path_input) or (os.path.basename(imagemagick_path_input) == "magick" and "magick.exe" not in imagemagick_path_input.lower()): # magick.exeがない場合もOK
-        video_editor.set_imagemagick_binary(imagemagick_path_input)
-        os.environ["IMAGEMAGICK_BINARY"] = imagemagick_path_input # 環境変数にも設定して次回以降も利用
-        st.sidebar.success(f"ImageMagickパスを '{imagemagick_path_input}' に設定しました。")
-        st.experimental_rerun()
-    else:
-        st.sidebar.error("指定されたImageMagickバイナリパスが見つからないか、不正なパスです。")
-
 # ============================================================================
 # メインパネル：指示と編集
 # ============================================================================
 
+# 1ページに表示するクリップ数（クリップが多い場合でも1回の再実行で作るウィジェットの数を抑える）
+CLIPS_PER_PAGE = int(os.environ.get("CLIPS_PER_PAGE", "10"))
+
+@st.cache_data(show_spinner=False)
+def get_video_size(video_path, content_hash):
+    """
+    動画の解像度 (幅, 高さ) を返します。ASS字幕の座標系に使います（content_hashはキャッシュのキー用）。
+    """
+    index = media_index.get_ready_index(video_path, content_hash)
+    info = index.video if index else ffmpeg_tools.probe_video_stream(video_path)
+    return (info["width"], info["height"]) if info else None
+
+def format_bytes(size: int) -> str:
+    for unit in ("B", "KB", "MB", "GB"):
+        if size < 1024 or unit == "GB":
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
+
+# ダウンロードボタンで渡すファイルの最大サイズ（静的ファイル配信を使えない場合）
+DOWNLOAD_BUTTON_MAX_BYTES = 200 * storage_manager.MB
+# 静的ファイル配信を使えない場合に、プレーヤーで表示するファイルの最大サイズ
+INLINE_VIDEO_MAX_BYTES = 50 * storage_manager.MB
+
+def show_rendered_video(output_path):
+    """
+    レンダリング結果をプレーヤーで表示します。
+    ファイルのパスを st.video に渡すとファイル全体がメモリ上のメディアストアに読み込まれるため、静的ファイル配信を使える場合は
+    そのURLを渡し、ブラウザがサーバーから直接ストリーミングで再生します。使えない場合は INLINE_VIDEO_MAX_BYTES 以下のファイルだけを表示します。
+    """
+    url = storage_manager.static_url(output_path) if st.get_option("server.enableStaticServing") else None
+    page_url = st.context.url
+    if url and page_url:
+        # st.video はURLとして http(s) の絶対URLだけを受け付ける
+        st.video(urllib.parse.urljoin(page_url.rstrip("/") + "/", url))
+    elif os.path.getsize(output_path) <= INLINE_VIDEO_MAX_BYTES:
+        st.video(output_path)
+    else:
+        st.caption(f"{os.path.basename(output_path)} は {format_bytes(INLINE_VIDEO_MAX_BYTES)} を超えるため、プレーヤーでは表示しません。ダウンロードして確認してください。")
+
+def download_rendered_video(output_path, key):
+    """
+    レンダリング結果のダウンロードリンクを表示します。
+    静的ファイル配信が有効で配信できるサイズであれば、ブラウザがサーバーから直接ストリーミングでダウンロードします。
+    それ以外の場合はダウンロードボタンを使い、ファイルはクリックされた時点で初めて読み込まれます。
+    ダウンロードボタンはファイル全体をメモリに読み込むため、DOWNLOAD_BUTTON_MAX_BYTES を超えるファイルには使いません。
+    """
+    file_name = os.path.basename(output_path)
+    url = storage_manager.static_url(output_path) if st.get_option("server.enableStaticServing") else None
+    if url:
+        st.markdown(f'<a href="{url}" download="{file_name}">レンダリングされた動画をダウンロード</a>', unsafe_allow_html=True)
+    elif os.path.getsize(output_path) > DOWNLOAD_BUTTON_MAX_BYTES:
+        st.warning(f"{file_name} は {format_bytes(DOWNLOAD_BUTTON_MAX_BYTES)} を超えるため、静的ファイル配信 (server.enableStaticServing) を有効にしてダウンロードしてください。")
+    else:
+        st.download_button(
+            label="レンダリングされた動画をダウンロード",
+            data=functools.partial(pathlib.Path(output_path).read_bytes),
+            file_name=file_name,
+            mime="video/mp4",
+            key=key
+        )
+
+@st.fragment(run_every=1)
+def render_job_status():
+    """
+    バックグラウンドのレンダリングジョブの進捗・残り時間を表示します。
+    完了した時点でアプリ全体を再実行し、レンダリング結果を表示します。
+    """
+    job = render_jobs.get_render_job(st.session_state.render_job_id)
+    if job is None:
+        st.session_state.render_job_id = None
+        st.rerun(scope="app")
+
+    if job["status"] == "completed":
+        st.session_state.temp_output_video = job["output_path"]
+        st.session_state.rendered_outputs = job.get("output_paths") or {}
+        st.session_state.render_job_id = None
+        st.rerun(scope="app")
+    elif job["status"] == "failed":
+        st.error(f"動画のレンダリング中にエラーが発生しました: {job.get('error', '')}", icon="\u274C")
+        if st.button("閉じる", key="dismiss_render_job"):
+            st.session_state.render_job_id = None
+            st.rerun(scope="app")
+    elif job["status"] == "cancelled":
+        st.info("レンダリングをキャンセルしました。")
+        if st.button("閉じる", key="dismiss_render_job"):
+            st.session_state.render_job_id = None
+            st.rerun(scope="app")
+    else:
+        if job["status"] == "queued":
+            label = "レンダリング待機中..."
+        else:
+            eta = job["eta_seconds"]
+            eta_text = f"残り約{int(eta)}秒" if eta is not None else "残り時間を計算中"
+            label = f"レンダリング中... {job['progress'] * 100:.0f}% ({job['frames_encoded']}フレーム / {eta_text})"
+        st.progress(job["progress"], text=label)
+        if st.button("レンダリングをキャンセル", key="cancel_render_job"):
+            render_jobs.cancel_render_job(job["id"])
+
+def show_preview(clip_index=None):
+    """
+    プロキシ動画から高速にプレビューをレンダリングし、session_stateに保存します。
+    """
+    with st.spinner("プレビューを作成中..."):
+        preview_path = video_editor.render_preview(
+            st.session_state.uploaded_video_path,
+            clip_state.to_render_list(st.session_state.edited_clips),
+            content_hash=st.session_state.uploaded_video_hash,
+            clip_index=clip_index
+        )
+    if preview_path:
+        # プレビューのファイル名は呼び出しごとに異なるため、このセッションの前回のプレビューは削除しておく
+        previous_path = st.session_state.preview_video
+        if previous_path and previous_path != preview_path and os.path.exists(previous_path):
+            os.remove(previous_path)
+        st.session_state.preview_video = preview_path
+    else:
+        st.error("プレビューの作成中にエラーが発生しました。", icon="\u274C")
+
+@st.fragment(run_every=1)
+def filmstrip_build_status():
+    """
+    フィルムストリップの作成が終わった（または失敗した）時点でアプリ全体を再実行し、各クリップのサムネイルを表示し直します。
+    clip_editorは入力の変更時にしか再実行されないため、作成中の表示を更新するためにこのフラグメントで完了を待ちます。
+    """
+    if filmstrip.get_filmstrip_status(st.session_state.uploaded_video_hash) != "building":
+        st.rerun(scope="app")
+
+@st.fragment
+def clip_editor(clip: ClipState, number: int, font_paths, font_labels, font_indices, source_index=None):
+    """
+    1つのクリップの編集フォームです。フラグメントとして実行されるため、入力を変更してもこのクリップの部分だけが再実行されます。
+    ウィジェットのキーにはクリップのidを使い、入力値はClipStateに直接書き戻します。
+    source_index（メディアインデックス）が渡された場合は、区間を動画の実際の長さと照合して警告を表示します。
+    """
+    key = clip.id
+    st.markdown(f"### クリップ {number}")
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        clip.start_time = st.number_input("開始時間 (秒)", value=float(clip.start_time), step=0.1, key=f"start_{key}")
+    with col2:
+        clip.end_time = st.number_input("終了時間 (秒)", value=float(clip.end_time), step=0.1, key=f"end_{key}")
+    with col3:
+        clip.text = st.text_input("テロップ", value=clip.text, key=f"text_{key}")
+    if clip.end_time <= clip.start_time:
+        st.warning("終了時間が開始時間以前のため、このクリップはレンダリングされません。")
+    elif source_index and source_index.clamp_range(clip.start_time, clip.end_time) is None:
+        st.warning(f"開始時間が動画の長さ ({source_index.duration:.2f}秒) を超えているため、このクリップはレンダリングされません。")
+    elif source_index and clip.end_time > source_index.duration:
+        st.warning(f"終了時間が動画の長さ ({source_index.duration:.2f}秒) を超えています。レンダリング時に動画の終わりまでに切り詰められます。")
+
+    # 開始・終了時点のフレームをフィルムストリップから表示する（レンダリングせずに区間の端を確認できる）
+    posters = filmstrip.get_posters(st.session_state.uploaded_video_hash, [clip.start_time, clip.end_time])
+    if posters:
+        st.image(posters, caption=[f"開始 {clip.start_time:.1f}秒", f"終了 {clip.end_time:.1f}秒"], width=160)
+    elif filmstrip.get_filmstrip_status(st.session_state.uploaded_video_hash) == "failed":
+        st.caption("この動画では区間の端のサムネイルを作成できませんでした。")
+    else:
+        st.caption("区間の端のサムネイルを作成中です...")
+
+    # 個別クリップのテロップスタイル設定
+    with st.expander(f"クリップ {number} テロップスタイルを調整"):
+        clip.font_path = st.selectbox(
+            "フォント",
+            font_paths, # font_pathを直接渡す
+            format_func=lambda font_path: font_labels.get(font_path, font_path),
+            index=font_indices.get(clip.font_path, 0),
+            key=f"font_path_{key}"
+        )
+        clip.font_size = st.slider("フォントサイズ", 10, 100, clip.font_size, key=f"font_size_{key}")
+        clip.font_color = st.color_picker("フォント色", clip.font_color, key=f"font_color_{key}")
+        position_labels = list(clip_state.TEXT_POSITION_OPTIONS.keys())
+        clip.text_position = clip_state.TEXT_POSITION_OPTIONS[st.selectbox("位置", position_labels, index=position_labels.index(clip.text_position_label), key=f"text_pos_{key}")]
+        bg_enabled = st.checkbox("背景を有効にする", value=bool(clip.bg_color), key=f"bg_enabled_{key}")
+        clip.bg_color = st.color_picker("背景色", clip.bg_color or "#000000", key=f"bg_color_{key}") if bg_enabled else None
+
+    col_preview, col_delete = st.columns(2)
+    if col_preview.button(f"クリップ {number} をプレビュー", key=f"preview_clip_{key}"):
+        show_preview(next(i for i, c in enumerate(st.session_state.edited_clips) if c.id == clip.id))
+        st.rerun(scope="app")
+    if col_delete.button(f"クリップ {number} を削除", key=f"delete_clip_{key}"):
+        st.session_state.edited_clips = [c for c in st.session_state.edited_clips if c.id != clip.id]
+        st.rerun(scope="app")
+    st.markdown("--- ")
+
 if not st.session_state.uploaded_video_file_id:
-    st.info("まずサイドバーから動画をアップロードしてください。", icon="")
+    st.info("まずサイドバーから動画をアップロードしてください。")
 else:
     st.subheader("シーン抽出指示")
     prompt = st.text_area("AIへの指示を自然言語で入力してください (例: \"特定の商品が登場するシーンをすべて抽出して、それぞれのシーンにテロップを付けて\" ")
-    if st.button("AIにシーン抽出を依頼"): # AI解析はFile APIの課金対象
+    keyframes_only = st.checkbox("各ショットの代表フレームのみを送信する (長い動画のトークン節約)", value=False)
+    if st.button("AIにシーン抽出を依頼", disabled=st.session_state.gemini_file_state != "ACTIVE"): # AI解析はFile APIの課金対象
         if prompt:
             with st.spinner("AIが動画を解析中... (これには時間がかかる場合があります)"):
-                # ここでGemini API (vision-pro) を呼び出して動画解析を行う
-                # 仮の解析結果を生成（実際にはGemini APIのレスポンスを処理する）
-                st.session_state.video_analysis_result = [
-                    {"start_time": 0, "end_time": 5, "caption": "製品Aの紹介"},
-                    {"start_time": 10, "end_time": 18, "caption": "製品Aの使用デモ"},
-                    {"start_time": 25, "end_time": 30, "caption": "製品Bが登場"},
-                ]
+                # Gemini APIで動画を解析する（同じ動画・指示・モデルの結果はキャッシュから即座に返る）
+                scenes = video_analyzer.extract_scenes(
+                    st.session_state.uploaded_video_file_id,
+                    st.session_state.uploaded_video_hash,
+                    prompt,
+                    video_path=st.session_state.uploaded_video_path,
+                    keyframes_only=keyframes_only
+                )
+            if scenes is not None:
+                st.session_state.video_analysis_result = scenes
                 st.session_state.edited_clips = [] # 解析結果を元に編集クリップを初期化
+                st.session_state.clip_page = 0
                 for res in st.session_state.video_analysis_result:
-                    st.session_state.edited_clips.append({
-                        "start_time": res["start_time"],
-                        "end_time": res["end_time"],
-                        "text": res["caption"],
-                        "font_path": st.session_state.selected_font_path if st.session_state.selected_font_path else font_manager.get_available_fonts()[0] if font_manager.get_available_fonts() else None,
-                        "font_size": default_font_size,
-                        "font_color": default_font_color,
-                        "text_position": default_text_position,
-                        "bg_color": default_bg_color
-                    })
-            st.success("AIによるシーン抽出が完了しました！")
+                    st.session_state.edited_clips.append(ClipState(
+                        start_time=res["start_time"],
+                        end_time=res["end_time"],
+                        text=res["caption"],
+                        font_path=st.session_state.selected_font_path or next(iter(st.session_state.available_fonts), None),
+                        font_size=default_font_size,
+                        font_color=default_font_color,
+                        text_position=default_text_position,
+                        bg_color=default_bg_color
+                    ))
+                st.success("AIによるシーン抽出が完了しました！")
+                cache_stats = video_analyzer.get_analysis_cache_stats()
+                st.caption(f"解析キャッシュ: ヒット {cache_stats['hits']} / ミス {cache_stats['misses']}")
         else:
             st.warning("シーン抽出の指示を入力してください。")
 
     st.subheader("編集ワークスペース")
     if st.session_state.edited_clips:
-        for i, clip in enumerate(st.session_state.edited_clips):
-            st.markdown(f"### クリップ {i+1}")
-            col1, col2, col3 = st.columns(3)
-            with col1:
-                clip["start_time"] = st.number_input(f"開始時間 (秒)##{i}", value=float(clip["start_time"]), step=0.1, key=f"start_{i}")
-            with col2:
-                clip["end_time"] = st.number_input(f"終了時間 (秒)##{i}", value=float(clip["end_time"]), step=0.1, key=f"end_{i}")
-            with col3:
-                clip["text"] = st.text_input(f"テロップ##{i}", value=clip["text"], key=f"text_{i}")
-            
-            # 個別クリップのテロップスタイル設定
-            with st.expander(f"クリップ {i+1} テロップスタイルを調整"):
-                clip["font_path"] = st.selectbox(
-                    f"フォント##{i}",
-                    st.session_state.available_fonts, # font_pathを直接渡す
-                    format_func=font_manager.get_font_display_name,
-                    index=st.session_state.available_fonts.index(clip["font_path"]) if clip["font_path"] in st.session_state.available_fonts else 0,
-                    key=f"font_path_{i}"
-                )
-                clip["font_size"] = st.slider(f"フォントサイズ##{i}", 10, 100, clip["font_size"], key=f"font_size_{i}")
-                clip["font_color"] = st.color_picker(f"フォント色##{i}", clip["font_color"], key=f"font_color_{i}")
-                text_position_label_current = next((key for key, val in default_text_position_options.items() if val == clip["text_position"]), list(default_text_position_options.keys())[0])
-                clip["text_position"] = default_text_position_options[st.selectbox(f"位置##{i}", list(default_text_position_options.keys()), index=list(default_text_position_options.keys()).index(text_position_label_current), key=f"text_pos_{i}")]
-                bg_enabled_current = True if clip["bg_color"] else False
-                clip["bg_enabled"] = st.checkbox(f"背景を有効にする (クリップ {i+1})##{i}", value=bg_enabled_current, key=f"bg_enabled_{i}")
-                clip["bg_color"] = st.color_picker(f"背景色 (クリップ {i+1})##{i}", clip["bg_color"] if clip["bg_color"] else "#000000", key=f"bg_color_{i}") if clip["bg_enabled"] else None
+        clip_count = len(st.session_state.edited_clips)
+        page_count = (clip_count + CLIPS_PER_PAGE - 1) // CLIPS_PER_PAGE
+        st.session_state.clip_page = min(st.session_state.clip_page, page_count - 1)
+        if page_count > 1:
+            st.session_state.clip_page = st.selectbox(
+                f"表示するクリップ (全{clip_count}件)",
+                range(page_count),
+                index=st.session_state.clip_page,
+                format_func=lambda page: f"クリップ {page * CLIPS_PER_PAGE + 1} - {min((page + 1) * CLIPS_PER_PAGE, clip_count)}"
+            )
+
+        # フォントの表示名と位置は全クリップで共通なので、ページごとに一度だけ求めてフラグメントに渡す
+        font_labels = dict(zip(st.session_state.available_fonts, font_display_names))
+        font_indices = {font_path: index for index, font_path in enumerate(st.session_state.available_fonts)}
+        # サムネイル用のフィルムストリップがまだない（容量上限で削除された場合を含む）ときは作成を開始する
+        filmstrip.start_filmstrip_build(st.session_state.uploaded_video_path, st.session_state.uploaded_video_hash)
+        if filmstrip.get_filmstrip_status(st.session_state.uploaded_video_hash) == "building":
+            filmstrip_build_status()
+        # アップロード時に作成したメディアインデックスで、区間が動画の長さに収まっているかを確認する（作成中は確認せずに表示する）
+        source_index = media_index.get_ready_index(st.session_state.uploaded_video_path, st.session_state.uploaded_video_hash) if st.session_state.uploaded_video_path else None
+        page_start = st.session_state.clip_page * CLIPS_PER_PAGE
+        for number, clip in enumerate(st.session_state.edited_clips[page_start:page_start + CLIPS_PER_PAGE], start=page_start + 1):
+            clip_editor(clip, number, st.session_state.available_fonts, font_labels, font_indices, source_index)
 
-            st.button(f"クリップ {i+1} を削除", key=f"delete_clip_{i}", on_click=lambda idx=i: st.session_state.edited_clips.pop(idx))
-            st.markdown("--- ")
+        if st.button("タイムライン全体をプレビュー (低解像度)"):
+            show_preview()
+        if st.session_state.preview_video and os.path.exists(st.session_state.preview_video):
+            st.video(st.session_state.preview_video)
+            if not video_editor.get_ready_proxy(st.session_state.uploaded_video_hash):
+                st.caption("プロキシ動画を作成中のため、元の動画からプレビューしました。")
 
         if st.button("新しいクリップを追加"):
-            st.session_state.edited_clips.append({
-                "start_time": 0,
-                "end_time": 0,
-                "text": "新しいテロップ",
-                "font_path": st.session_state.selected_font_path if st.session_state.selected_font_path else font_manager.get_available_fonts()[0] if font_manager.get_available_fonts() else None,
-                "font_size": default_font_size,
-                "font_color": default_font_color,
-                "text_position": default_text_position,
-                "bg_color": default_bg_color
-            })
-            st.experimental_rerun()
+            st.session_state.edited_clips.append(ClipState(
+                start_time=0,
+                end_time=0,
+                text="新しいテロップ",
+                font_path=st.session_state.selected_font_path or next(iter(st.session_state.available_fonts), None),
+                font_size=default_font_size,
+                font_color=default_font_color,
+                text_position=default_text_position,
+                bg_color=default_bg_color
+            ))
+            # 追加したクリップが表示されるよう最後のページに移動する
+            st.session_state.clip_page = (len(st.session_state.edited_clips) - 1) // CLIPS_PER_PAGE
+            st.rerun()
     else:
         st.info("AIにシーン抽出を依頼するか、手動でクリップを追加してください。")
 
     st.subheader("最終プレビューとレンダリング")
-    if st.button("レンダリング実行"):
-        if not st.session_state.uploaded_video_file_id:
+    smart_render = st.checkbox("スマートレンダリング (テロップのない区間は再エンコードせずにコピー)", value=False)
+    encoder_profile_labels = {"draft": "ドラフト (高速・低解像度)", "standard": "標準", "final": "最終出力 (高画質・高圧縮)"}
+    encoder_profile = st.selectbox(
+        "エンコードプロファイル",
+        list(video_editor.ENCODER_PROFILES),
+        index=list(video_editor.ENCODER_PROFILES).index(video_editor.DEFAULT_ENCODER_PROFILE),
+        format_func=lambda name: encoder_profile_labels.get(name, name)
+    )
+    render_engine_labels = {"moviepy": "MoviePy (従来)", "ffmpeg": "ffmpeg (テロップを字幕として一括処理・高速)"}
+    render_engine = st.selectbox(
+        "レンダリングエンジン",
+        list(video_editor.RENDER_ENGINES),
+        index=list(video_editor.RENDER_ENGINES).index(video_editor.DEFAULT_RENDER_ENGINE),
+        format_func=lambda name: render_engine_labels.get(name, name)
+    )
+    subtitle_mode = "burn"
+    if render_engine == "ffmpeg":
+        subtitle_mode_labels = {"burn": "映像に焼き込む", "soft": "字幕トラックとして格納 (プレーヤーで表示を切り替え可能)"}
+        subtitle_mode = st.radio("テロップの出力方法", list(video_editor.SUBTITLE_MODES), format_func=lambda mode: subtitle_mode_labels.get(mode, mode), horizontal=True)
+    renditions = ["original"]
+    if render_engine == "ffmpeg":
+        rendition_labels = {"original": "元の比率", "landscape": "横型 16:9 (YouTube)", "vertical": "縦型 9:16 (ショート / リール)", "review": "確認用 720p"}
+        renditions = st.multiselect(
+            "出力形式 (複数選択すると1回のデコードから同時に書き出します)",
+            list(video_editor.RENDITION_PRESETS),
+            default=["original"],
+            format_func=lambda name: rendition_labels.get(name, name)
+        ) or ["original"]
+    if st.button("レンダリング実行", disabled=bool(st.session_state.render_job_id)):
+        if not st.session_state.uploaded_video_path or not os.path.exists(st.session_state.uploaded_video_path):
             st.error("動画がアップロードされていません。", icon="\u274C")
         elif not st.session_state.edited_clips:
             st.error("編集するクリップがありません。", icon="\u274C")
-        elif not os.environ.get("IMAGEMAGICK_BINARY"):
-            st.error("ImageMagickのバイナリパスが設定されていません。サイドバーで設定してください。", icon="\u274C")
         else:
-            with st.spinner("動画をレンダリング中... (これには時間がかかります)"):
-                # Gemini File APIから動画をダウンロードする必要がある（仮に一時ファイルとして保存）
-                # TODO: 実際のGemini File APIからのダウンロード処理を実装
-                # ここではアップロード時に保存した一時ファイルをそのまま使うことを想定
-                temp_video_path = os.path.join("/tmp", st.session_state.uploaded_video_name) # アップロード時に一時保存したパスを仮定
-                # 実際には video_analyzer.get_gemini_file(st.session_state.uploaded_video_file_id) でFileオブジェクトを取得後、ダウンロードが必要
-
-                # edited_clipsのデータ構造をvideo_editor.render_videoが期待する形式に変換
-                clips_to_render = []
-                for clip in st.session_state.edited_clips:
-                    clips_to_render.append({
-                        "start_time": clip["start_time"],
-                        "end_time": clip["end_time"],
-                        "text_params": {
-                            "text": clip["text"],
-                            "font_path": clip["font_path"],
-                            "font_size": clip["font_size"],
-                            "font_color": clip["font_color"],
-                            "text_position": clip["text_position"],
-                            "bg_color": clip["bg_color"]
-                        }
-                    })
-
-                output_filename = f"rendered_{os.path.splitext(st.session_state.uploaded_video_name)[0]}.mp4"
-                rendered_video_path = video_editor.render_video(temp_video_path, clips_to_render, output_filename)
-                
-                if rendered_video_path:
-                    st.session_state.temp_output_video = rendered_video_path
-                    st.success("動画のレンダリングが完了しました！")
-                else:
-                    st.error("動画のレンダリング中にエラーが発生しました。", icon="\u274C")
-            st.experimental_rerun() # レンダリング結果を反映するために再実行
+            # アップロード時にソースストアへ保存した動画をそのまま使う
+            source_video_path = st.session_state.uploaded_video_path
+
+            # edited_clipsのデータ構造をvideo_editor.render_videoが期待する形式に変換
+            clips_to_render = clip_state.to_render_list(st.session_state.edited_clips)
+
+            # 出力はジョブごとのディレクトリに保存され、静的ファイルとして配信される
+            output_filename = storage_manager.new_output_path(f"rendered_{os.path.splitext(st.session_state.uploaded_video_name)[0]}.mp4")
+            # レンダリングはバックグラウンドのジョブとして実行し、スクリプトをブロックしない
+            st.session_state.render_job_id = render_jobs.submit_render_job(
+                source_video_path, clips_to_render, output_filename,
+                smart_render=smart_render, content_hash=st.session_state.uploaded_video_hash, profile=encoder_profile,
+                engine=render_engine, subtitle_mode=subtitle_mode,
+                renditions=renditions if renditions != ["original"] else None
+            )
+
+    if st.session_state.edited_clips and st.session_state.uploaded_video_path and os.path.exists(st.session_state.uploaded_video_path):
+        with st.expander("テロップを字幕ファイルとして書き出す"):
+            clips_to_export = clip_state.to_render_list(st.session_state.edited_clips)
+            subtitle_basename = os.path.splitext(st.session_state.uploaded_video_name)[0]
+            col_srt, col_ass = st.columns(2)
+            col_srt.download_button("SRT (テキストのみ)", subtitles.build_srt(clips_to_export), file_name=f"{subtitle_basename}.srt", mime="application/x-subrip")
+            video_size = get_video_size(st.session_state.uploaded_video_path, st.session_state.uploaded_video_hash)
+            if video_size:
+                col_ass.download_button("ASS (フォント・色・位置を含む)", subtitles.build_ass(clips_to_export, video_size), file_name=f"{subtitle_basename}.ass", mime="text/x-ssa")
+
+    if st.session_state.render_job_id:
+        render_job_status()
     
     if st.session_state.temp_output_video:
-        st.subheader("レンダリング結果")
-        st.video(st.session_state.temp_output_video)
-        with open(st.session_state.temp_output_video, "rb") as file:
-            st.download_button(
-                label="レンダリングされた動画をダウンロード",
-                data=file,
-                file_name=os.path.basename(st.session_state.temp_output_video),
-                mime="video/mp4"
-            )
-        if st.button("一時出力ファイルを削除"):
-            os.remove(st.session_state.temp_output_video)
+        rendered_outputs = st.session_state.rendered_outputs or {"original": st.session_state.temp_output_video}
+        if not all(os.path.exists(path) for path in rendered_outputs.values()):
+            # 保持期間を過ぎた出力はストレージの整理で削除される
+            st.warning("レンダリング結果は保持期間を過ぎたため削除されました。もう一度レンダリングしてください。", icon="\u26A0\uFE0F")
             st.session_state.temp_output_video = None
-            st.experimental_rerun()
+            st.session_state.rendered_outputs = {}
+        else:
+            st.subheader("レンダリング結果")
+            for tab, (rendition_name, output_path) in zip(st.tabs(list(rendered_outputs)), rendered_outputs.items()):
+                with tab:
+                    show_rendered_video(output_path)
+                    download_rendered_video(output_path, key=f"download_rendered_{rendition_name}")
+            if st.button("一時出力ファイルを削除"):
+                for output_path in set(rendered_outputs.values()):
+                    storage_manager.discard_output(output_path)
+                st.session_state.temp_output_video = None
+                st.session_state.rendered_outputs = {}
+                st.rerun()
+
 
+# ストレージ使用量
+with st.sidebar.expander("ストレージ使用量"):
+    usage = storage_manager.get_usage()
+    st.caption(f"ディスク空き容量: {format_bytes(usage['disk']['free'])} / {format_bytes(usage['disk']['total'])}")
+    # st.dataframeはpyarrow（とNumPy）を読み込み初回表示が遅くなるため、Markdownの表で表示する
+    rows = [
+        f"| {name} | {format_bytes(area['bytes'])} | {format_bytes(area['max_bytes']) if area['max_bytes'] else '-'} | {area['entries']} |"
+        for name, area in usage["areas"].items()
+    ]
+    st.markdown("\n".join(["| 領域 | 使用量 | 上限 | 件数 |", "| --- | ---: | ---: | ---: |"] + rows))
+    if st.button("今すぐ整理", key="enforce_storage_quotas"):
+        freed = storage_manager.enforce_quotas()
+        st.toast(f"{format_bytes(freed)} を削除しました。")
 
 # 注意事項/ヒント
 st.sidebar.markdown("""
 ---
 **ヒント:**
-- `ImageMagick` は `MoviePy` の `TextClip` に必要です。インストールされていない場合は、[ImageMagick公式サイト](https://imagemagick.org/script/download.php) からダウンロードしてください。
-  - macOS (Homebrew): `brew install imagemagick`
-  - Windows (winget): `winget install ImageMagick.ImageMagick`
+- テロップはPillowで描画されるため、`ImageMagick` のインストールは不要です。描画済みのテロップは `./cache/captions` に再利用のため保存されます。
 - Google FontsのダウンロードURLは、API経由での取得が理想的ですが、現在簡易実装のため一部ハードコードされています。
-- 大容量動画の`Gemini File API`からのダウンロードは、レンダリング時に一時的に行われます。\n""")
+- アップロードされた動画はチャンク単位で `./sources` に保存され、レンダリングにはそのファイルが使われます。
+- キャッシュ・アップロード動画・レンダリング結果は領域ごとの容量上限と保持期間に従って、古いものから自動的に削除されます。\n""")
@@ -0,0 +1,279 @@
+"""
+レンダリングのベンチマーク
+
+ffmpegのlavfi（testsrc2 + sine）で合成した動画をローカルに生成し、解像度・長さ・クリップ数の組み合わせごとに
+video_editor.render_video を実行します。各ケースは新しいプロセスで実行し、以下を計測してJSONに保存します。
+  - wall_seconds / fps: レンダリングの所要時間と、出力フレーム数あたりの処理速度
+  - peak_rss_mb: Pythonプロセスとffmpeg子プロセスそれぞれの最大常駐メモリ
+  - output_bytes: 出力ファイルのサイズ
+あわせて、日本語テロップ (create_text_clip) の描画時間と、アップロード経路 (source_store.ingest_upload) の転送速度も計測します。
+ネットワークには接続しないため、オフラインのLinux環境で実行できます。
+
+使い方:
+  python benchmarks/render_benchmark.py --output render.json
+  python benchmarks/render_benchmark.py --quick --compare render.json   # 前回の結果と比較し、退行していれば終了コード1
+"""
+import argparse
+import itertools
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+# 合成動画の保存先（同じ条件の動画は再生成しない）
+SYNTHETIC_VIDEO_DIR = os.path.join(REPO_ROOT, "cache", "bench")
+SYNTHETIC_FPS = 30
+
+RESOLUTIONS = {"360p": (640, 360), "720p": (1280, 720), "1080p": (1920, 1080)}
+DEFAULT_MATRIX = {"resolution": ["360p", "720p", "1080p"], "duration": [10, 30], "clips": [1, 4], "smart_render": [False]}
+QUICK_MATRIX = {"resolution": ["360p"], "duration": [6], "clips": [2], "smart_render": [False, True]}
+
+CAPTION_TEXT = "ベンチマーク用テロップ {index}：日本語の折り返しと描画を確認します"
+
+def _git_commit() -> str or None:
+    proc = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT, capture_output=True, text=True)
+    return proc.stdout.strip() if proc.returncode == 0 else None
+
+def generate_synthetic_video(resolution: str, duration: float) -> str:
+    """
+    テストパターンと正弦波音声からなる合成動画を生成し、パスを返します。
+    """
+    from modules import ffmpeg_tools
+
+    width, height = RESOLUTIONS[resolution]
+    path = os.path.join(SYNTHETIC_VIDEO_DIR, f"synthetic_{resolution}_{duration}s.mp4")
+    if os.path.exists(path):
+        return path
+    os.makedirs(SYNTHETIC_VIDEO_DIR, exist_ok=True)
+    temp_path = f"{path}.{os.getpid()}.tmp.mp4"
+    ffmpeg_tools.run_ffmpeg([
+        "-y",
+        "-f", "lavfi", "-i", f"testsrc2=size={width}x{height}:rate={SYNTHETIC_FPS}:duration={duration}",
+        "-f", "lavfi", "-i", f"sine=frequency=440:sample_rate=44100:duration={duration}",
+        "-c:v", "libx264", "-preset", "veryfast", "-g", str(SYNTHETIC_FPS * 2), "-pix_fmt", "yuv420p",
+        "-c:a", "aac", "-shortest", temp_path,
+    ])
+    os.replace(temp_path, path)
+    return path
+
+def find_japanese_font() -> str or None:
+    """
+    バンドル済み・アップロード済みのフォントから日本語対応のものを1つ選びます。見つからない場合はNoneを返します。
+    """
+    from modules import font_manager
+
+    fonts = font_manager.get_font_registry()["fonts"]
+    japanese = sorted(path for path, info in fonts.items() if info["supports_japanese"])
+    if japanese:
+        return os.path.abspath(japanese[0])
+    return os.path.abspath(sorted(fonts)[0]) if fonts else None
+
+def build_clips(duration: float, clip_count: int, font_path: str or None, width: int) -> list:
+    """
+    動画全体を均等に分割し、各クリップに日本語テロップを付けた編集データを作成します。
+    """
+    clip_length = duration / clip_count
+    clips = []
+    for index in range(clip_count):
+        start = index * clip_length
+        clips.append({
+            "start_time": round(start, 3),
+            "end_time": round(min(duration, start + clip_length * 0.8), 3),
+            "text_params": {
+                "text": CAPTION_TEXT.format(index=index + 1),
+                "font_path": font_path,
+                "font_size": max(16, width // 30),
+                "font_color": "#FFFFFF",
+                "text_position": ("center", "bottom"),
+                "bg_color": "#000000",
+            },
+        })
+    return clips
+
+def run_case(case: dict) -> dict:
+    """
+    1つのケースを現在のプロセスで実行します（--run-case から呼び出され、親プロセスが結果を集計します）。
+    キャッシュの影響を受けないよう、一時ディレクトリを作業ディレクトリにして実行します。
+    """
+    from modules import video_editor
+
+    width, height = RESOLUTIONS[case["resolution"]]
+    video_path = generate_synthetic_video(case["resolution"], case["duration"])
+    clips = build_clips(case["duration"], case["clips"], case["font_path"], width)
+
+    work_dir = tempfile.mkdtemp(prefix="quickclip-bench-")
+    cwd = os.getcwd()
+    os.chdir(work_dir)
+    try:
+        start = time.perf_counter()
+        output_path = video_editor.render_video(video_path, clips, "bench_output.mp4", smart_render=case["smart_render"], workers=1)
+        wall = time.perf_counter() - start
+        output_bytes = os.path.getsize(output_path) if output_path and os.path.exists(output_path) else None
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    frames = sum(round((c["end_time"] - c["start_time"]) * SYNTHETIC_FPS) for c in clips)
+    return {
+        "ok": bool(output_path),
+        "wall_seconds": wall,
+        "frames": frames,
+        "fps": frames / wall if wall > 0 else None,
+        # ru_maxrss はLinuxではKB単位
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "peak_child_rss_mb": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024,
+        "output_bytes": output_bytes,
+    }
+
+def run_caption_benchmark(font_path: str or None, iterations: int = 50) -> dict:
+    """
+    create_text_clip の描画時間を、キャッシュなし（初回）とキャッシュあり（2回目以降）に分けて計測します。
+    """
+    from modules import caption_renderer, video_editor
+
+    work_dir = tempfile.mkdtemp(prefix="quickclip-bench-")
+    original_cache_dir = caption_renderer.CAPTION_CACHE_DIR
+    caption_renderer.CAPTION_CACHE_DIR = os.path.join(work_dir, "captions")
+    try:
+        texts = [CAPTION_TEXT.format(index=i) for i in range(iterations)]
+        start = time.perf_counter()
+        for text in texts:
+            video_editor.create_text_clip(text, font_path, 48, "#FFFFFF", ("center", "bottom"), "#000000", duration=1, max_width=1200)
+        cold = (time.perf_counter() - start) / iterations
+        start = time.perf_counter()
+        for text in texts:
+            video_editor.create_text_clip(text, font_path, 48, "#FFFFFF", ("center", "bottom"), "#000000", duration=1, max_width=1200)
+        warm = (time.perf_counter() - start) / iterations
+    finally:
+        caption_renderer.CAPTION_CACHE_DIR = original_cache_dir
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return {"cold_ms": cold * 1000, "warm_ms": warm * 1000, "iterations": iterations}
+
+def run_upload_benchmark(video_path: str) -> dict:
+    """
+    アップロードされたファイルをソースストアに取り込む経路（チャンクコピー + SHA-256）の転送速度を計測します。
+    """
+    from modules import source_store
+
+    work_dir = tempfile.mkdtemp(prefix="quickclip-bench-")
+    original_source_dir = source_store.SOURCE_DIR
+    source_store.SOURCE_DIR = os.path.join(work_dir, "sources")
+    try:
+        size = os.path.getsize(video_path)
+        with open(video_path, "rb") as uploaded_file:
+            start = time.perf_counter()
+            source_store.ingest_upload(uploaded_file)
+            wall = time.perf_counter() - start
+    finally:
+        source_store.SOURCE_DIR = original_source_dir
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return {"bytes": size, "wall_seconds": wall, "mb_per_second": size / (1024 * 1024) / wall if wall > 0 else None}
+
+def _case_name(case: dict) -> str:
+    return f"{case['resolution']}-{case['duration']}s-{case['clips']}clips{'-smart' if case['smart_render'] else ''}"
+
+def run_benchmark(matrix: dict) -> dict:
+    """
+    マトリクスの全ケースを個別のプロセスで実行し、結果をまとめます。
+    """
+    font_path = find_japanese_font()
+    cases = [dict(zip(matrix, values), font_path=font_path) for values in itertools.product(*matrix.values())]
+    results = {}
+    for case in cases:
+        name = _case_name(case)
+        generate_synthetic_video(case["resolution"], case["duration"]) # 動画の生成時間を計測に含めない
+        proc = subprocess.run([sys.executable, os.path.abspath(__file__), "--run-case", json.dumps(case)], capture_output=True, text=True)
+        if proc.returncode != 0:
+            results[name] = {"ok": False, "error": proc.stderr[-2000:]}
+        else:
+            results[name] = dict(json.loads(proc.stdout.strip().splitlines()[-1]), case={k: v for k, v in case.items() if k != "font_path"})
+        summary = results[name]
+        if summary.get("ok"):
+            print(f"{name:28s} {summary['wall_seconds']:7.2f} s  {summary['fps']:7.1f} fps  RSS {summary['peak_rss_mb']:7.1f} MB  ffmpeg {summary['peak_child_rss_mb']:7.1f} MB  {summary['output_bytes'] / 1024:9.0f} KB")
+        else:
+            print(f"{name:28s} FAILED")
+
+    upload_source = generate_synthetic_video(matrix["resolution"][-1], max(matrix["duration"]))
+    return {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": sys.version.split()[0],
+        "commit": _git_commit(),
+        "font": os.path.basename(font_path) if font_path else None,
+        "cases": results,
+        "caption": run_caption_benchmark(font_path),
+        "upload": run_upload_benchmark(upload_source),
+    }
+
+def compare(baseline: dict, current: dict, tolerance: float) -> list:
+    """
+    前回の結果と比較し、退行の内容をリストで返します。
+    共通するケースについて、所要時間・最大メモリがtolerance（割合）を超えて増えた場合を退行とみなします。
+    """
+    regressions = []
+    for name, after in current["cases"].items():
+        before = baseline.get("cases", {}).get(name)
+        if not before or not before.get("ok"):
+            continue
+        if not after.get("ok"):
+            regressions.append(f"{name} が失敗しました")
+            continue
+        for metric in ("wall_seconds", "peak_rss_mb", "peak_child_rss_mb"):
+            change = (after[metric] - before[metric]) / before[metric] if before[metric] else 0.0
+            print(f"{name:28s} {metric:18s} {before[metric]:9.2f} -> {after[metric]:9.2f} ({change:+.1%})")
+            if change > tolerance:
+                regressions.append(f"{name} の {metric} が {change:.1%} 増えました")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="QuickClip Pro のレンダリングベンチマーク")
+    parser.add_argument("--quick", action="store_true", help="小さなマトリクスで短時間だけ実行する")
+    parser.add_argument("--resolutions", nargs="+", choices=sorted(RESOLUTIONS), help="計測する解像度")
+    parser.add_argument("--durations", nargs="+", type=float, help="合成動画の長さ（秒）")
+    parser.add_argument("--clips", nargs="+", type=int, help="クリップ数")
+    parser.add_argument("--smart-render", action="store_true", help="スマートレンダリングのケースも計測する")
+    parser.add_argument("--output", help="結果を保存するJSONファイル")
+    parser.add_argument("--compare", help="比較対象となる前回の結果（JSON）")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="退行とみなす増加の割合 (既定: 0.15 = 15%%)")
+    parser.add_argument("--run-case", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_case:
+        print(json.dumps(run_case(json.loads(args.run_case))))
+        return
+
+    matrix = dict(QUICK_MATRIX if args.quick else DEFAULT_MATRIX)
+    if args.resolutions:
+        matrix["resolution"] = args.resolutions
+    if args.durations:
+        matrix["duration"] = [int(d) if float(d).is_integer() else d for d in args.durations]
+    if args.clips:
+        matrix["clips"] = args.clips
+    if args.smart_render:
+        matrix["smart_render"] = [False, True]
+
+    result = run_benchmark(matrix)
+    print(f"caption     : {result['caption']['cold_ms']:.2f} ms (cold) / {result['caption']['warm_ms']:.2f} ms (cached)")
+    print(f"upload      : {result['upload']['mb_per_second']:.1f} MB/s")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(baseline, result, args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION: {regression}")
+        if regressions:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+"""
+コールドスタート時間のベンチマーク
+
+新しいPythonプロセスで以下を計測し、結果をJSONに保存します。
+  - import: app.py が読み込むモジュール (modules.*) のインポート時間
+  - first_paint: AppTest で app.py を初回実行し、最初の画面が組み立てられるまでの時間
+  - heavy_modules: 初回実行の時点で読み込まれてしまった重いモジュール（遅延読み込みの退行検出用）
+
+使い方:
+  python benchmarks/startup_benchmark.py --output startup.json
+  python benchmarks/startup_benchmark.py --compare startup.json   # 前回の結果と比較し、退行していれば終了コード1
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 初回表示の時点で読み込まれていてはいけない重いモジュール
+HEAVY_MODULES = ["moviepy.editor", "google.generativeai", "numpy", "proglog"]
+
+# 子プロセスで実行する計測コード（インポートやモジュールキャッシュの影響を受けないよう毎回新しいプロセスで実行する）
+_IMPORT_PROBE = """
+import json, sys, time
+start = time.perf_counter()
+from modules import video_analyzer, font_manager, video_editor, render_jobs
+elapsed = time.perf_counter() - start
+print(json.dumps({"seconds": elapsed, "heavy_modules": [m for m in %r if m in sys.modules]}))
+"""
+
+_FIRST_PAINT_PROBE = """
+import json, sys, time
+start = time.perf_counter()
+from streamlit.testing.v1 import AppTest
+app = AppTest.from_file("app.py", default_timeout=120)
+app.run()
+elapsed = time.perf_counter() - start
+print(json.dumps({
+    "seconds": elapsed,
+    "exceptions": [str(e.value) for e in app.exception],
+    "heavy_modules": [m for m in %r if m in sys.modules],
+}))
+"""
+
+def _run_probe(code: str) -> dict:
+    """
+    計測コードを新しいプロセスで実行し、最後に出力されたJSONを返します。
+    """
+    env = dict(os.environ, GEMINI_API_KEY=os.environ.get("GEMINI_API_KEY", "benchmark-dummy-key"), PYTHONDONTWRITEBYTECODE="1")
+    proc = subprocess.run([sys.executable, "-c", code], cwd=REPO_ROOT, env=env, capture_output=True, text=True)
+    if proc.returncode != 0:
+        raise RuntimeError(f"計測に失敗しました:\n{proc.stderr[-2000:]}")
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+def _summarize(samples: list) -> dict:
+    return {
+        "median": statistics.median(samples),
+        "min": min(samples),
+        "max": max(samples),
+        "samples": samples,
+    }
+
+def run_benchmark(repeat: int) -> dict:
+    """
+    インポート時間と初回表示時間をそれぞれrepeat回計測します。
+    """
+    import_runs = [_run_probe(_IMPORT_PROBE % HEAVY_MODULES) for _ in range(repeat)]
+    paint_runs = [_run_probe(_FIRST_PAINT_PROBE % HEAVY_MODULES) for _ in range(repeat)]
+    return {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": sys.version.split()[0],
+        "commit": _git_commit(),
+        "import": _summarize([run["seconds"] for run in import_runs]),
+        "first_paint": _summarize([run["seconds"] for run in paint_runs]),
+        "heavy_modules": sorted({m for run in import_runs + paint_runs for m in run["heavy_modules"]}),
+        "exceptions": sorted({e for run in paint_runs for e in run["exceptions"]}),
+    }
+
+def _git_commit() -> str or None:
+    proc = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT, capture_output=True, text=True)
+    return proc.stdout.strip() if proc.returncode == 0 else None
+
+def compare(baseline: dict, current: dict, tolerance: float) -> list:
+    """
+    前回の結果と比較し、退行の内容をリストで返します。中央値がtolerance（割合）を超えて遅くなった場合を退行とみなします。
+    """
+    regressions = []
+    for metric in ("import", "first_paint"):
+        before, after = baseline[metric]["median"], current[metric]["median"]
+        change = (after - before) / before if before else 0.0
+        print(f"{metric:12s} {before * 1000:8.1f} ms -> {after * 1000:8.1f} ms ({change:+.1%})")
+        if change > tolerance:
+            regressions.append(f"{metric} が {change:.1%} 遅くなりました")
+    new_heavy = sorted(set(current["heavy_modules"]) - set(baseline.get("heavy_modules", [])))
+    if new_heavy:
+        regressions.append(f"起動時に重いモジュールが読み込まれています: {', '.join(new_heavy)}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="QuickClip Pro の起動時間ベンチマーク")
+    parser.add_argument("--repeat", type=int, default=5, help="計測の繰り返し回数")
+    parser.add_argument("--output", help="結果を保存するJSONファイル")
+    parser.add_argument("--compare", help="比較対象となる前回の結果（JSON）")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="退行とみなす遅延の割合 (既定: 0.2 = 20%%)")
+    args = parser.parse_args()
+
+    result = run_benchmark(args.repeat)
+    print(f"import      : {result['import']['median'] * 1000:.1f} ms (median of {args.repeat})")
+    print(f"first paint : {result['first_paint']['median'] * 1000:.1f} ms (median of {args.repeat})")
+    if result["heavy_modules"]:
+        print(f"heavy modules loaded at startup: {', '.join(result['heavy_modules'])}")
+    if result["exceptions"]:
+        print(f"exceptions during first run: {result['exceptions']}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(baseline, result, args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION: {regression}")
+        if regressions:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
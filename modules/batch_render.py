@@ -0,0 +1,253 @@
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+
+from modules import caption_renderer, source_store, video_editor
+
+# Streamlitを使わずに、マニフェスト（編集リスト）から複数のプロジェクトをまとめてレンダリングするコマンドラインツール
+#
+# 使い方:
+#   python -m modules.batch_render projects/*.json --jobs 2 --output-dir ./renders --report report.json
+#
+# マニフェストは1プロジェクトを表すJSONオブジェクト、またはその配列です。clipsはapp.pyの clips_to_render と同じ形式です。
+#   {
+#     "source": "videos/input.mp4",
+#     "output": "input_edited.mp4",          # 省略時は rendered_<ソース名>.mp4
+#     "profile": "final",                     # 省略時は --profile の値
+#     "smart_render": false,
+#     "engine": "ffmpeg",                     # 省略時は --engine の値
+#     "subtitle_mode": "burn",                # ffmpegエンジンのテロップの出力方法 (burn / soft)
+#     "renditions": ["landscape", "vertical"], # 複数の出力形式を1回のデコードで書き出す（ffmpegエンジン、出力名に形式名が付く）
+#     "clips": [
+#       {"start_time": 0.0, "end_time": 4.5, "text_params": {"text": "テロップ", "font_path": "Noto Sans JP", "font_size": 48,
+#        "font_color": "#FFFFFF", "text_position": ["center", "bottom"], "bg_color": null}}
+#     ]
+#   }
+# font_pathにはフォントファイルのパスのほか、フォント管理の表示名（例: "Noto Sans JP"）も指定できます。
+# sourceと相対パスのfont_pathは、マニフェストファイルのあるディレクトリを基準に解決します。
+
+# 表示名ではなくフォントファイルのパスとして扱うfont_pathの拡張子
+FONT_FILE_EXTENSIONS = (".ttf", ".otf", ".ttc")
+
+class _SourcePool:
+    """
+    ジョブ間で開いたソース動画 (VideoFileClip) を再利用するためのプールです。
+    MoviePyのリーダーはスレッドセーフではないため、1つのクリップは同時に1つのジョブだけが使います。
+    """
+
+    def __init__(self):
+        self._idle: Dict[str, List] = {}
+        self._opened = []
+        self._lock = threading.Lock()
+
+    def acquire(self, video_path: str):
+        with self._lock:
+            idle = self._idle.get(video_path)
+            if idle:
+                return idle.pop()
+        from moviepy.editor import VideoFileClip
+        clip = VideoFileClip(video_path, audio=True, video=True)
+        with self._lock:
+            self._opened.append(clip)
+        return clip
+
+    def release(self, video_path: str, clip):
+        with self._lock:
+            self._idle.setdefault(video_path, []).append(clip)
+
+    def close(self):
+        with self._lock:
+            for clip in self._opened:
+                clip.close()
+            self._opened.clear()
+            self._idle.clear()
+
+def load_manifests(manifest_paths: List[str]) -> List[Dict]:
+    """
+    マニフェストファイルを読み込み、プロジェクトのリストを返します。
+    ソースとフォントファイルのパスはマニフェストファイルからの相対パスとして解決します。
+    """
+    projects = []
+    for manifest_path in manifest_paths:
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        entries = data if isinstance(data, list) else [data]
+        base_dir = os.path.dirname(os.path.abspath(manifest_path))
+        for index, entry in enumerate(entries):
+            source = entry.get("source") or entry.get("video_path")
+            if not source or not isinstance(entry.get("clips"), list):
+                raise ValueError(f"{manifest_path} の {index + 1} 件目に source または clips がありません。")
+            source = source if os.path.isabs(source) else os.path.join(base_dir, source)
+            try:
+                # 出力形式の設定はレンダリングを始める前に検証する
+                renditions = [video_editor.get_rendition(r, i) for i, r in enumerate(entry.get("renditions") or [])] or None
+            except ValueError as e:
+                raise ValueError(f"{manifest_path} の {index + 1} 件目: {e}") from e
+            for clip in entry["clips"]:
+                text_params = clip.get("text_params") or {}
+                font_path = text_params.get("font_path")
+                if (font_path and not os.path.isabs(font_path)
+                        and (os.path.splitext(font_path)[1].lower() in FONT_FILE_EXTENSIONS or "/" in font_path or os.sep in font_path)):
+                    text_params["font_path"] = os.path.normpath(os.path.join(base_dir, font_path))
+            projects.append({
+                "manifest": manifest_path,
+                "index": index,
+                "source": os.path.normpath(source),
+                "output": entry.get("output") or f"rendered_{os.path.splitext(os.path.basename(source))[0]}.mp4",
+                "profile": entry.get("profile"),
+                "smart_render": bool(entry.get("smart_render", False)),
+                "engine": entry.get("engine"),
+                "subtitle_mode": entry.get("subtitle_mode", "burn"),
+                "renditions": renditions,
+                "clips": entry["clips"],
+            })
+    return projects
+
+def _resolve_fonts(projects: List[Dict]):
+    """
+    表示名で指定されたフォントをパスに置き換え、使われるフォントを事前に一度だけ読み込みます。
+    読み込んだフォントはcaption_rendererのキャッシュに残るため、全ジョブで共有されます。
+    """
+    registry = None
+    used_fonts = set()
+    for project in projects:
+        for clip in project["clips"]:
+            text_params = clip.get("text_params") or {}
+            font_path = text_params.get("font_path")
+            if font_path and not os.path.exists(font_path):
+                if registry is None:
+                    from modules import font_manager
+                    registry = font_manager.get_font_registry()
+                text_params["font_path"] = registry["by_display_name"].get(font_path)
+                if text_params["font_path"] is None:
+                    print(f"フォント '{font_path}' が見つかりません。既定のフォントを使用します。", file=sys.stderr)
+            if isinstance(text_params.get("text_position"), list):
+                text_params["text_position"] = tuple(text_params["text_position"])
+            if text_params.get("text"):
+                used_fonts.add((text_params.get("font_path"), int(text_params.get("font_size", 50))))
+    for font_path, font_size in used_fonts:
+        caption_renderer.load_font(font_path, font_size)
+
+def _hash_sources(projects: List[Dict]) -> Dict[str, str]:
+    """
+    各ソースのコンテンツハッシュを一度だけ計算します。セグメントキャッシュのキーとしてジョブ間で共有されます。
+    """
+    hashes = {}
+    for source in sorted({project["source"] for project in projects}):
+        if os.path.exists(source):
+            hashes[source] = source_store.hash_file(source)
+    return hashes
+
+def _render_project(project: Dict, output_dir: str, default_profile: str, default_engine: str, source_pool: _SourcePool, content_hash: str or None) -> Dict:
+    """
+    1つのプロジェクトをレンダリングし、レポート用の結果を返します。
+    """
+    result = {
+        "manifest": project["manifest"],
+        "index": project["index"],
+        "source": project["source"],
+        "clips": len(project["clips"]),
+        "profile": project["profile"] or default_profile,
+        "engine": "ffmpeg" if project["renditions"] else project["engine"] or default_engine,
+    }
+    if not os.path.exists(project["source"]):
+        return dict(result, status="failed", error="ソース動画が見つかりません。", seconds=0.0)
+
+    output_filename = os.path.join(output_dir, project["output"])
+    start = time.perf_counter()
+    # ffmpegエンジンはソースを直接読むため、MoviePyのクリップを開かない
+    clip = source_pool.acquire(project["source"]) if result["engine"] != "ffmpeg" else None
+    try:
+        if project["renditions"]:
+            output_paths = video_editor.render_renditions(
+                project["source"], project["clips"], project["renditions"], output_filename,
+                profile=result["profile"], subtitle_mode=project["subtitle_mode"], content_hash=content_hash
+            ) or {}
+        else:
+            output_path = video_editor.render_video(
+                project["source"], project["clips"], output_filename,
+                smart_render=project["smart_render"], content_hash=content_hash,
+                profile=result["profile"], source_clip=clip,
+                engine=result["engine"], subtitle_mode=project["subtitle_mode"]
+            )
+            output_paths = {"original": output_path} if output_path else {}
+    except Exception as e:
+        output_paths = {}
+        result["error"] = str(e)
+    finally:
+        if clip is not None:
+            source_pool.release(project["source"], clip)
+    result["seconds"] = round(time.perf_counter() - start, 3)
+
+    if output_paths and all(os.path.exists(path) for path in output_paths.values()):
+        result.update(status="completed", output_bytes=sum(os.path.getsize(path) for path in output_paths.values()))
+        if project["renditions"]:
+            result["outputs"] = {name: os.path.abspath(path) for name, path in output_paths.items()}
+        else:
+            result["output"] = os.path.abspath(output_paths["original"])
+    else:
+        result.update(status="failed")
+        result.setdefault("error", "レンダリングに失敗しました。詳細はログを確認してください。")
+    return result
+
+def run_batch(manifest_paths: List[str], jobs: int = 1, output_dir: str = ".", profile: str = None, use_cache: bool = True, engine: str = None) -> Dict:
+    """
+    マニフェストの全プロジェクトを最大jobs件ずつ並行してレンダリングし、レポートを返します。
+    """
+    projects = load_manifests(manifest_paths)
+    default_profile = profile or video_editor.DEFAULT_ENCODER_PROFILE
+    default_engine = engine or video_editor.DEFAULT_RENDER_ENGINE
+    os.makedirs(output_dir, exist_ok=True)
+    _resolve_fonts(projects)
+    hashes = _hash_sources(projects) if use_cache else {}
+
+    source_pool = _SourcePool()
+    started_at = time.time()
+    start = time.perf_counter()
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, jobs), thread_name_prefix="batch-render") as executor:
+            futures = [
+                executor.submit(_render_project, project, output_dir, default_profile, default_engine, source_pool, hashes.get(project["source"]))
+                for project in projects
+            ]
+            results = [future.result() for future in futures]
+    finally:
+        source_pool.close()
+
+    completed = [r for r in results if r["status"] == "completed"]
+    return {
+        "started_at": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(started_at)),
+        "wall_seconds": round(time.perf_counter() - start, 3),
+        "jobs": jobs,
+        "projects": len(results),
+        "completed": len(completed),
+        "failed": len(results) - len(completed),
+        "output_bytes": sum(r["output_bytes"] for r in completed),
+        "results": results,
+    }
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m modules.batch_render", description="マニフェストから複数の動画をまとめてレンダリングします。")
+    parser.add_argument("manifests", nargs="+", help="マニフェスト (JSON) のパス")
+    parser.add_argument("--jobs", "-j", type=int, default=int(os.environ.get("BATCH_RENDER_JOBS", "1")), help="同時にレンダリングするプロジェクト数")
+    parser.add_argument("--output-dir", "-o", default=".", help="出力先ディレクトリ")
+    parser.add_argument("--profile", choices=list(video_editor.ENCODER_PROFILES), help="マニフェストで指定がない場合のエンコードプロファイル")
+    parser.add_argument("--engine", choices=list(video_editor.RENDER_ENGINES), help="マニフェストで指定がない場合のレンダリングエンジン")
+    parser.add_argument("--report", help="結果レポート (JSON) の出力先。省略時は出力先ディレクトリの batch_report.json")
+    parser.add_argument("--no-cache", action="store_true", help="セグメントキャッシュを使わない")
+    args = parser.parse_args(argv)
+
+    report = run_batch(args.manifests, jobs=args.jobs, output_dir=args.output_dir, profile=args.profile, use_cache=not args.no_cache, engine=args.engine)
+    report_path = args.report or os.path.join(args.output_dir, "batch_report.json")
+    with open(report_path, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"{report['completed']} / {report['projects']} 件のレンダリングが完了しました ({report['wall_seconds']} 秒)。レポート: {report_path}")
+    return 0 if report["failed"] == 0 else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,191 @@
+import hashlib
+import json
+import os
+from functools import lru_cache
+from typing import List, TYPE_CHECKING
+
+from PIL import Image, ImageColor, ImageDraw, ImageFont
+
+from modules import storage_manager
+
+if TYPE_CHECKING:
+    import numpy as np
+
+# Pillowによるテロップ画像のラスタライズ
+# ImageMagickを呼び出さずにプロセス内で日本語テロップを描画し、結果をディスクにキャッシュします。
+
+CAPTION_CACHE_DIR = storage_manager.area_path("captions")
+# 描画ロジックを変更した場合はこの値を上げ、古いキャッシュを無効にする
+CAPTION_CACHE_VERSION = 1
+
+# 行頭に来てはいけない文字（禁則処理）
+_NO_LINE_START_CHARS = set("、。，．,.!?！？」』）)】〉》ー～ぁぃぅぇぉっゃゅょゎァィゥェォッャュョヮヵヶ・：；:;")
+
+@lru_cache(maxsize=64)
+def load_font(font_path: str, font_size: int):
+    """
+    フォントを読み込みます。同じフォント・サイズの組み合わせはプロセス内で再利用されます。
+    """
+    if font_path and os.path.exists(font_path):
+        return ImageFont.truetype(font_path, font_size)
+    return ImageFont.load_default(size=font_size)
+
+def wrap_text(text: str, font, max_width: int = None) -> List[str]:
+    """
+    テキストを1文字単位で折り返します。日本語は単語間に空白がないため、文字単位で幅を測って改行します。
+    ASS字幕の書き出し (subtitles) でも使い、焼き込みのテロップと同じ位置で改行します。
+    """
+    lines = []
+    for paragraph in text.split("\n"):
+        if not max_width:
+            lines.append(paragraph)
+            continue
+        line = ""
+        for char in paragraph:
+            candidate = line + char
+            if line and font.getlength(candidate) > max_width and char not in _NO_LINE_START_CHARS:
+                # 英単語の途中では改行しないよう、空白があればそこで折り返す
+                head, space, tail = line.rpartition(" ")
+                if space and head and char != " ":
+                    lines.append(head)
+                    line = tail + char
+                else:
+                    lines.append(line.rstrip())
+                    line = char.lstrip()
+            else:
+                line = candidate
+        lines.append(line)
+    return lines
+
+def render_caption_image(text: str, font_path: str, font_size: int, font_color: str, bg_color: str = None, max_width: int = None) -> Image.Image:
+    """
+    テロップをRGBA画像として描画します。bg_colorが指定された場合はテキストの背後を塗りつぶします。
+    """
+    font = load_font(font_path, int(font_size))
+    padding = max(2, int(font_size * 0.2))
+    lines = wrap_text(text, font, max_width - 2 * padding if max_width else None)
+
+    ascent, descent = font.getmetrics()
+    line_height = ascent + descent
+    line_spacing = int(font_size * 0.15)
+    line_widths = [int(font.getlength(line)) for line in lines]
+    width = max(line_widths + [1]) + 2 * padding
+    height = line_height * len(lines) + line_spacing * (len(lines) - 1) + 2 * padding
+
+    fill = ImageColor.getrgb(bg_color) if bg_color else (0, 0, 0, 0)
+    image = Image.new("RGBA", (width, height), fill)
+    draw = ImageDraw.Draw(image)
+    color = ImageColor.getrgb(font_color)
+    y = padding
+    for line, line_width in zip(lines, line_widths):
+        draw.text(((width - line_width) // 2, y), line, font=font, fill=color)
+        y += line_height + line_spacing
+    return image
+
+def _caption_cache_key(text: str, font_path: str, font_size: int, font_color: str, bg_color: str, max_width: int) -> str:
+    """
+    テロップのパラメータとフォントファイルの状態からキャッシュキーを生成します。
+    """
+    font_stat = None
+    if font_path and os.path.exists(font_path):
+        stat = os.stat(font_path)
+        font_stat = [stat.st_size, stat.st_mtime_ns]
+    payload = json.dumps(
+        [CAPTION_CACHE_VERSION, text, font_path, font_stat, int(font_size), font_color, bg_color, max_width],
+        ensure_ascii=False
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def get_caption_image(text: str, font_path: str, font_size: int, font_color: str, bg_color: str = None, max_width: int = None) -> Image.Image:
+    """
+    キャッシュを利用してテロップ画像を取得します。
+    同じパラメータのテロップは再描画せず、ディスク上のPNGを読み込みます。
+    """
+    key = _caption_cache_key(text, font_path, font_size, font_color, bg_color, max_width)
+    cache_path = os.path.join(CAPTION_CACHE_DIR, key[:2], f"{key}.png")
+    if os.path.exists(cache_path):
+        try:
+            with Image.open(cache_path) as cached:
+                return cached.convert("RGBA")
+        except OSError:
+            pass # 壊れたキャッシュは描画し直す
+
+    image = render_caption_image(text, font_path, font_size, font_color, bg_color, max_width)
+    try:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        temp_path = f"{cache_path}.{os.getpid()}.tmp"
+        image.save(temp_path, format="PNG")
+        os.replace(temp_path, cache_path)
+    except OSError as e:
+        print(f"テロップ画像のキャッシュ保存に失敗しました: {e}")
+    return image
+
+def resolve_position(position, frame_size: int, size: int) -> int:
+    """
+    MoviePyのset_positionと同じ表記（'left'/'center'/'bottom'等、0〜1の割合、ピクセル値）を座標に変換します。
+    """
+    if position in ("left", "top"):
+        return 0
+    if position == "center":
+        return (frame_size - size) // 2
+    if position in ("right", "bottom"):
+        return frame_size - size
+    if isinstance(position, float) and 0.0 <= position <= 1.0:
+        return int(position * frame_size)
+    return int(position)
+
+class CaptionOverlay:
+    """
+    テロップ画像をフレームの該当領域だけにアルファブレンドします。
+    乗算済みアルファとバウンディングボックスを一度だけ計算し、フレームごとの処理はNumPyのin-place演算のみで行います。
+    全画面のCompositeVideoClipに比べ、1フレームあたりの演算量とメモリ確保を大きく削減します。
+    """
+
+    def __init__(self, image: Image.Image, text_position, frame_size):
+        import numpy as np
+        rgba = np.asarray(image.convert("RGBA"))
+        frame_w, frame_h = frame_size
+        img_h, img_w = rgba.shape[:2]
+        x = resolve_position(text_position[0], frame_w, img_w)
+        y = resolve_position(text_position[1], frame_h, img_h)
+
+        # 完全に透明な余白を除いたバウンディングボックスを求める
+        rows = np.flatnonzero(rgba[:, :, 3].any(axis=1))
+        cols = np.flatnonzero(rgba[:, :, 3].any(axis=0))
+        if rows.size == 0:
+            self.region = None
+            return
+        top, bottom, left, right = rows[0], rows[-1] + 1, cols[0], cols[-1] + 1
+
+        # フレームからはみ出す部分を切り取る
+        x0, y0 = max(x + left, 0), max(y + top, 0)
+        x1, y1 = min(x + right, frame_w), min(y + bottom, frame_h)
+        if x0 >= x1 or y0 >= y1:
+            self.region = None
+            return
+        crop = rgba[y0 - y:y1 - y, x0 - x:x1 - x].astype(np.float32)
+
+        alpha = crop[:, :, 3:4] / 255.0
+        self.region = (slice(y0, y1), slice(x0, x1))
+        self._premultiplied = crop[:, :, :3] * alpha + 0.5 # +0.5 で切り捨てを四捨五入にする
+        self._inverse_alpha = 1.0 - alpha
+        self._blend_buffer = np.empty(self._premultiplied.shape, dtype=np.float32)
+        self._frame_buffer = None
+
+    def apply(self, frame: "np.ndarray") -> "np.ndarray":
+        """
+        フレームにテロップを合成して返します。
+        デコーダが返すフレームは読み取り専用かつ再利用されるため、事前確保したバッファにコピーしてから合成します。
+        返されるバッファは次の呼び出しで上書きされます。
+        """
+        import numpy as np
+        if self.region is None:
+            return frame
+        if self._frame_buffer is None or self._frame_buffer.shape != frame.shape:
+            self._frame_buffer = np.empty_like(frame)
+        np.copyto(self._frame_buffer, frame)
+        target = self._frame_buffer[self.region]
+        np.multiply(target, self._inverse_alpha, out=self._blend_buffer)
+        np.add(self._blend_buffer, self._premultiplied, out=self._blend_buffer)
+        np.copyto(target, self._blend_buffer, casting="unsafe")
+        return self._frame_buffer
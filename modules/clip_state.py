@@ -0,0 +1,84 @@
+import uuid
+from dataclasses import dataclass, field
+from typing import Dict, List, Tuple
+
+# 編集ワークスペースで扱うクリップの状態
+# session_stateには辞書ではなくClipStateのリストを保存します。idはウィジェットのキーに使うため、
+# クリップを削除・並べ替えても他のクリップの入力状態がずれません。
+
+# テロップ位置の選択肢（表示名 -> MoviePyのset_positionと同じ表記）
+TEXT_POSITION_OPTIONS = {
+    "下部中央": ("center", "bottom"),
+    "中央": ("center", "center"),
+    "上部中央": ("center", "top"),
+    "下部左": ("left", "bottom"),
+    "下部右": ("right", "bottom"),
+}
+
+def _new_clip_id() -> str:
+    return uuid.uuid4().hex[:8]
+
+@dataclass(slots=True)
+class ClipState:
+    """
+    1つの編集クリップの区間とテロップのスタイルです。
+    """
+    start_time: float
+    end_time: float
+    text: str = ""
+    font_path: str = None
+    font_size: int = 50
+    font_color: str = "#FFFFFF"
+    text_position: Tuple = ("center", "bottom")
+    bg_color: str = None
+    id: str = field(default_factory=_new_clip_id)
+
+    @property
+    def duration(self) -> float:
+        return max(0.0, float(self.end_time) - float(self.start_time))
+
+    @property
+    def text_position_label(self) -> str:
+        """
+        現在のテロップ位置に対応するTEXT_POSITION_OPTIONSの表示名を返します。該当しない場合は先頭の表示名を返します。
+        """
+        return next((label for label, value in TEXT_POSITION_OPTIONS.items() if value == tuple(self.text_position)), next(iter(TEXT_POSITION_OPTIONS)))
+
+    def to_render_dict(self) -> Dict:
+        """
+        video_editor.render_video が期待する形式 ({"start_time", "end_time", "text_params"}) に変換します。
+        """
+        return {
+            "start_time": self.start_time,
+            "end_time": self.end_time,
+            "text_params": {
+                "text": self.text,
+                "font_path": self.font_path,
+                "font_size": self.font_size,
+                "font_color": self.font_color,
+                "text_position": tuple(self.text_position),
+                "bg_color": self.bg_color,
+            },
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "ClipState":
+        """
+        以前のsession_stateで使っていた辞書形式のクリップからClipStateを作成します。
+        """
+        return cls(
+            start_time=float(data.get("start_time", 0)),
+            end_time=float(data.get("end_time", 0)),
+            text=data.get("text", ""),
+            font_path=data.get("font_path"),
+            font_size=int(data.get("font_size", 50)),
+            font_color=data.get("font_color", "#FFFFFF"),
+            text_position=tuple(data.get("text_position") or ("center", "bottom")),
+            bg_color=data.get("bg_color"),
+        )
+
+def to_render_list(clips: List[ClipState]) -> List[Dict]:
+    """
+    ClipStateのリストをvideo_editor.render_videoに渡すクリップデータのリストに変換します。
+    """
+    return [clip.to_render_dict() for clip in clips]
@@ -0,0 +1,140 @@
+import json
+import os
+import shutil
+import threading
+import time
+from typing import Dict
+
+from modules import storage_manager
+
+class DiskCache:
+    """
+    キーごとに1ファイルを保存するシンプルなディスクキャッシュです。
+    ファイルの更新時刻を最終アクセス時刻として扱い、TTLを過ぎたエントリと、
+    合計サイズが上限を超えた分の古いエントリ（LRU）を削除します。storage_manager.pin で使用中のエントリは削除しません。
+    """
+
+    def __init__(self, directory: str, max_bytes: int = None, ttl: float = None, suffix: str = ".json"):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.suffix = suffix
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+    def path_for(self, key: str) -> str:
+        """
+        キーに対応するキャッシュファイルのパスを返します（存在するとは限りません）。
+        """
+        return os.path.join(self.directory, key[:2], f"{key}{self.suffix}")
+
+    def _is_expired(self, path: str) -> bool:
+        return bool(self.ttl) and time.time() - os.path.getmtime(path) > self.ttl
+
+    def get_path(self, key: str) -> str or None:
+        """
+        有効なキャッシュファイルのパスを返し、アクセス時刻を更新します。存在しない場合はNoneを返します。
+        """
+        path = self.path_for(key)
+        try:
+            if self._is_expired(path):
+                os.remove(path)
+                raise FileNotFoundError(path)
+            os.utime(path)
+        except OSError:
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return path
+
+    def get_json(self, key: str):
+        """
+        JSONとして保存された値を返します。存在しない・壊れている場合はNoneを返します。
+        """
+        path = self.get_path(key)
+        if path is None:
+            return None
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def put_json(self, key: str, value):
+        """
+        値をJSONとして保存し、必要に応じて古いエントリを削除します。
+        """
+        path = self.path_for(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(value, f, ensure_ascii=False)
+        os.replace(temp_path, path)
+        self.evict()
+
+    def put_file(self, key: str, source_path: str, move: bool = False) -> str:
+        """
+        既存のファイルをキャッシュに格納し、格納先のパスを返します。
+        """
+        path = self.path_for(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        if move:
+            shutil.move(source_path, temp_path)
+        else:
+            shutil.copyfile(source_path, temp_path)
+        os.replace(temp_path, path)
+        self.evict()
+        return path
+
+    def evict(self):
+        """
+        TTL切れのエントリと、合計サイズの上限を超えた分の最も古いエントリを削除します。
+        """
+        if not self.ttl and not self.max_bytes:
+            return
+        entries = []
+        now = time.time()
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if not name.endswith(self.suffix):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                if self.ttl and now - stat.st_mtime > self.ttl:
+                    self._remove(path)
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+
+        if self.max_bytes:
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                if self._remove(path):
+                    total -= size
+
+    def _remove(self, path: str) -> bool:
+        if storage_manager.is_pinned(path):
+            return False
+        try:
+            os.remove(path)
+        except OSError:
+            return False
+        with self._lock:
+            self.evictions += 1
+        return True
+
+    def stats(self) -> Dict[str, int]:
+        """
+        ヒット数・ミス数・削除数を返します。
+        """
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions}
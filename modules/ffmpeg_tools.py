@@ -0,0 +1,300 @@
+import os
+import re
+import subprocess
+import tempfile
+from typing import Callable, Dict, List, Tuple, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import numpy as np
+
+# ffmpegを直接呼び出すための補助関数群
+# MoviePyが同梱しているffmpeg (imageio-ffmpeg) をそのまま利用するため、追加のインストールは不要です。
+
+def get_ffmpeg_binary() -> str:
+    """
+    MoviePyが使用しているffmpegバイナリのパスを返します。
+    """
+    from moviepy.config import get_setting
+    return get_setting("FFMPEG_BINARY")
+
+def run_ffmpeg(args: List[str]) -> str:
+    """
+    ffmpegを実行し、標準エラー出力（ログ）を文字列で返します。
+    失敗した場合は RuntimeError を送出します。
+    """
+    cmd = [get_ffmpeg_binary(), "-hide_banner", "-nostdin"] + args
+    proc = subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    log = proc.stderr.decode("utf-8", errors="replace")
+    if proc.returncode != 0:
+        raise RuntimeError(f"ffmpegの実行に失敗しました ({proc.returncode}): {log[-2000:]}")
+    return log
+
+def run_ffmpeg_with_progress(args: List[str], on_progress: Callable[[int], None]) -> str:
+    """
+    ffmpegを実行し、エンコード済みのフレーム数を on_progress(frame) で逐次通知します。
+    on_progressが例外を送出した場合はffmpegを停止し、その例外をそのまま送出します（キャンセル用）。
+    """
+    cmd = [get_ffmpeg_binary(), "-hide_banner", "-nostdin", "-nostats", "-progress", "pipe:1"] + args
+    # 標準エラーはパイプが詰まらないよう一時ファイルに受ける
+    with tempfile.TemporaryFile() as stderr_file:
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=stderr_file)
+        try:
+            for line in proc.stdout:
+                key, _, value = line.decode("utf-8", errors="replace").strip().partition("=")
+                if key == "frame" and value.isdigit():
+                    on_progress(int(value))
+        except BaseException:
+            proc.kill()
+            proc.wait()
+            raise
+        returncode = proc.wait()
+        stderr_file.seek(0)
+        log = stderr_file.read().decode("utf-8", errors="replace")
+    if returncode != 0:
+        raise RuntimeError(f"ffmpegの実行に失敗しました ({returncode}): {log[-2000:]}")
+    return log
+
+def _probe_log(video_path: str) -> str:
+    """
+    ffmpeg -i の出力（ストリーム情報）を返します。
+    """
+    cmd = [get_ffmpeg_binary(), "-hide_banner", "-nostdin", "-i", video_path]
+    proc = subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    return proc.stderr.decode("utf-8", errors="replace")
+
+def probe_video_codec(video_path: str) -> str or None:
+    """
+    動画ストリームのコーデック名 (例: 'h264') を返します。取得できない場合はNoneを返します。
+    """
+    match = re.search(r"Stream #\S+.*?: Video: (\w+)", _probe_log(video_path))
+    return match.group(1) if match else None
+
+def probe_video_stream(video_path: str) -> Dict or None:
+    """
+    最初の映像ストリームのコーデック名・解像度・フレームレート・ピクセルフォーマットを
+    {"codec": 'h264', "width": 1920, "height": 1080, "fps": 29.97, "pix_fmt": 'yuv420p'} の形で返します。
+    映像ストリームがない場合はNoneを返します。
+    """
+    return parse_video_stream(_probe_log(video_path))
+
+def parse_video_stream(log: str) -> Dict or None:
+    """
+    ffmpegのログ（入力のストリーム情報）から probe_video_stream と同じ形式の情報を取り出します。
+    """
+    match = re.search(r"Stream #\S+.*?: Video: (\w+).*?, (\d{2,})x(\d{2,})", log)
+    if not match:
+        return None
+    fps = re.search(r"Stream #\S+.*?: Video: .*?, ([0-9.]+) (?:fps|tbr)", log)
+    pix_fmt = re.search(r"Stream #\S+.*?: Video: [^,]+, (\w+)", log)
+    return {
+        "codec": match.group(1),
+        "width": int(match.group(2)),
+        "height": int(match.group(3)),
+        "fps": float(fps.group(1)) if fps else None,
+        "pix_fmt": pix_fmt.group(1) if pix_fmt else None,
+    }
+
+def probe_audio_stream(video_path: str) -> Dict or None:
+    """
+    最初の音声ストリームのコーデック名とサンプリングレートを {"codec": 'aac', "sample_rate": 44100} の形で返します。
+    音声ストリームがない場合はNoneを返します。
+    """
+    return parse_audio_stream(_probe_log(video_path))
+
+def parse_audio_stream(log: str) -> Dict or None:
+    """
+    ffmpegのログ（入力のストリーム情報）から probe_audio_stream と同じ形式の情報を取り出します。
+    """
+    match = re.search(r"Stream #\S+.*?: Audio: (\w+).*?, (\d+) Hz", log)
+    if not match:
+        return None
+    return {"codec": match.group(1), "sample_rate": int(match.group(2))}
+
+def parse_duration(log: str) -> float or None:
+    """
+    ffmpegのログからコンテナに記録された長さ（秒）を取り出します。
+    """
+    match = re.search(r"Duration: (\d+):(\d+):([0-9.]+)", log)
+    if not match:
+        return None
+    return int(match.group(1)) * 3600 + int(match.group(2)) * 60 + float(match.group(3))
+
+def probe_h264_sps(video_path: str) -> Dict or None:
+    """
+    最初の映像ストリーム (H.264) のSPSから profile_idc と level_idc を {"profile_idc": 100, "level_idc": 40} の形で返します。
+    trace_headers により先頭の1フレーム分のヘッダだけを読み、デコードは行いません。取得できない場合はNoneを返します。
+    """
+    cmd = [
+        get_ffmpeg_binary(), "-hide_banner", "-nostdin", "-i", video_path,
+        "-map", "0:v:0", "-frames:v", "1", "-c", "copy", "-bsf:v", "trace_headers", "-f", "null", "-",
+    ]
+    proc = subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    log = proc.stderr.decode("utf-8", errors="replace")
+    profile = re.search(r"\bprofile_idc\s+\d+ = (\d+)", log)
+    level = re.search(r"\blevel_idc\s+\d+ = (\d+)", log)
+    if not profile or not level:
+        return None
+    return {"profile_idc": int(profile.group(1)), "level_idc": int(level.group(1))}
+
+def get_keyframe_times(video_path: str) -> List[float]:
+    """
+    キーフレーム (Iフレーム) のタイムスタンプ（秒）を昇順で返します。
+    -skip_frame nokey によりキーフレームのみをデコードするため、全フレームのデコードは行いません。
+    """
+    log = run_ffmpeg(["-skip_frame", "nokey", "-i", video_path, "-map", "0:v:0", "-vf", "showinfo", "-f", "null", "-"])
+    times = [float(t) for t in re.findall(r"pts_time:\s*(-?[0-9.]+)", log)]
+    return sorted(set(times))
+
+def read_packet_table(video_path: str) -> Tuple[str, str]:
+    """
+    最初の映像・音声ストリームのパケットの一覧を、デコードせずにストリームコピーで読み出します。
+    戻り値は (framecrc形式の一覧, ストリーム情報を含むログ) です。
+    framecrcの各行は「ストリーム番号, DTS, PTS, 長さ, サイズ, CRC[, F=フラグ]」で、キーフレーム以外のパケットにはフラグが付きます。
+    """
+    cmd = [
+        get_ffmpeg_binary(), "-hide_banner", "-nostdin", "-i", video_path,
+        "-map", "0:v:0", "-map", "0:a:0?", "-c", "copy", "-f", "framecrc", "-",
+    ]
+    proc = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    log = proc.stderr.decode("utf-8", errors="replace")
+    if proc.returncode != 0:
+        raise RuntimeError(f"パケットの読み出しに失敗しました ({proc.returncode}): {log[-2000:]}")
+    return proc.stdout.decode("utf-8", errors="replace"), log
+
+def stream_copy_segment(video_path: str, start_time: float, end_time: float, output_path: str, audio: bool = True, inband_headers: bool = False, timescale: int = None, frame_count: int = None):
+    """
+    再エンコードせずに [start_time, end_time) の区間を切り出します。
+    start_time はキーフレーム上にある必要があります。
+    audio=False の場合は映像のみを切り出します。
+    frame_countを指定すると、映像をデコード順で先頭からその枚数だけ切り出します。Bフレームのあるソースでは -t だけだと
+    end_time 以降のフレームが含まれることがあるため、キーフレーム間を正確に切り出す場合に指定します（クローズドGOPが前提）。
+    inband_headers=True の場合はH.264のSPS/PPSを各キーフレームの前に埋め込み、パラメータの異なるセグメントと結合しても復号できるようにします。
+    timescaleを指定すると、映像トラックのタイムスケールをその値にします。
+    """
+    args = ["-y", "-ss", f"{start_time:.6f}", "-i", video_path, "-t", f"{end_time - start_time:.6f}", "-map", "0:v:0"]
+    if audio:
+        args += ["-map", "0:a:0?"]
+    args += ["-c", "copy", "-avoid_negative_ts", "make_zero"]
+    if frame_count:
+        args += ["-frames:v", str(frame_count)]
+    if inband_headers:
+        args += ["-bsf:v", "h264_mp4toannexb"]
+    if timescale:
+        args += ["-video_track_timescale", str(timescale)]
+    run_ffmpeg(args + [output_path])
+
+def concat_segments(segment_paths: List[str], output_path: str):
+    """
+    concat demuxerを使い、セグメントを再エンコードせずに1つのファイルに結合します。
+    全セグメントのコーデックパラメータが一致している必要があります。
+    """
+    list_path = output_path + ".concat.txt"
+    with open(list_path, "w", encoding="utf-8") as f:
+        for path in segment_paths:
+            escaped = os.path.abspath(path).replace("'", "'\\''")
+            f.write(f"file '{escaped}'\n")
+    try:
+        run_ffmpeg(["-y", "-f", "concat", "-safe", "0", "-i", list_path, "-c", "copy", "-movflags", "+faststart", output_path])
+    finally:
+        os.remove(list_path)
+
+def copy_audio_ranges(video_path: str, ranges: List[Tuple[float, float]], output_path: str):
+    """
+    音声ストリームを再エンコードせずに区間ごとに切り出し、1つの音声ファイル (.m4a) に結合します。
+    区間の境界はAACフレーム（1024サンプル）単位に丸められます。
+    """
+    part_paths = []
+    try:
+        for i, (start_time, end_time) in enumerate(ranges):
+            part_path = f"{output_path}.part{i:04d}.m4a"
+            run_ffmpeg([
+                "-y", "-ss", f"{start_time:.6f}", "-i", video_path,
+                "-t", f"{end_time - start_time:.6f}",
+                "-map", "0:a:0", "-c", "copy", part_path,
+            ])
+            part_paths.append(part_path)
+        if len(part_paths) == 1:
+            os.replace(part_paths[0], output_path)
+        else:
+            concat_segments(part_paths, output_path)
+    finally:
+        for part_path in part_paths:
+            if os.path.exists(part_path):
+                os.remove(part_path)
+
+def encode_audio_ranges(video_path: str, ranges: List[Tuple[float, float]], output_path: str, bitrate: str, sample_rate: int = None):
+    """
+    音声ストリームを区間ごとに切り出して結合し、1回だけAACで再エンコードして1つの音声ファイル (.m4a) に書き出します。
+    sample_rateを指定しない場合はソースのサンプリングレート・チャンネル構成のままエンコードします。
+    """
+    args = ["-y"]
+    for start_time, end_time in ranges:
+        args += ["-ss", f"{start_time:.6f}", "-t", f"{end_time - start_time:.6f}", "-i", video_path]
+    inputs = "".join(f"[{i}:a:0]" for i in range(len(ranges)))
+    args += ["-filter_complex", f"{inputs}concat=n={len(ranges)}:v=0:a=1[aout]", "-map", "[aout]", "-c:a", "aac", "-b:a", bitrate]
+    if sample_rate:
+        args += ["-ar", str(sample_rate)]
+    run_ffmpeg(args + [output_path])
+
+def mux_audio(video_path: str, audio_path: str, output_path: str):
+    """
+    映像のみのファイルに音声ファイルを再エンコードせずに多重化します。
+    """
+    run_ffmpeg([
+        "-y", "-i", video_path, "-i", audio_path,
+        "-map", "0:v:0", "-map", "1:a:0", "-c", "copy",
+        "-shortest", "-movflags", "+faststart", output_path,
+    ])
+
+def read_raw_frames(video_path: str, fps: float, width: int, height: int, pix_fmt: str = "gray") -> "np.ndarray":
+    """
+    動画を指定したフレームレート・解像度に縮小しながら一度だけデコードし、フレームの配列を返します。
+    pix_fmt='gray' の場合は (N, height, width)、'rgb24' の場合は (N, height, width, 3) の uint8 配列です。
+    """
+    import numpy as np
+    channels = 3 if pix_fmt == "rgb24" else 1
+    cmd = [
+        get_ffmpeg_binary(), "-hide_banner", "-nostdin", "-loglevel", "error",
+        "-i", video_path, "-map", "0:v:0",
+        "-vf", f"fps={fps},scale={width}:{height}",
+        "-pix_fmt", pix_fmt, "-f", "rawvideo", "-",
+    ]
+    proc = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if proc.returncode != 0:
+        raise RuntimeError(f"フレームのデコードに失敗しました: {proc.stderr.decode('utf-8', errors='replace')[-2000:]}")
+    frame_bytes = width * height * channels
+    count = len(proc.stdout) // frame_bytes
+    frames = np.frombuffer(proc.stdout, dtype=np.uint8, count=count * frame_bytes)
+    shape = (count, height, width, 3) if channels == 3 else (count, height, width)
+    return frames.reshape(shape)
+
+def extract_frames_jpeg(video_path: str, times: List[float], max_width: int = 384) -> List[bytes]:
+    """
+    複数の時刻のフレームを縮小したJPEGとして、1回のffmpegの実行で取り出します（timesと同じ順のリストを返します）。
+    最初の時刻の手前に一度だけシークして最後の時刻まで順にデコードし、select フィルタで各時刻以降の最初のフレームを選びます。
+    時刻ごとにffmpegを起動してシークし直すと、ショットの多い長い動画では数百のプロセスを起動することになるためです。
+    """
+    if not times:
+        return []
+    start = max(min(times) - 1.0, 0.0)
+    targets = sorted({round(max(t, 0.0) - start, 3) for t in times})
+    # 直前に選んだフレームが目標の時刻より前で、このフレームが目標の時刻以降であれば選ぶ（近い時刻は同じフレームになる）
+    select = "+".join(f"gte(t,{t:.3f})*(isnan(prev_selected_t)+lt(prev_selected_t,{t:.3f}))" for t in targets)
+    cmd = [
+        get_ffmpeg_binary(), "-hide_banner", "-nostdin",
+        "-ss", f"{start:.3f}", "-t", f"{targets[-1] + 1.0:.3f}", "-i", video_path, "-map", "0:v:0",
+        "-vf", f"select='{select}',showinfo,scale='min({max_width},iw)':-2",
+        "-fps_mode", "passthrough", "-f", "image2pipe", "-c:v", "mjpeg", "-q:v", "5", "-",
+    ]
+    proc = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    log = proc.stderr.decode("utf-8", errors="replace")
+    # JPEGの先頭マーカー (SOI) は圧縮データの中には現れないため、そこで区切る
+    images = [b"\xff\xd8" + chunk for chunk in proc.stdout.split(b"\xff\xd8")[1:]]
+    frame_times = [float(t) for t in re.findall(r"pts_time:\s*(-?[0-9.]+)", log)]
+    if proc.returncode != 0 or not images or len(images) != len(frame_times):
+        raise RuntimeError(f"フレームの取り出しに失敗しました: {log[-2000:]}")
+    frames = []
+    for t in times:
+        relative = max(t, 0.0) - start
+        frames.append(next((image for image, frame_time in zip(images, frame_times) if frame_time >= relative - 0.001), images[-1]))
+    return frames
@@ -0,0 +1,195 @@
+import json
+import os
+import shutil
+import subprocess
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, List, Tuple, TYPE_CHECKING
+
+from modules import ffmpeg_tools, media_index, metrics, storage_manager
+
+if TYPE_CHECKING:
+    import numpy as np
+
+# クリップの区間編集用のフィルムストリップ（一定間隔の縮小フレーム）
+# ソース動画を先頭から一度だけ順にデコードし、縮小したフレームを1つの配列ファイルにまとめて保存します。
+# 区間の端のサムネイル（ポスターフレーム）はこの配列から取り出すため、境界ごとに1GBのソースをシークし直す必要がありません。
+#
+# 保存形式: filmstrips/<コンテンツハッシュ>.v<バージョン>/frames.rgb（(フレーム数, 高さ, 幅, 3) のuint8の連続領域）と index.json
+# 作成に失敗した場合は同じディレクトリに failed（エラー内容）だけを置き、容量上限・TTLで削除されるまで作り直さない
+
+FILMSTRIP_DIR = storage_manager.area_path("filmstrips")
+FILMSTRIP_VERSION = 1
+# フレームを取り出す間隔（秒）と縮小後の高さ（幅は縦横比から決める）
+FILMSTRIP_INTERVAL = float(os.environ.get("FILMSTRIP_INTERVAL", "1.0"))
+FILMSTRIP_HEIGHT = int(os.environ.get("FILMSTRIP_HEIGHT", "90"))
+# 長い動画でもファイルサイズが一定以下になるよう、フレーム数がこの値を超える場合は間隔を広げる
+FILMSTRIP_MAX_FRAMES = int(os.environ.get("FILMSTRIP_MAX_FRAMES", "3600"))
+# メモリ上に保持するフィルムストリップの数（フレームはメモリマップで読むため、保持しても使用メモリは小さい）
+FILMSTRIP_MEMORY_ENTRIES = 8
+
+_filmstrip_lock = threading.Lock()
+_loaded: Dict[str, "Filmstrip"] = {}
+_filmstrip_futures: Dict[str, Future] = {}
+_filmstrip_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="filmstrip")
+
+class Filmstrip:
+    """
+    1つのソース動画のフィルムストリップです。i番目のフレームは時刻 i * interval（秒）のフレームです。
+    """
+
+    def __init__(self, frames: "np.ndarray", interval: float, duration: float):
+        self.frames = frames
+        self.interval = interval
+        self.duration = duration
+
+    def frame_index(self, time_sec: float) -> int:
+        """
+        時刻に最も近いフレームの番号を返します。
+        """
+        return int(min(max(round(float(time_sec) / self.interval), 0), len(self.frames) - 1))
+
+    def poster(self, time_sec: float) -> "np.ndarray":
+        """
+        時刻に最も近いフレーム（高さ, 幅, 3 のRGB配列）を返します。
+        """
+        import numpy as np
+        return np.asarray(self.frames[self.frame_index(time_sec)])
+
+def filmstrip_dir(content_hash: str) -> str:
+    return os.path.join(FILMSTRIP_DIR, f"{content_hash}.v{FILMSTRIP_VERSION}")
+
+def _frame_size(video_info: Dict) -> Tuple[int, int]:
+    height = min(FILMSTRIP_HEIGHT, video_info["height"])
+    width = max(2, int(round(video_info["width"] * height / video_info["height"] / 2)) * 2)
+    return width, height
+
+def build_filmstrip(video_path: str, content_hash: str) -> Filmstrip:
+    """
+    ソース動画を一度だけデコードして一定間隔の縮小フレームを取り出し、フィルムストリップとして保存します。
+    フレームはffmpegが直接ファイルに書き出すため、動画が長くてもメモリに全体を展開しません。
+    """
+    index = media_index.get_media_index(video_path, content_hash)
+    video_info = index.video if index else ffmpeg_tools.probe_video_stream(video_path)
+    if not video_info:
+        raise ValueError(f"映像ストリームが見つかりません: {video_path}")
+    duration = index.duration if index else None
+    interval = FILMSTRIP_INTERVAL
+    if duration:
+        interval = max(interval, duration / FILMSTRIP_MAX_FRAMES)
+    width, height = _frame_size(video_info)
+
+    directory = filmstrip_dir(content_hash)
+    temp_dir = storage_manager.make_work_dir("quickclip_filmstrip_")
+    try:
+        frames_path = os.path.join(temp_dir, "frames.rgb")
+        cmd = [
+            ffmpeg_tools.get_ffmpeg_binary(), "-hide_banner", "-nostdin", "-loglevel", "error",
+            "-i", video_path, "-map", "0:v:0", "-an", "-sn",
+            "-vf", f"fps=1/{interval:.6f},scale={width}:{height}:flags=area",
+            "-pix_fmt", "rgb24", "-f", "rawvideo", "-y", frames_path,
+        ]
+        with metrics.span("filmstrip_build"):
+            proc = subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        if proc.returncode != 0:
+            raise RuntimeError(f"フィルムストリップの作成に失敗しました: {proc.stderr.decode('utf-8', errors='replace')[-2000:]}")
+        count = os.path.getsize(frames_path) // (width * height * 3)
+        if count == 0:
+            raise RuntimeError("フィルムストリップのフレームを取り出せませんでした。")
+        with open(os.path.join(temp_dir, "index.json"), "w", encoding="utf-8") as f:
+            json.dump({"version": FILMSTRIP_VERSION, "interval": interval, "count": count, "width": width, "height": height,
+                       "duration": duration or count * interval}, f)
+        os.makedirs(FILMSTRIP_DIR, exist_ok=True)
+        shutil.rmtree(directory, ignore_errors=True)
+        os.replace(temp_dir, directory)
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+    return _load(content_hash)
+
+def _load(content_hash: str) -> Filmstrip or None:
+    import numpy as np
+    with _filmstrip_lock:
+        filmstrip = _loaded.get(content_hash)
+    if filmstrip is not None:
+        return filmstrip
+    directory = filmstrip_dir(content_hash)
+    try:
+        with open(os.path.join(directory, "index.json"), "r", encoding="utf-8") as f:
+            info = json.load(f)
+        frames = np.memmap(os.path.join(directory, "frames.rgb"), dtype=np.uint8, mode="r",
+                           shape=(info["count"], info["height"], info["width"], 3))
+        storage_manager.touch(os.path.join(directory, "index.json"))
+    except (OSError, ValueError, KeyError):
+        return None
+    filmstrip = Filmstrip(frames, info["interval"], info["duration"])
+    with _filmstrip_lock:
+        _loaded[content_hash] = filmstrip
+        while len(_loaded) > FILMSTRIP_MEMORY_ENTRIES:
+            _loaded.pop(next(iter(_loaded)))
+    return filmstrip
+
+def _failed_marker(content_hash: str) -> str:
+    return os.path.join(filmstrip_dir(content_hash), "failed")
+
+def _build_in_background(video_path: str, content_hash: str):
+    try:
+        return build_filmstrip(video_path, content_hash)
+    except Exception as e:
+        print(f"フィルムストリップの作成中にエラーが発生しました: {e}")
+        try:
+            os.makedirs(filmstrip_dir(content_hash), exist_ok=True)
+            with open(_failed_marker(content_hash), "w", encoding="utf-8") as f:
+                f.write(str(e))
+        except OSError:
+            pass
+        return None
+    finally:
+        with _filmstrip_lock:
+            _filmstrip_futures.pop(content_hash, None)
+
+def start_filmstrip_build(video_path: str, content_hash: str):
+    """
+    フィルムストリップの作成をバックグラウンドで開始します。作成済み・作成中・作成に失敗済みの場合は何もしません。
+    """
+    if not content_hash or os.path.exists(os.path.join(filmstrip_dir(content_hash), "index.json")) or os.path.exists(_failed_marker(content_hash)):
+        return
+    with _filmstrip_lock:
+        if content_hash not in _filmstrip_futures:
+            _filmstrip_futures[content_hash] = _filmstrip_executor.submit(_build_in_background, video_path, content_hash)
+
+def get_filmstrip_status(content_hash: str) -> str or None:
+    """
+    フィルムストリップの状態を 'ready'（作成済み）/ 'building'（作成中）/ 'failed'（作成に失敗）のいずれかで返します。
+    作成を開始していない場合はNoneを返します。
+    """
+    if not content_hash:
+        return None
+    if os.path.exists(os.path.join(filmstrip_dir(content_hash), "index.json")):
+        return "ready"
+    with _filmstrip_lock:
+        if content_hash in _filmstrip_futures:
+            return "building"
+    return "failed" if os.path.exists(_failed_marker(content_hash)) else None
+
+def get_ready_filmstrip(content_hash: str) -> Filmstrip or None:
+    """
+    作成済みのフィルムストリップを返します。まだ作成されていない場合はNoneを返します（作成を待ちません）。
+    """
+    if not content_hash:
+        return None
+    filmstrip = _load(content_hash)
+    if filmstrip is not None and not os.path.exists(filmstrip_dir(content_hash)):
+        # 容量上限により削除された
+        with _filmstrip_lock:
+            _loaded.pop(content_hash, None)
+        return None
+    return filmstrip
+
+def get_posters(content_hash: str, times: List[float]) -> "List[np.ndarray]" or None:
+    """
+    指定した時刻のポスターフレームのリストを返します。フィルムストリップが作成されていない場合はNoneを返します。
+    """
+    filmstrip = get_ready_filmstrip(content_hash)
+    if filmstrip is None:
+        return None
+    return [filmstrip.poster(t) for t in times]
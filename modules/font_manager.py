@@ -1,15 +1,72 @@
 import streamlit as st
+import hashlib
+import json
 import os
 import requests
+import struct
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Dict
 
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from PIL import ImageFont
+
+from modules import metrics, source_store, storage_manager
+from modules.disk_cache import DiskCache
+
 FONT_DIR = "./fonts"
-GOOGLE_FONTS_DIR = os.path.join(FONT_DIR, "google_fonts")
-CUSTOM_FONTS_DIR = os.path.join(FONT_DIR, "custom_fonts")
+GOOGLE_FONTS_DIR = storage_manager.area_path("google_fonts")
+CUSTOM_FONTS_DIR = storage_manager.area_path("custom_fonts")
+
+# フォントのメタデータ（ファミリー名・ハッシュ・日本語対応状況）のキャッシュ
+# ファイルのパス・サイズ・更新時刻をキーにするため、フォントが差し替えられると自動的に読み直される
+font_metadata_cache = DiskCache(storage_manager.area_path("font_metadata"))
+FONT_METADATA_VERSION = 1
+
+# 日本語対応の判定に使う文字（ひらがな・カタカナ・小学1年生で習う漢字・約物）
+JAPANESE_SAMPLE_CHARS = (
+    "".join(chr(c) for c in range(0x3041, 0x3094))
+    + "".join(chr(c) for c in range(0x30A1, 0x30F7))
+    + "一右雨円王音下火花貝学気九休玉金空月犬見五口校左三山子四糸字耳七車手十出女小上森人水正生青夕石赤千川先早草足村大男竹中虫町天田土二日入年白八百文木本名目立力林六"
+    + "、。「」ー・"
+)
+# この割合以上の文字を含むフォントを日本語対応とみなす
+JAPANESE_COVERAGE_THRESHOLD = 0.95
+
+# Google Fontsのファイル名とダウンロードURLの対応
+GOOGLE_FONT_URLS = {
+    "NotoSansJP-Regular.ttf": "https://fonts.gstatic.com/ea/notosansjp/v5/NotoSansJP-Regular.otf",
+    "ZenKakuGothicNew-Regular.ttf": "https://fonts.gstatic.com/s/zenkakugothicnew/v18/DtNoDxwz6Eo_MvPekbS3JY4_RzEw7_I_g-Y-H9_G.ttf",
+    "MPLUSRounded1c-Regular.ttf": "https://fonts.gstatic.com/s/mplusrounded1c/v25/VibzRvVHAxLgFG7FD5nkKLmrBP4.ttf",
+}
+# 各フォントの期待するSHA-256（固定値）。ダウンロードした内容がこの値と一致しない場合は配置しない
+# URLを変更したときは `python -m modules.font_manager --print-digests` の出力で更新する
+# 固定値が未登録のフォントは初回に取得した内容のハッシュをマニフェストに記録し、以降の取得ではその値と照合する
+GOOGLE_FONT_SHA256 = {
+    "NotoSansJP-Regular.ttf": None,
+    "ZenKakuGothicNew-Regular.ttf": None,
+    "MPLUSRounded1c-Regular.ttf": None,
+}
+# ダウンロード済みフォントのURL・ハッシュ・ETag等を記録するマニフェスト
+# Dockerイメージのビルド時に `python -m modules.font_manager` でフォントと一緒に生成される
+FONT_MANIFEST_PATH = os.path.join(GOOGLE_FONTS_DIR, "manifest.json")
+# 有効にすると、固定のハッシュが未登録のフォントは取得しない
+REQUIRE_PINNED_FONT_DIGESTS = os.environ.get("REQUIRE_PINNED_FONT_DIGESTS", "").lower() in ("1", "true", "yes")
+FONT_DOWNLOAD_WORKERS = 4
+FONT_DOWNLOAD_TIMEOUT = 30
+# TrueType / OpenType ファイルの先頭4バイト
+_FONT_SIGNATURES = (b"\x00\x01\x00\x00", b"OTTO", b"true", b"ttcf")
 
-# フォントディレクトリが存在しない場合は作成
-os.makedirs(GOOGLE_FONTS_DIR, exist_ok=True)
-os.makedirs(CUSTOM_FONTS_DIR, exist_ok=True)
+_http_session = None
+_manifest_lock = threading.Lock()
+_background_fetch = None
+
+_registry_lock = threading.Lock()
+_font_registry = {"signature": None, "fonts": {}, "by_display_name": {}}
+
+# フォントディレクトリはインポート時には作成せず、フォントを保存する時点で作成する
 
 def get_google_fonts_list() -> Dict[str, str]:
     """
@@ -24,43 +81,214 @@ def get_google_fonts_list() -> Dict[str, str]:
         "M PLUS Rounded 1c": "MPLUSRounded1c-Regular.ttf",
     }
 
+def _get_http_session() -> requests.Session:
+    """
+    フォント取得用のHTTPセッションを返します。コネクションプールを共有し、一時的なエラーは再試行します。
+    """
+    global _http_session
+    if _http_session is None:
+        session = requests.Session()
+        retry = Retry(total=3, backoff_factor=0.5, status_forcelist=(429, 500, 502, 503, 504))
+        adapter = HTTPAdapter(pool_connections=FONT_DOWNLOAD_WORKERS, pool_maxsize=FONT_DOWNLOAD_WORKERS, max_retries=retry)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        _http_session = session
+    return _http_session
+
+def load_font_manifest() -> Dict[str, Dict]:
+    """
+    フォントマニフェストを読み込みます。存在しない・壊れている場合は空の辞書を返します。
+    """
+    try:
+        with open(FONT_MANIFEST_PATH, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def _save_font_manifest(manifest: Dict[str, Dict]):
+    os.makedirs(os.path.dirname(FONT_MANIFEST_PATH), exist_ok=True)
+    temp_path = f"{FONT_MANIFEST_PATH}.{os.getpid()}.tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2, sort_keys=True)
+    os.replace(temp_path, FONT_MANIFEST_PATH)
+
+def _verify_font_file(font_path: str, entry: Dict, expected_sha256: str) -> bool:
+    """
+    ローカルのフォントファイルがマニフェストのサイズと、固定のハッシュ（未登録の場合はマニフェストのハッシュ）に一致するかを確認します。
+    """
+    expected_sha256 = expected_sha256 or entry.get("sha256")
+    try:
+        if os.path.getsize(font_path) != entry.get("size"):
+            return False
+    except OSError:
+        return False
+    return entry.get("sha256") == expected_sha256 and _hash_font_file(font_path) == expected_sha256
+
+def _fetch_font(session: requests.Session, file_name: str, url: str, expected_sha256: str, entry: Dict or None) -> Dict:
+    """
+    フォントを1つ取得し、マニフェストのエントリを返します。
+    ローカルに検証済みのファイルがある場合は条件付きリクエスト (If-None-Match / If-Modified-Since) を送り、
+    未更新 (304) であればダウンロードしません。ダウンロードしたファイルはサイズ・形式を検証し、ハッシュが固定値と一致した場合のみ配置します。
+    expected_sha256がNoneの場合（初回の取得）はハッシュを照合せず、取得した内容のハッシュをエントリに記録します。
+    """
+    font_path = os.path.join(GOOGLE_FONTS_DIR, file_name)
+    headers = {}
+    if entry and entry.get("url") == url and _verify_font_file(font_path, entry, expected_sha256):
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+
+    with metrics.span("font_download") as span, session.get(url, headers=headers, stream=True, timeout=FONT_DOWNLOAD_TIMEOUT) as response:
+        span.set(file_name=file_name, status=response.status_code)
+        if response.status_code == 304:
+            return entry
+        response.raise_for_status()
+
+        digest = hashlib.sha256()
+        size = 0
+        temp_path = f"{font_path}.{os.getpid()}.{threading.get_ident()}.part"
+        os.makedirs(GOOGLE_FONTS_DIR, exist_ok=True)
+        try:
+            with open(temp_path, "wb") as f:
+                for chunk in response.iter_content(chunk_size=64 * 1024):
+                    digest.update(chunk)
+                    size += len(chunk)
+                    f.write(chunk)
+            expected_size = response.headers.get("Content-Length")
+            if expected_size is not None and response.headers.get("Content-Encoding") is None and int(expected_size) != size:
+                raise ValueError(f"{file_name} のサイズが一致しません ({size} / {expected_size} バイト)")
+            with open(temp_path, "rb") as f:
+                if f.read(4) not in _FONT_SIGNATURES:
+                    raise ValueError(f"{file_name} はフォントファイルではありません")
+            if expected_sha256 and digest.hexdigest() != expected_sha256:
+                raise ValueError(f"{file_name} のハッシュが固定値と一致しません ({digest.hexdigest()})")
+            os.replace(temp_path, font_path)
+            span.set(bytes=size)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+        return {
+            "url": url,
+            "sha256": digest.hexdigest(),
+            "size": size,
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+        }
+
+def fetch_google_fonts(file_names: List[str] = None, urls: Dict[str, str] = None, digests: Dict[str, str] = None,
+                       max_workers: int = FONT_DOWNLOAD_WORKERS, revalidate: bool = False) -> Dict[str, str]:
+    """
+    Google Fontsを並列に取得してマニフェストを更新し、{ファイル名: エラーメッセージ or None} を返します。
+    revalidate=Falseの場合、マニフェストと一致するファイルはリクエストを送らずにそのまま使います。
+    urls・digestsを指定すると取得先と固定のハッシュを差し替えられます（ローカルのテスト用サーバーなど）。
+    """
+    urls = urls or GOOGLE_FONT_URLS
+    digests = digests or GOOGLE_FONT_SHA256
+    file_names = file_names if file_names is not None else list(urls)
+    manifest = load_font_manifest()
+    session = _get_http_session()
+
+    results = {}
+    pending = []
+    for file_name in file_names:
+        url = urls.get(file_name)
+        if url is None:
+            results[file_name] = "ダウンロードURLが登録されていません"
+            continue
+        expected_sha256 = digests.get(file_name)
+        entry = manifest.get(file_name)
+        if not expected_sha256:
+            if REQUIRE_PINNED_FONT_DIGESTS:
+                results[file_name] = "固定のハッシュが登録されていません"
+                continue
+            # 固定値が未登録の場合は、同じURLから以前に取得した内容のハッシュと照合する
+            expected_sha256 = entry.get("sha256") if entry and entry.get("url") == url else None
+            if expected_sha256 is None:
+                print(f"{file_name} の固定のハッシュが登録されていないため、取得した内容のハッシュを記録します。")
+        font_path = os.path.join(GOOGLE_FONTS_DIR, file_name)
+        if (not revalidate and entry and entry.get("url") == url and entry.get("sha256") == expected_sha256
+                and os.path.exists(font_path) and os.path.getsize(font_path) == entry.get("size")):
+            results[file_name] = None
+            continue
+        pending.append((file_name, url, expected_sha256, entry))
+
+    if pending:
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(pending)))) as executor:
+            futures = {executor.submit(_fetch_font, session, *args): args[0] for args in pending}
+        for future, file_name in futures.items():
+            try:
+                entry = future.result()
+            except Exception as e:
+                results[file_name] = str(e)
+                continue
+            with _manifest_lock:
+                manifest = load_font_manifest()
+                manifest[file_name] = entry
+                _save_font_manifest(manifest)
+            results[file_name] = None
+    return results
+
+def build_font_bundle() -> bool:
+    """
+    get_google_fonts_listの全フォントを取得し、マニフェストとともにフォントバンドルを作成します。
+    Dockerイメージのビルド時に実行し、コールドスタート後にフォントをダウンロードし直さずに済むようにします。
+    """
+    os.makedirs(GOOGLE_FONTS_DIR, exist_ok=True)
+    results = fetch_google_fonts(list(get_google_fonts_list().values()), revalidate=True)
+    for file_name, error in results.items():
+        print(f"{file_name}: {'OK' if error is None else error}")
+    return all(error is None for error in results.values())
+
+def compute_font_digests(urls: Dict[str, str] = None) -> Dict[str, str]:
+    """
+    各フォントをダウンロードしてSHA-256を計算し、{ファイル名: SHA-256} を返します（ファイルは保存しません）。
+    GOOGLE_FONT_SHA256 の固定値を更新するときに使います。
+    """
+    session = _get_http_session()
+    digests = {}
+    for file_name, url in (urls or GOOGLE_FONT_URLS).items():
+        digest = hashlib.sha256()
+        with session.get(url, stream=True, timeout=FONT_DOWNLOAD_TIMEOUT) as response:
+            response.raise_for_status()
+            for chunk in response.iter_content(chunk_size=64 * 1024):
+                digest.update(chunk)
+        digests[file_name] = digest.hexdigest()
+    return digests
+
+def start_missing_font_fetch():
+    """
+    バンドルに含まれていないフォントをバックグラウンドで取得します。プロセスごとに一度だけ実行されます。
+    """
+    global _background_fetch
+    with _manifest_lock:
+        if _background_fetch is None:
+            _background_fetch = threading.Thread(
+                target=fetch_google_fonts, args=(list(get_google_fonts_list().values()),),
+                name="font-fetch", daemon=True
+            )
+            _background_fetch.start()
+
 def download_google_font(font_name: str, file_name: str) -> str or None:
     """
     指定されたGoogle Fontをダウンロードし、ローカルに保存します。
     """
     font_path = os.path.join(GOOGLE_FONTS_DIR, file_name)
-    if os.path.exists(font_path):
+    if file_name in load_font_manifest() and os.path.exists(font_path):
         st.info(f"{font_name} は既にダウンロードされています。")
         return font_path
+    if file_name not in GOOGLE_FONT_URLS:
+        st.warning(f"'{font_name}' のダウンロードURLが見つかりませんでした。手動でアップロードしてください。")
+        return None
 
-    # Google FontsのダウンロードURLは、各フォントのCSSから取得する必要があります。
-    # ここではNoto Sans JPの例を示しますが、他のフォントも同様に探し出す必要があります。
-    # 実際の運用では、Google Fonts APIを利用してダウンロードURLを取得する方が良いでしょう。
-    st.info(f"{font_name} をダウンロード中...")
-    try:
-        # 例: Noto Sans JPのダウンロードURL (実際にはweightなどを指定する)
-        # 暫定的にCDNから直接ダウンロードするが、これは本番環境では適切ではない可能性がある。
-        # Google Fonts APIの利用を検討するか、woff2ファイルを事前に用意する。
-        if "NotoSansJP" in file_name:
-            url = f"https://fonts.gstatic.com/ea/notosansjp/v5/NotoSansJP-Regular.otf"
-        elif "ZenKakuGothicNew" in file_name:
-            url = f"https://fonts.gstatic.com/s/zenkakugothicnew/v18/DtNoDxwz6Eo_MvPekbS3JY4_RzEw7_I_g-Y-H9_G.ttf"
-        elif "MPLUSRounded1c" in file_name:
-            url = f"https://fonts.gstatic.com/s/mplusrounded1c/v25/VibzRvVHAxLgFG7FD5nkKLmrBP4.ttf"
-        else:
-            st.warning(f"'{font_name}' のダウンロードURLが見つかりませんでした。手動でアップロードしてください。")
-            return None
-
-        response = requests.get(url, stream=True)
-        response.raise_for_status()
-        with open(font_path, "wb") as f:
-            for chunk in response.iter_content(chunk_size=8192):
-                f.write(chunk)
-        st.success(f"{font_name} のダウンロードが完了しました。", icon="\u2705")
-        return font_path
-    except Exception as e:
-        st.error(f"{font_name} のダウンロード中にエラーが発生しました: {e}", icon="\u274C")
+    with st.spinner(f"{font_name} をダウンロード中..."):
+        error = fetch_google_fonts([file_name])[file_name]
+    if error:
+        st.error(f"{font_name} のダウンロード中にエラーが発生しました: {error}", icon="\u274C")
         return None
+    st.success(f"{font_name} のダウンロードが完了しました。", icon="\u2705")
+    return font_path
 
 def upload_custom_font(uploaded_file) -> str or None:
     """
@@ -74,8 +302,7 @@ def upload_custom_font(uploaded_file) -> str or None:
 
         font_path = os.path.join(CUSTOM_FONTS_DIR, uploaded_file.name)
         try:
-            with open(font_path, "wb") as f:
-                f.write(uploaded_file.getbuffer())
+            source_store.stream_upload_to_file(uploaded_file, font_path)
             st.success(f"カスタムフォント '{uploaded_file.name}' がアップロードされました。", icon="\u2705")
             return font_path
         except Exception as e:
@@ -83,21 +310,174 @@ def upload_custom_font(uploaded_file) -> str or None:
             return None
     return None
 
+def _read_cmap_codepoints(font_path: str) -> set:
+    """
+    フォントのcmapテーブルを読み、収録されているUnicodeコードポイントの集合を返します。
+    Unicode用のサブテーブル（format 4 / 12）のみを対象とします。
+    """
+    with open(font_path, "rb") as f:
+        data = f.read()
+    num_tables = struct.unpack_from(">H", data, 4)[0]
+    cmap_offset = None
+    for i in range(num_tables):
+        tag, _, offset, _ = struct.unpack_from(">4sIII", data, 12 + 16 * i)
+        if tag == b"cmap":
+            cmap_offset = offset
+            break
+    if cmap_offset is None:
+        return set()
+
+    codepoints = set()
+    num_subtables = struct.unpack_from(">H", data, cmap_offset + 2)[0]
+    for i in range(num_subtables):
+        platform_id, encoding_id, offset = struct.unpack_from(">HHI", data, cmap_offset + 4 + 8 * i)
+        if (platform_id, encoding_id) not in ((0, 3), (0, 4), (0, 6), (3, 1), (3, 10)):
+            continue
+        table = cmap_offset + offset
+        table_format = struct.unpack_from(">H", data, table)[0]
+        if table_format == 4:
+            seg_count = struct.unpack_from(">H", data, table + 6)[0] // 2
+            end_codes = struct.unpack_from(f">{seg_count}H", data, table + 14)
+            start_codes = struct.unpack_from(f">{seg_count}H", data, table + 16 + 2 * seg_count)
+            for start, end in zip(start_codes, end_codes):
+                if start != 0xFFFF:
+                    codepoints.update(range(start, end + 1))
+        elif table_format == 12:
+            num_groups = struct.unpack_from(">I", data, table + 12)[0]
+            for j in range(num_groups):
+                start, end, _ = struct.unpack_from(">III", data, table + 16 + 12 * j)
+                codepoints.update(range(start, end + 1))
+    return codepoints
+
+def _hash_font_file(font_path: str) -> str:
+    digest = hashlib.sha256()
+    with open(font_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def _read_font_metadata(font_path: str, stat: os.stat_result) -> Dict:
+    """
+    フォントのファミリー名・スタイル名・ハッシュ・日本語対応状況を読み取ります。
+    結果はファイルのサイズと更新時刻をキーにディスクへキャッシュされます。
+    """
+    key = hashlib.sha256(f"{FONT_METADATA_VERSION}:{os.path.abspath(font_path)}:{stat.st_size}:{stat.st_mtime_ns}".encode("utf-8")).hexdigest()
+    metadata = font_metadata_cache.get_json(key)
+    if metadata is not None:
+        return metadata
+
+    fallback_name = os.path.basename(font_path).split('.')[0]
+    try:
+        family, style = ImageFont.truetype(font_path, 12).getname()
+    except OSError:
+        family, style = fallback_name, None
+    try:
+        codepoints = _read_cmap_codepoints(font_path)
+    except (OSError, struct.error):
+        codepoints = set()
+    covered = sum(1 for char in JAPANESE_SAMPLE_CHARS if ord(char) in codepoints)
+    coverage = covered / len(JAPANESE_SAMPLE_CHARS)
+    metadata = {
+        "family": family or fallback_name,
+        "style": style or "Regular",
+        "sha256": _hash_font_file(font_path),
+        "japanese_coverage": round(coverage, 4),
+        "supports_japanese": coverage >= JAPANESE_COVERAGE_THRESHOLD,
+    }
+    try:
+        font_metadata_cache.put_json(key, metadata)
+    except OSError as e:
+        print(f"フォント情報のキャッシュ保存に失敗しました: {e}")
+    return metadata
+
+def _directory_signature(directories: List[str]) -> tuple:
+    """
+    フォントディレクトリの更新時刻の組を返します。
+    ファイルの追加・削除・名前変更はディレクトリの更新時刻を変えるため、これが変わらなければ再走査は不要です。
+    """
+    signature = []
+    for directory in directories:
+        try:
+            signature.append((directory, os.stat(directory).st_mtime_ns))
+        except OSError:
+            signature.append((directory, None))
+    return tuple(signature)
+
+def _build_font_registry(previous_fonts: Dict[str, Dict]) -> Dict:
+    """
+    フォントディレクトリを走査してレジストリを作り直します。
+    サイズと更新時刻が変わっていないフォントは前回のメタデータを再利用します。
+    """
+    fonts = {}
+    directories = [FONT_DIR]
+    for root, dirs, files in os.walk(FONT_DIR):
+        directories.extend(os.path.join(root, d) for d in dirs)
+        for file in files:
+            if not file.lower().endswith(('.ttf', '.otf')):
+                continue
+            path = os.path.join(root, file)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            previous = previous_fonts.get(path)
+            if previous and previous["size"] == stat.st_size and previous["mtime_ns"] == stat.st_mtime_ns:
+                fonts[path] = previous
+                continue
+            info = dict(_read_font_metadata(path, stat), path=path, size=stat.st_size, mtime_ns=stat.st_mtime_ns)
+            fonts[path] = info
+
+    # 表示名はフォント内部のファミリー名・スタイル名から作り、重複する場合はファイル名を添える
+    by_display_name = {}
+    for path in sorted(fonts):
+        info = fonts[path]
+        display_name = info["family"] if info["style"] == "Regular" else f"{info['family']} {info['style']}"
+        if display_name in by_display_name:
+            display_name = f"{display_name} ({os.path.basename(path)})"
+        info["display_name"] = display_name
+        by_display_name[display_name] = path
+
+    return {"signature": _directory_signature(directories), "fonts": fonts, "by_display_name": by_display_name}
+
+def get_font_registry() -> Dict:
+    """
+    フォントレジストリを返します。フォントディレクトリに変更があった場合のみ再走査します。
+    戻り値は {"fonts": {パス: 情報}, "by_display_name": {表示名: パス}} を含む辞書です。
+    """
+    global _font_registry
+    with _registry_lock:
+        signature = _font_registry["signature"]
+        if signature is None or _directory_signature([directory for directory, _ in signature]) != signature:
+            with metrics.span("font_registry_build") as span:
+                _font_registry = _build_font_registry(_font_registry["fonts"])
+                span.set(fonts=len(_font_registry["fonts"]))
+        return _font_registry
+
 def get_available_fonts() -> List[str]:
     """
     利用可能な全てのフォントファイル（Google Fontsとカスタムフォント）のパスをリストで返します。
     """
-    available_fonts = []
-    for root, _, files in os.walk(FONT_DIR):
-        for file in files:
-            if file.lower().endswith(('.ttf', '.otf')):
-                available_fonts.append(os.path.join(root, file))
-    return available_fonts
+    return sorted(get_font_registry()["fonts"])
+
+def get_font_info(font_path: str) -> Dict or None:
+    """
+    フォントのメタデータ（family, style, sha256, japanese_coverage, supports_japanese, display_name）を返します。
+    """
+    return get_font_registry()["fonts"].get(font_path)
+
+def get_font_path_by_display_name(display_name: str) -> str or None:
+    """
+    表示名に対応するフォントファイルのパスを返します。
+    """
+    return get_font_registry()["by_display_name"].get(display_name)
 
 def get_font_display_name(font_path: str) -> str:
     """
     フォントファイルのパスから表示名を生成します。
     """
+    info = get_font_info(font_path)
+    if info:
+        return info["display_name"]
     return os.path.basename(font_path).split('.')[0]
 
 # Streamlit Session Stateでの利用例:
@@ -147,3 +527,12 @@ def get_font_display_name(font_path: str) -> str:
 #     )
 #     if st.session_state.selected_font:
 #         st.sidebar.write(f"選択中のフォント: {get_font_display_name(st.session_state.selected_font)}")
+
+if __name__ == "__main__":
+    # Dockerイメージのビルド時にフォントバンドルを作成する: python -m modules.font_manager
+    # 固定のハッシュを更新する: python -m modules.font_manager --print-digests
+    import sys
+    if "--print-digests" in sys.argv[1:]:
+        print(json.dumps(compute_font_digests(), indent=4))
+        raise SystemExit(0)
+    raise SystemExit(0 if build_font_bundle() else 1)
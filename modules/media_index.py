@@ -0,0 +1,301 @@
+import hashlib
+import json
+import os
+import threading
+from bisect import bisect_left, bisect_right
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, List, Tuple, TYPE_CHECKING
+
+from modules import ffmpeg_tools, metrics, storage_manager
+
+if TYPE_CHECKING:
+    import numpy as np
+
+# ソース動画ごとのメディアインデックス（キーフレーム位置・フレームのタイムスタンプ・長さ・ストリーム情報）
+# アップロード時にパケットの一覧をデコードせずに一度だけ読み出し、コンテンツハッシュをキーとしてディスクに保存します。
+# レンダリングのたびにコンテナを調べ直したり、キーフレームを探すためにデコードしたりせずに済むようにします。
+
+MEDIA_INDEX_DIR = storage_manager.area_path("media_index")
+# インデックスの内容・形式を変更した場合はこの値を上げ、古いインデックスを作り直す
+MEDIA_INDEX_VERSION = 2
+# メモリ上に保持するインデックスの数
+MEDIA_INDEX_MEMORY_ENTRIES = 16
+
+_index_lock = threading.Lock()
+_loaded: Dict[str, "MediaIndex"] = {}
+_index_futures: Dict[str, Future] = {}
+# 作成に失敗したインデックスのキーとエラー内容（同じソースで作成をやり直さないようにする）
+_failed: Dict[str, str] = {}
+_index_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="media-index")
+
+class MediaIndex:
+    """
+    1つのソース動画のインデックスです。時刻はすべて秒で、ffmpegの入力側シーク (-ss) と同じタイムライン上の値です。
+    keyframes と frame_times は昇順のnumpy配列で、検索は二分探索で行います。
+    """
+
+    def __init__(self, keyframes: "np.ndarray", frame_times: "np.ndarray", info: Dict):
+        self.keyframes = keyframes
+        self.frame_times = frame_times
+        self.info = info
+
+    @property
+    def duration(self) -> float:
+        return self.info["duration"]
+
+    @property
+    def video(self) -> Dict:
+        return self.info["video"]
+
+    @property
+    def audio(self) -> Dict or None:
+        return self.info["audio"]
+
+    @property
+    def fps(self) -> float or None:
+        return self.info["video"].get("fps")
+
+    def keyframe_at_or_before(self, time_sec: float) -> float:
+        """
+        time_sec以前で最も近いキーフレームの時刻を返します。先頭より前の場合は最初のキーフレームを返します。
+        """
+        i = bisect_right(self.keyframes, time_sec + 1e-6)
+        return float(self.keyframes[max(i - 1, 0)])
+
+    def keyframe_after(self, time_sec: float) -> float or None:
+        """
+        time_secより後で最も近いキーフレームの時刻を返します。ない場合はNoneを返します。
+        """
+        i = bisect_right(self.keyframes, time_sec + 1e-6)
+        return float(self.keyframes[i]) if i < len(self.keyframes) else None
+
+    def keyframes_between(self, start_time: float, end_time: float, tolerance: float = 1e-3) -> List[float]:
+        """
+        [start_time, end_time] の範囲（前後にtoleranceの誤差を許容）にあるキーフレームの時刻を返します。
+        """
+        return [float(t) for t in self.keyframes[bisect_left(self.keyframes, start_time - tolerance):bisect_right(self.keyframes, end_time + tolerance)]]
+
+    def frame_at_or_before(self, time_sec: float) -> float:
+        """
+        time_secの時点で表示されているフレームの開始時刻を返します。
+        """
+        i = bisect_right(self.frame_times, time_sec + 1e-6)
+        return float(self.frame_times[max(i - 1, 0)])
+
+    def frame_count_between(self, start_time: float, end_time: float, tolerance: float = 1e-3) -> int:
+        """
+        [start_time, end_time) の範囲（前後にtoleranceの誤差を許容）に表示開始時刻があるフレームの数を返します。
+        """
+        return int(bisect_left(self.frame_times, end_time - tolerance) - bisect_left(self.frame_times, start_time - tolerance))
+
+    def clamp_range(self, start_time: float, end_time: float) -> Tuple[float, float] or None:
+        """
+        区間を実際の長さの範囲内に収めて返します。区間が空になる場合はNoneを返します。
+        """
+        start_time = max(0.0, float(start_time))
+        end_time = min(float(end_time), self.duration)
+        if end_time - start_time <= 0:
+            return None
+        return start_time, end_time
+
+    def save(self, path: str):
+        import numpy as np
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp.npz"
+        np.savez(temp_path, keyframes=self.keyframes, frame_times=self.frame_times, info=np.array(json.dumps(self.info)))
+        os.replace(temp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "MediaIndex":
+        import numpy as np
+        with np.load(path, allow_pickle=False) as data:
+            return cls(data["keyframes"], data["frame_times"], json.loads(str(data["info"])))
+
+def _parse_packet_table(table: str) -> Tuple[Dict[int, Dict], Dict[int, List[Tuple[int, int, int, bool]]]]:
+    """
+    framecrc形式のパケット一覧を、ストリームごとのヘッダ情報と (DTS, PTS, 長さ, キーフレームかどうか) のリストに分解します。
+    """
+    headers: Dict[int, Dict] = {}
+    packets: Dict[int, List[Tuple[int, int, int, bool]]] = {}
+    for line in table.splitlines():
+        if line.startswith("#"):
+            name, _, value = line[1:].partition(":")
+            field, _, stream = name.rpartition(" ")
+            if field and stream.isdigit():
+                headers.setdefault(int(stream), {})[field] = value.strip()
+            continue
+        columns = [c.strip() for c in line.split(",")]
+        if len(columns) < 6:
+            continue
+        flags = next((int(c[2:], 16) for c in columns[6:] if c.startswith("F=")), None)
+        pts = int(columns[2])
+        if pts == -(2 ** 63): # AV_NOPTS_VALUE
+            continue
+        packets.setdefault(int(columns[0]), []).append((int(columns[1]), pts, int(columns[3]), flags is None or bool(flags & 1)))
+    return headers, packets
+
+def build_media_index(video_path: str) -> MediaIndex:
+    """
+    ソース動画のパケットをデコードせずに一度だけ読み出し、インデックスを作成します。
+    映像ストリームがない場合は ValueError を送出します。
+    """
+    import numpy as np
+    table, log = ffmpeg_tools.read_packet_table(video_path)
+    headers, packets = _parse_packet_table(table)
+    video_info = ffmpeg_tools.parse_video_stream(log)
+    if not video_info or not packets.get(0):
+        raise ValueError(f"映像ストリームが見つかりません: {video_path}")
+
+    end_time = 0.0
+    time_bases = {}
+    for stream, stream_packets in packets.items():
+        numerator, _, denominator = headers.get(stream, {}).get("tb", "1/1").partition("/")
+        time_bases[stream] = int(numerator) / int(denominator or 1)
+        end_time = max(end_time, max(pts + duration for _, pts, duration, _ in stream_packets) * time_bases[stream])
+
+    video_packets = packets[0]
+    frame_times = np.unique(np.array([pts for _, pts, _, _ in video_packets], dtype=np.float64) * time_bases[0])
+    keyframes = np.unique(np.array([pts for _, pts, _, key in video_packets if key], dtype=np.float64) * time_bases[0])
+    if not len(keyframes):
+        keyframes = frame_times[:1]
+    if not video_info["fps"] and len(frame_times) > 1:
+        video_info["fps"] = round((len(frame_times) - 1) / (frame_times[-1] - frame_times[0]), 3)
+    # スマートレンダリングで再エンコードするセグメントをソースと同じパラメータで書き出すための情報
+    # time_base: 映像のタイムベースの分母 / reorder_delay: Bフレームの並べ替えによる先頭のDTSの遅れ（フレーム数）
+    numerator, _, denominator = headers.get(0, {}).get("tb", "1/1").partition("/")
+    video_info["time_base"] = int(denominator) if numerator == "1" and denominator.isdigit() else None
+    first_dts, first_pts, first_duration, _ = video_packets[0]
+    video_info["reorder_delay"] = int(round((first_pts - first_dts) / first_duration)) if first_duration > 0 else None
+    sps = ffmpeg_tools.probe_h264_sps(video_path) if video_info["codec"] == "h264" else None
+    video_info["profile_idc"] = sps["profile_idc"] if sps else None
+    video_info["level_idc"] = sps["level_idc"] if sps else None
+
+    audio_info = ffmpeg_tools.parse_audio_stream(log) if packets.get(1) else None
+    if audio_info:
+        audio_info["channel_layout"] = headers.get(1, {}).get("channel_layout_name")
+
+    stat = os.stat(video_path)
+    info = {
+        "version": MEDIA_INDEX_VERSION,
+        "duration": round(end_time, 6),
+        "container_duration": ffmpeg_tools.parse_duration(log),
+        "frame_count": len(frame_times),
+        "video": video_info,
+        "audio": audio_info,
+        "source": {"size": stat.st_size, "mtime": stat.st_mtime},
+    }
+    return MediaIndex(keyframes, frame_times, info)
+
+def index_key(video_path: str, content_hash: str = None) -> str:
+    """
+    インデックスのキーを返します。コンテンツハッシュがない場合はファイルのパス・サイズ・更新時刻から作ります。
+    """
+    if content_hash:
+        return content_hash
+    stat = os.stat(video_path)
+    payload = json.dumps([os.path.abspath(video_path), stat.st_size, stat.st_mtime_ns])
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def index_path(key: str) -> str:
+    return os.path.join(MEDIA_INDEX_DIR, key[:2], f"{key}.v{MEDIA_INDEX_VERSION}.npz")
+
+def _remember(key: str, index: MediaIndex):
+    with _index_lock:
+        _loaded.pop(key, None)
+        _loaded[key] = index
+        while len(_loaded) > MEDIA_INDEX_MEMORY_ENTRIES:
+            _loaded.pop(next(iter(_loaded)))
+
+def _load(key: str) -> MediaIndex or None:
+    with _index_lock:
+        index = _loaded.get(key)
+    if index is not None:
+        return index
+    path = index_path(key)
+    try:
+        index = MediaIndex.load(path)
+        storage_manager.touch(path)
+    except (OSError, ValueError, KeyError):
+        return None
+    _remember(key, index)
+    return index
+
+def _build_and_store(video_path: str, key: str) -> MediaIndex:
+    try:
+        with metrics.span("media_index_build"):
+            index = build_media_index(video_path)
+        index.save(index_path(key))
+        _remember(key, index)
+        return index
+    except Exception as e:
+        print(f"メディアインデックスの作成中にエラーが発生しました: {e}")
+        with _index_lock:
+            _failed[key] = str(e)
+        raise
+    finally:
+        with _index_lock:
+            _index_futures.pop(key, None)
+
+def start_index_build(video_path: str, content_hash: str = None) -> Future or None:
+    """
+    インデックスの作成をバックグラウンドで開始し、そのFutureを返します。作成中の場合は作成中のFutureを返し、
+    作成済み・作成に失敗済みの場合は何もせずにNoneを返します。
+    """
+    key = index_key(video_path, content_hash)
+    if os.path.exists(index_path(key)):
+        return None
+    with _index_lock:
+        if key in _failed:
+            return None
+        future = _index_futures.get(key)
+        if future is None:
+            future = _index_executor.submit(_build_and_store, video_path, key)
+            _index_futures[key] = future
+    return future
+
+def get_media_index(video_path: str, content_hash: str = None) -> MediaIndex or None:
+    """
+    ソース動画のインデックスを返します。作成されていない場合はその場で作成し、作成中の場合は完了を待ちます。
+    作成できない場合はNoneを返します（呼び出し側はffmpegでの直接の調査に切り替えます）。
+    作成に失敗したことのあるソースでは作り直さずにNoneを返します。
+    """
+    try:
+        key = index_key(video_path, content_hash)
+        index = _load(key)
+        if index is None:
+            future = start_index_build(video_path, content_hash)
+            index = future.result() if future else _load(key)
+        return index
+    except Exception as e:
+        print(f"メディアインデックスの作成中にエラーが発生しました: {e}")
+        return None
+
+def get_ready_index(video_path: str, content_hash: str = None) -> MediaIndex or None:
+    """
+    作成済みのインデックスを返します。まだ作成されていない場合は作成をバックグラウンドで開始してNoneを返します（完了を待ちません）。
+    画面の再実行ごとに呼び出すところで使います。
+    """
+    try:
+        key = index_key(video_path, content_hash)
+        index = _load(key)
+        if index is None:
+            start_index_build(video_path, content_hash)
+        return index
+    except OSError:
+        return None
+
+def validate_clips(edited_clips_data: List[Dict], index: MediaIndex) -> List[Dict]:
+    """
+    クリップの区間をソースの実際の長さと照合し、終了時刻が長さを超えるクリップは切り詰め、
+    開始時刻が長さを超える（空になる）クリップは除いたリストを返します。
+    """
+    validated = []
+    for i, clip_data in enumerate(edited_clips_data):
+        clamped = index.clamp_range(clip_data["start_time"], clip_data["end_time"])
+        if clamped is None:
+            print(f"クリップ {i + 1} の区間 ({clip_data['start_time']}〜{clip_data['end_time']}秒) は動画の長さ ({index.duration:.2f}秒) の範囲外のため、除外しました。")
+            continue
+        if clamped[1] < float(clip_data["end_time"]):
+            print(f"クリップ {i + 1} の終了時刻を動画の長さ ({index.duration:.2f}秒) に合わせました。")
+        validated.append(dict(clip_data, start_time=clamped[0], end_time=clamped[1]))
+    return validated
@@ -0,0 +1,236 @@
+import json
+import logging
+import os
+import resource
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Tuple
+
+# 処理段階ごとの計測（スパン）とメトリクスの出力
+# 環境変数 QUICKCLIP_METRICS=1 で有効になります。無効な場合、span() は共有の何もしないオブジェクトを返すだけなので、
+# 計測箇所を残したままでもほぼコストはかかりません。
+#   - 構造化ログ: スパンが終わるたびに1行のJSONを出力します（既定は標準エラー、METRICS_LOG_PATH でファイルに変更可能）
+#   - Prometheus: METRICS_PORT を指定すると、/metrics でテキスト形式のメトリクスを公開します
+METRICS_ENABLED = os.environ.get("QUICKCLIP_METRICS", "").lower() in ("1", "true", "yes")
+METRICS_PORT = int(os.environ.get("METRICS_PORT", "0"))
+METRICS_LOG_PATH = os.environ.get("METRICS_LOG_PATH")
+METRIC_PREFIX = "quickclip"
+
+_lock = threading.Lock()
+# (名前, ラベル) -> [回数, 合計秒数, 最大秒数]
+_spans: Dict[Tuple[str, Tuple], list] = {}
+# (名前, ラベル) -> 値
+_counters: Dict[Tuple[str, Tuple], float] = {}
+_gauges: Dict[Tuple[str, Tuple], float] = {}
+_server = None
+_logger = None
+
+class _NoopSpan:
+    """
+    メトリクスが無効な場合に返される、何もしないスパンです。
+    """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+    def set(self, **fields):
+        pass
+
+_NOOP_SPAN = _NoopSpan()
+
+class Span:
+    """
+    処理の所要時間を計測し、終了時に集計と構造化ログへ記録します。
+    set(bytes=...) で処理したバイト数を渡すと、スループット (bytes_per_second) も記録します。
+    """
+
+    def __init__(self, name: str, labels: Dict):
+        self.name = name
+        self.labels = labels
+        self.fields = {}
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        duration = time.perf_counter() - self.start
+        key = (self.name, _label_key(self.labels))
+        with _lock:
+            stats = _spans.setdefault(key, [0, 0.0, 0.0])
+            stats[0] += 1
+            stats[1] += duration
+            stats[2] = max(stats[2], duration)
+        record = {"span": self.name, "seconds": round(duration, 6), **self.labels, **self.fields}
+        if "bytes" in self.fields and duration > 0:
+            record["bytes_per_second"] = round(self.fields["bytes"] / duration, 1)
+            increment(f"{self.name}_bytes", self.fields["bytes"], **self.labels)
+        if exc_type is not None:
+            record["error"] = exc_type.__name__
+            increment(f"{self.name}_errors", **self.labels)
+        _log(record)
+        return False
+
+    def set(self, **fields):
+        self.fields.update(fields)
+
+def _label_key(labels: Dict) -> Tuple:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+def _get_logger() -> logging.Logger:
+    global _logger
+    if _logger is None:
+        logger = logging.getLogger("quickclip.metrics")
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+        handler = logging.FileHandler(METRICS_LOG_PATH, encoding="utf-8") if METRICS_LOG_PATH else logging.StreamHandler(sys.stderr)
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        logger.addHandler(handler)
+        _logger = logger
+    return _logger
+
+def _log(record: Dict):
+    record = {"ts": round(time.time(), 3), **record}
+    _get_logger().info(json.dumps(record, ensure_ascii=False, default=str))
+
+def enabled() -> bool:
+    """
+    メトリクスの記録が有効かどうかを返します。計測のための追加処理を省略する判定に使います。
+    """
+    return METRICS_ENABLED
+
+def set_enabled(value: bool):
+    """
+    メトリクスの記録を実行時に有効・無効にします（ベンチマークやバッチ処理向け）。
+    """
+    global METRICS_ENABLED
+    METRICS_ENABLED = value
+
+def span(name: str, **labels):
+    """
+    with文で囲んだ処理の所要時間を計測します。無効な場合は何もしないスパンを返します。
+    """
+    if not METRICS_ENABLED:
+        return _NOOP_SPAN
+    return Span(name, labels)
+
+def increment(name: str, value: float = 1, **labels):
+    """
+    カウンタに値を加算します。
+    """
+    if not METRICS_ENABLED:
+        return
+    key = (name, _label_key(labels))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+def set_gauge(name: str, value: float, **labels):
+    """
+    ゲージの値を設定し、構造化ログにも記録します。
+    """
+    if not METRICS_ENABLED:
+        return
+    with _lock:
+        _gauges[(name, _label_key(labels))] = value
+    _log({"gauge": name, "value": value, **labels})
+
+def log_event(name: str, **fields):
+    """
+    集計せずに構造化ログへ1件のイベントを記録します（クリップごとの内訳など）。
+    """
+    if not METRICS_ENABLED:
+        return
+    _log({"event": name, **fields})
+
+def record_peak_memory(stage: str):
+    """
+    現在までのプロセスと子プロセス（ffmpeg）の最大常駐メモリをゲージとして記録します。
+    """
+    if not METRICS_ENABLED:
+        return
+    # ru_maxrss はLinuxではKB単位
+    set_gauge("peak_rss_bytes", resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024, stage=stage, process="self")
+    set_gauge("peak_rss_bytes", resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * 1024, stage=stage, process="children")
+
+def _escape_label_value(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _format_labels(label_key: Tuple) -> str:
+    if not label_key:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape_label_value(value)}"' for key, value in label_key) + "}"
+
+def render_prometheus() -> str:
+    """
+    記録したメトリクスをPrometheusのテキスト形式で返します。
+    スパンは summary（_count / _sum）と最大値のゲージ、カウンタは _total、ゲージはそのままの名前で出力します。
+    """
+    with _lock:
+        spans = dict(_spans)
+        counters = dict(_counters)
+        gauges = dict(_gauges)
+
+    lines = []
+    for name in sorted({name for name, _ in spans}):
+        metric = f"{METRIC_PREFIX}_{name}_seconds"
+        samples = [(_format_labels(label_key), stats) for (span_name, label_key), stats in sorted(spans.items()) if span_name == name]
+        lines.append(f"# TYPE {metric} summary")
+        for labels, (count, total, _) in samples:
+            lines.append(f"{metric}_count{labels} {count}")
+            lines.append(f"{metric}_sum{labels} {total:.6f}")
+        lines.append(f"# TYPE {metric}_max gauge")
+        for labels, (_, _, maximum) in samples:
+            lines.append(f"{metric}_max{labels} {maximum:.6f}")
+    for name in sorted({name for name, _ in counters}):
+        metric = f"{METRIC_PREFIX}_{name}_total"
+        lines.append(f"# TYPE {metric} counter")
+        for (counter_name, label_key), value in sorted(counters.items()):
+            if counter_name == name:
+                lines.append(f"{metric}{_format_labels(label_key)} {value}")
+    for name in sorted({name for name, _ in gauges}):
+        metric = f"{METRIC_PREFIX}_{name}"
+        lines.append(f"# TYPE {metric} gauge")
+        for (gauge_name, label_key), value in sorted(gauges.items()):
+            if gauge_name == name:
+                lines.append(f"{metric}{_format_labels(label_key)} {value}")
+    return "\n".join(lines) + "\n"
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass # アクセスログは出力しない
+
+def start_metrics_server(port: int = None) -> int or None:
+    """
+    /metrics を公開するHTTPサーバーをバックグラウンドのスレッドで起動し、ポート番号を返します。
+    メトリクスが無効な場合やポートが指定されていない場合は起動せず、Noneを返します。プロセスごとに一度だけ起動します。
+    """
+    global _server
+    port = METRICS_PORT if port is None else port
+    if not METRICS_ENABLED or not port:
+        return None
+    with _lock:
+        if _server is None:
+            try:
+                _server = ThreadingHTTPServer(("0.0.0.0", port), _MetricsHandler)
+            except OSError as e:
+                print(f"メトリクスサーバーの起動に失敗しました: {e}")
+                return None
+            threading.Thread(target=_server.serve_forever, name="metrics-server", daemon=True).start()
+        return _server.server_address[1]
@@ -0,0 +1,188 @@
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+
+from modules import storage_manager, video_editor
+
+# バックグラウンドのレンダリングジョブ管理
+# ジョブはプロセス内のワーカープールで実行されるため、Streamlitのスクリプトの再実行やブラウザの再接続をまたいで存続します。
+
+# 同時に実行するレンダリングジョブ数（デフォルトはCPU数の半分、最低1）
+RENDER_JOB_CONCURRENCY = int(os.environ.get("RENDER_JOB_CONCURRENCY", str(max(1, (os.cpu_count() or 1) // 2))))
+# 完了したジョブの情報を保持する時間（秒）
+FINISHED_JOB_TTL = 24 * 60 * 60
+
+_executor = ThreadPoolExecutor(max_workers=RENDER_JOB_CONCURRENCY, thread_name_prefix="render-job")
+_jobs: Dict[str, Dict] = {}
+_lock = threading.Lock()
+
+class RenderCancelled(Exception):
+    """
+    ジョブのキャンセルによりレンダリングが中断されたことを表します。
+    """
+
+def _update(job_id: str, **fields):
+    with _lock:
+        _jobs[job_id].update(fields)
+
+def _make_progress_callback(job_id: str, cancel_event: threading.Event):
+    """
+    レンダリングの進捗をジョブ情報に反映し、キャンセル要求があれば中断するコールバックを作成します。
+    """
+    def progress_callback(stage: str, done: int, total: int):
+        if cancel_event.is_set():
+            raise RenderCancelled(job_id)
+        now = time.time()
+        with _lock:
+            job = _jobs[job_id]
+            if stage == "frames":
+                job["frames_encoded"] = job["frames_base"] + done
+                job["frame_done"], job["frame_total"] = done, total
+            elif stage == "segments":
+                # セグメントが1つ終わるごとに、エンコード済みフレーム数の基準を進める
+                job["frames_base"] = job["frames_encoded"]
+                job["frame_done"], job["frame_total"] = 0, 0
+                job["segments_done"], job["segments_total"] = done, total
+            elif stage == "parallel_frames":
+                # 並列レンダリングでは、全ワーカーのフレーム数の合計がタイムライン全体に対する進捗になる
+                job["frames_encoded"] = done
+                job["parallel_done"], job["parallel_total"] = done, total
+
+            # MoviePyは末尾で総数より1つ多く報告することがあるため1.0で頭打ちにする
+            frame_fraction = min(1.0, job["frame_done"] / job["frame_total"]) if job["frame_total"] else 0.0
+            if job["parallel_total"]:
+                progress = min(1.0, job["parallel_done"] / job["parallel_total"])
+            elif job["segments_total"]:
+                progress = min(1.0, (job["segments_done"] + frame_fraction) / job["segments_total"])
+            else:
+                progress = min(1.0, frame_fraction)
+            elapsed = now - job["started_at"]
+            eta = elapsed * (1.0 - progress) / progress if progress > 0 else None
+            job.update(stage=stage, progress=progress, eta_seconds=eta, updated_at=now)
+
+    return progress_callback
+
+def _run_job(job_id: str, video_path: str, clips: List[Dict], output_filename: str, render_options: Dict, cancel_event: threading.Event):
+    if cancel_event.is_set():
+        _update(job_id, status="cancelled", finished_at=time.time())
+        return
+    _update(job_id, status="running", started_at=time.time(), stage="prepare")
+    render_options = dict(render_options)
+    renditions = render_options.pop("renditions", None)
+    output_paths = {}
+    # レンダリング中のソースと出力先は容量上限による削除の対象から外し、空き容量が足りなければ先に古いキャッシュを削除する
+    storage_manager.pin(video_path)
+    storage_manager.pin(output_filename)
+    if not storage_manager.ensure_free_space():
+        print("ディスクの空き容量が不足しています。レンダリングに失敗する可能性があります。")
+    try:
+        if renditions:
+            # 複数の出力形式は1回のデコードからまとめて書き出す（ffmpegエンジン）
+            output_paths = video_editor.render_renditions(
+                video_path, clips, renditions, output_filename,
+                profile=render_options.get("profile"), subtitle_mode=render_options.get("subtitle_mode", "burn"),
+                content_hash=render_options.get("content_hash"),
+                progress_callback=_make_progress_callback(job_id, cancel_event)
+            ) or {}
+            output_path = next(iter(output_paths.values()), False)
+        else:
+            output_path = video_editor.render_video(
+                video_path, clips, output_filename,
+                progress_callback=_make_progress_callback(job_id, cancel_event),
+                **render_options
+            )
+    except Exception as e:
+        output_path = False
+        _update(job_id, error=str(e))
+    finally:
+        storage_manager.unpin(video_path)
+        storage_manager.unpin(output_filename)
+
+    if cancel_event.is_set():
+        _update(job_id, status="cancelled", finished_at=time.time())
+        for path in set(output_paths.values()) | ({output_path} if output_path else set()):
+            storage_manager.discard_output(path)
+    elif output_path:
+        _update(job_id, status="completed", output_path=output_path, output_paths=output_paths or None, progress=1.0, eta_seconds=0, finished_at=time.time())
+    else:
+        with _lock:
+            _jobs[job_id].setdefault("error", "レンダリングに失敗しました。")
+        _update(job_id, status="failed", finished_at=time.time())
+
+def _prune_finished_jobs():
+    now = time.time()
+    with _lock:
+        expired = [job_id for job_id, job in _jobs.items() if job.get("finished_at") and now - job["finished_at"] > FINISHED_JOB_TTL]
+        for job_id in expired:
+            del _jobs[job_id]
+
+def submit_render_job(video_path: str, clips: List[Dict], output_filename: str, **render_options) -> str:
+    """
+    レンダリングジョブを登録し、ジョブIDを返します。
+    render_optionsはvideo_editor.render_videoのキーワード引数（smart_render, workers, content_hash など）です。
+    renditionsに出力形式のリストを渡すと video_editor.render_renditions で一度に書き出し、ジョブの output_paths に {形式名: パス} が入ります。
+    """
+    _prune_finished_jobs()
+    job_id = uuid.uuid4().hex[:12]
+    cancel_event = threading.Event()
+    with _lock:
+        _jobs[job_id] = {
+            "id": job_id,
+            "status": "queued",
+            "output_filename": output_filename,
+            "clip_count": len(clips),
+            "stage": "queued",
+            "progress": 0.0,
+            "frames_encoded": 0,
+            "frames_base": 0,
+            "frame_done": 0,
+            "frame_total": 0,
+            "segments_done": 0,
+            "segments_total": 0,
+            "parallel_done": 0,
+            "parallel_total": 0,
+            "eta_seconds": None,
+            "submitted_at": time.time(),
+            "started_at": None,
+            "output_path": None,
+            "output_paths": None,
+            "_cancel_event": cancel_event,
+        }
+        _jobs[job_id]["_future"] = _executor.submit(_run_job, job_id, video_path, clips, output_filename, render_options, cancel_event)
+    return job_id
+
+def get_render_job(job_id: str) -> Dict or None:
+    """
+    ジョブの状態のスナップショットを返します。存在しないジョブの場合はNoneを返します。
+    statusは 'queued' / 'running' / 'completed' / 'failed' / 'cancelled' のいずれかです。
+    """
+    with _lock:
+        job = _jobs.get(job_id)
+        if job is None:
+            return None
+        return {key: value for key, value in job.items() if not key.startswith("_")}
+
+def cancel_render_job(job_id: str) -> bool:
+    """
+    ジョブのキャンセルを要求します。待機中のジョブは即座に、実行中のジョブは次の進捗報告時に中断されます。
+    並列レンダリング中は一定間隔で進捗が報告され、実行中のセグメントの完了を待たずにワーカープロセスを終了します。
+    """
+    with _lock:
+        job = _jobs.get(job_id)
+        if job is None or job["status"] in ("completed", "failed", "cancelled"):
+            return False
+        job["_cancel_event"].set()
+        if job["_future"].cancel():
+            job.update(status="cancelled", finished_at=time.time())
+    return True
+
+def list_render_jobs() -> List[Dict]:
+    """
+    全ジョブの状態を登録順に返します。
+    """
+    with _lock:
+        job_ids = list(_jobs)
+    return [job for job in (get_render_job(job_id) for job_id in job_ids) if job]
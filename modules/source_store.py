@@ -0,0 +1,79 @@
+import hashlib
+import os
+import uuid
+from typing import Tuple
+
+from modules import storage_manager
+
+# アップロードされた動画の保存先（コンテンツハッシュをファイル名とする永続ストア）
+# 同じ内容の動画は一度だけ保存され、解析・レンダリングの両方から同じファイルを参照します。
+SOURCE_DIR = storage_manager.area_path("sources")
+
+# 1GBの動画でもメモリに全体を展開しないよう、固定サイズのチャンクでコピーする
+CHUNK_SIZE = 8 * 1024 * 1024
+
+def stream_upload_to_file(uploaded_file, dest_path: str, chunk_size: int = CHUNK_SIZE) -> str:
+    """
+    アップロードされたファイルをチャンク単位でディスクに書き込み、同時にSHA-256を計算します。
+    書き込みは一時ファイル経由で行い、完了後にdest_pathへ置き換えます。
+    Streamlitの全セッションは同じプロセスで動くため、一時ファイル名はアップロードごとに一意にします。
+    戻り値はファイル内容のSHA-256（16進数）です。
+    """
+    digest = hashlib.sha256()
+    temp_path = f"{dest_path}.{uuid.uuid4().hex}.part"
+    os.makedirs(os.path.dirname(os.path.abspath(dest_path)), exist_ok=True)
+    uploaded_file.seek(0)
+    try:
+        with open(temp_path, "wb") as f:
+            while True:
+                chunk = uploaded_file.read(chunk_size)
+                if not chunk:
+                    break
+                digest.update(chunk)
+                f.write(chunk)
+        os.replace(temp_path, dest_path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+    return digest.hexdigest()
+
+def hash_file(path: str, chunk_size: int = CHUNK_SIZE) -> str:
+    """
+    ディスク上のファイルのSHA-256をチャンク単位で計算します。
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def get_source_path(content_hash: str) -> str or None:
+    """
+    コンテンツハッシュに対応する保存済み動画のパスを返します。存在しない場合はNoneを返します。
+    """
+    if os.path.isdir(SOURCE_DIR):
+        for name in os.listdir(SOURCE_DIR):
+            if os.path.splitext(name)[0] == content_hash:
+                return os.path.join(SOURCE_DIR, name)
+    return None
+
+def ingest_upload(uploaded_file) -> Tuple[str, str]:
+    """
+    アップロードされた動画をソースストアに取り込み、(コンテンツハッシュ, 保存先パス) を返します。
+    同じ内容の動画が既に保存されている場合は、既存のファイルを再利用します。
+    """
+    extension = os.path.splitext(uploaded_file.name)[1].lower()
+    os.makedirs(SOURCE_DIR, exist_ok=True)
+    incoming_path = os.path.join(SOURCE_DIR, f".incoming-{uuid.uuid4().hex}{extension}")
+    try:
+        content_hash = stream_upload_to_file(uploaded_file, incoming_path)
+        existing_path = get_source_path(content_hash)
+        if existing_path:
+            storage_manager.touch(existing_path)
+            return content_hash, existing_path
+        source_path = os.path.join(SOURCE_DIR, f"{content_hash}{extension}")
+        os.replace(incoming_path, source_path)
+        return content_hash, source_path
+    finally:
+        if os.path.exists(incoming_path):
+            os.remove(incoming_path)
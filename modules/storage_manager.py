@@ -0,0 +1,339 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from typing import Dict, List, Tuple
+from urllib.parse import quote
+
+from modules import metrics
+
+# 作業ディレクトリ（アップロード・レンダリング結果・各種キャッシュ・一時ファイル）の管理
+# すべての保存先をここで定義し、領域ごとの容量上限とTTLに従って古いもの（更新時刻が古い順 = LRU）から削除します。
+# 小さなボリューム（Fly.ioなど）でディスクが埋まってレンダリングが失敗しないよう、空き容量が足りない場合は
+# 優先度の低い領域から追加で削除します。
+
+MB = 1024 ** 2
+GB = 1024 ** 3
+HOUR = 60 * 60
+DAY = 24 * HOUR
+
+CACHE_DIR = "./cache"
+# Streamlitの静的ファイル配信 (server.enableStaticServing) の対象ディレクトリ（app.pyと同じ階層の static/）
+STATIC_DIR = "./static"
+STATIC_URL_PREFIX = "app/static"
+# 静的ファイルとして配信する最大サイズ。Streamlitの既定の上限 (200MB) はconfigure_static_servingでこの値に引き上げる
+# 静的配信はtornadoがファイルをチャンク単位で送るため、大きな出力でもメモリに全体を読み込まない
+STATIC_SERVING_MAX_BYTES = int(os.environ.get("STATIC_SERVING_MAX_BYTES", str(8 * GB)))
+# Streamlitの既定の上限（configure_static_servingで引き上げられなかった場合に使う）
+_STREAMLIT_STATIC_MAX_BYTES = 200 * MB
+
+# レンダリング前に確保する空き容量
+MIN_FREE_BYTES = int(os.environ.get("STORAGE_MIN_FREE_BYTES", str(1 * GB)))
+# セッションが使用中として登録（lease）したファイルを削除の対象から外す時間（秒）。画面の再実行ごとに延長される
+SESSION_LEASE_SECONDS = int(os.environ.get("STORAGE_SESSION_LEASE_SECONDS", str(6 * HOUR)))
+# バックグラウンドで容量上限とTTLを適用する間隔（秒）
+JANITOR_INTERVAL = int(os.environ.get("STORAGE_JANITOR_INTERVAL", "600"))
+# 使用量の集計結果を再利用する時間（秒）。ディレクトリの走査を画面の再実行ごとに行わないようにする
+USAGE_CACHE_SECONDS = 30
+
+def _env_bytes(name: str, default: int) -> int or None:
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    return int(value) or None # 0 は上限なし
+
+# 領域ごとの設定
+# path: 保存先 / max_bytes: 容量上限 (Noneは上限なし) / ttl: 最終更新からの保持期間（秒、Noneは無期限）
+# unit: 削除の単位。'file' はファイルごと、'entry' は直下のファイル・ディレクトリごと（ジョブ単位の出力や一時ディレクトリ）
+STORAGE_AREAS = {
+    "work": {"path": os.path.join(CACHE_DIR, "work"), "max_bytes": None, "ttl": 6 * HOUR, "unit": "entry"},
+    "outputs": {"path": os.path.join(STATIC_DIR, "outputs"), "max_bytes": _env_bytes("OUTPUT_MAX_BYTES", 4 * GB), "ttl": DAY, "unit": "entry"},
+    "previews": {"path": os.path.join(CACHE_DIR, "previews"), "max_bytes": _env_bytes("PREVIEW_MAX_BYTES", 512 * MB), "ttl": DAY, "unit": "file"},
+    "proxies": {"path": os.path.join(CACHE_DIR, "proxies"), "max_bytes": _env_bytes("PROXY_MAX_BYTES", 2 * GB), "ttl": 7 * DAY, "unit": "file"},
+    "segments": {"path": os.path.join(CACHE_DIR, "segments"), "max_bytes": _env_bytes("SEGMENT_CACHE_MAX_BYTES", 2 * GB), "ttl": 7 * DAY, "unit": "file"},
+    "captions": {"path": os.path.join(CACHE_DIR, "captions"), "max_bytes": _env_bytes("CAPTION_CACHE_MAX_BYTES", 256 * MB), "ttl": 30 * DAY, "unit": "file"},
+    "analysis": {"path": os.path.join(CACHE_DIR, "analysis"), "max_bytes": 50 * MB, "ttl": 30 * DAY, "unit": "file"},
+    "shots": {"path": os.path.join(CACHE_DIR, "shots"), "max_bytes": 20 * MB, "ttl": None, "unit": "file"},
+    "media_index": {"path": os.path.join(CACHE_DIR, "media_index"), "max_bytes": 128 * MB, "ttl": 30 * DAY, "unit": "file"},
+    "filmstrips": {"path": os.path.join(CACHE_DIR, "filmstrips"), "max_bytes": _env_bytes("FILMSTRIP_MAX_BYTES", 1 * GB), "ttl": 7 * DAY, "unit": "entry"},
+    "font_metadata": {"path": os.path.join(CACHE_DIR, "fonts"), "max_bytes": None, "ttl": None, "unit": "file"},
+    "sources": {"path": "./sources", "max_bytes": _env_bytes("SOURCE_STORE_MAX_BYTES", 8 * GB), "ttl": 7 * DAY, "unit": "file"},
+    "custom_fonts": {"path": os.path.join("./fonts", "custom_fonts"), "max_bytes": _env_bytes("CUSTOM_FONTS_MAX_BYTES", 256 * MB), "ttl": None, "unit": "file"},
+    "google_fonts": {"path": os.path.join("./fonts", "google_fonts"), "max_bytes": None, "ttl": None, "unit": "file"},
+}
+# 空き容量が足りない場合に削除する順序（作り直せるキャッシュから、最後にレンダリング結果）
+# アップロードされた動画は作り直せないため、空き容量の確保では削除せず、TTLと容量上限にのみ従う
+# どの領域でも、セッションが使用中として登録したファイル（lease）とレンダリング中のファイル（pin）は削除しない
+PRESSURE_EVICTION_ORDER = ["previews", "filmstrips", "segments", "captions", "proxies", "outputs"]
+
+_lock = threading.Lock()
+_pinned: Dict[str, int] = {}
+_leases: Dict[str, float] = {}
+_static_max_bytes = _STREAMLIT_STATIC_MAX_BYTES
+_usage_cache: Tuple[float, Dict] = (0.0, None)
+_janitor = None
+
+def area_path(name: str) -> str:
+    """
+    領域の保存先ディレクトリを返します。
+    """
+    return STORAGE_AREAS[name]["path"]
+
+def make_work_dir(prefix: str) -> str:
+    """
+    作業用の一時ディレクトリを work 領域に作成して返します。削除は呼び出し側の責任ですが、
+    異常終了などで残ったものはTTLを過ぎると自動的に削除されます。
+    """
+    os.makedirs(area_path("work"), exist_ok=True)
+    return tempfile.mkdtemp(prefix=prefix, dir=area_path("work"))
+
+def new_output_path(filename: str) -> str:
+    """
+    レンダリング結果の保存先パスを outputs 領域に作成して返します。
+    ジョブごとに推測できない名前のディレクトリを作るため、同名の出力が他のセッションと衝突せず、静的配信のURLも推測されません。
+    """
+    directory = os.path.join(area_path("outputs"), uuid.uuid4().hex)
+    os.makedirs(directory, exist_ok=True)
+    return os.path.join(directory, os.path.basename(filename))
+
+def static_url(path: str) -> str or None:
+    """
+    静的ファイル配信のディレクトリ配下にあり、配信できるサイズのファイルであれば、そのURL（ページからの相対パス）を返します。
+    それ以外の場合はNoneを返します。
+    """
+    relative = os.path.relpath(os.path.abspath(path), os.path.abspath(STATIC_DIR))
+    if relative.startswith(os.pardir) or not os.path.isfile(path) or os.path.getsize(path) > _static_max_bytes:
+        return None
+    return f"{STATIC_URL_PREFIX}/{quote(relative.replace(os.sep, '/'))}"
+
+def configure_static_serving() -> int:
+    """
+    Streamlitの静的ファイル配信の上限を STATIC_SERVING_MAX_BYTES に引き上げ、適用された上限（バイト）を返します。
+    Streamlitの内部の定数を書き換えるため、requirements.txt でStreamlitのバージョンを固定しています。
+    内部構成が変わって引き上げられない場合は警告を表示し、既定の上限のままにします。
+    """
+    global _static_max_bytes
+    try:
+        from streamlit.web.server import app_static_file_handler
+    except ImportError:
+        app_static_file_handler = None
+    if not hasattr(app_static_file_handler, "MAX_APP_STATIC_FILE_SIZE"):
+        print(f"Streamlitの静的ファイル配信の上限を変更できませんでした。{_static_max_bytes // MB}MB を超えるファイルは配信しません。")
+        return _static_max_bytes
+    app_static_file_handler.MAX_APP_STATIC_FILE_SIZE = max(app_static_file_handler.MAX_APP_STATIC_FILE_SIZE, STATIC_SERVING_MAX_BYTES)
+    _static_max_bytes = app_static_file_handler.MAX_APP_STATIC_FILE_SIZE
+    return _static_max_bytes
+
+def pin(path: str):
+    """
+    使用中のファイルを削除の対象から外します（unpinと対で呼び出します）。
+    """
+    path = os.path.abspath(path)
+    with _lock:
+        _pinned[path] = _pinned.get(path, 0) + 1
+
+def unpin(path: str):
+    path = os.path.abspath(path)
+    with _lock:
+        count = _pinned.get(path, 0) - 1
+        if count > 0:
+            _pinned[path] = count
+        else:
+            _pinned.pop(path, None)
+
+def touch(path: str):
+    """
+    ファイルを最近使ったものとして扱います。容量上限による削除は更新時刻の古い順に行われるため、
+    キャッシュ・ソースを再利用したときに呼び出し、使われているものが先に削除されないようにします。
+    """
+    os.utime(path)
+
+def lease(path: str, seconds: int = None):
+    """
+    セッションで使用中のファイル（アップロードした動画・レンダリング結果など）を、一定時間削除の対象から外します。
+    画面の再実行ごとに呼び出して延長し、セッションが終わると期限切れになって通常どおり削除できるようになります。
+    """
+    if not path:
+        return
+    path = os.path.abspath(path)
+    with _lock:
+        _leases[path] = time.time() + (seconds or SESSION_LEASE_SECONDS)
+
+def is_pinned(path: str) -> bool:
+    """
+    ファイル（またはその配下のファイル）がpin・leaseにより削除の対象から外されているかを返します。
+    """
+    path = os.path.abspath(path)
+    now = time.time()
+    with _lock:
+        for leased in [leased for leased, expires_at in _leases.items() if expires_at <= now]:
+            del _leases[leased]
+        return any(held == path or held.startswith(path + os.sep) for held in list(_pinned) + list(_leases))
+
+def _entry_stat(path: str) -> Tuple[float, int]:
+    """
+    ファイルまたはディレクトリの (最終更新時刻, 合計サイズ) を返します。ディレクトリの場合は中のファイルの最新の更新時刻です。
+    """
+    if not os.path.isdir(path):
+        stat = os.stat(path)
+        return stat.st_mtime, stat.st_size
+    latest, total = os.stat(path).st_mtime, 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                stat = os.stat(os.path.join(root, name))
+            except OSError:
+                continue
+            latest = max(latest, stat.st_mtime)
+            total += stat.st_size
+    return latest, total
+
+def _area_entries(name: str) -> List[Tuple[float, int, str]]:
+    """
+    領域内の削除単位を (最終更新時刻, サイズ, パス) のリストで返します。
+    """
+    area = STORAGE_AREAS[name]
+    directory = area["path"]
+    if not os.path.isdir(directory):
+        return []
+    entries = []
+    if area["unit"] == "entry":
+        for entry_name in os.listdir(directory):
+            path = os.path.join(directory, entry_name)
+            try:
+                mtime, size = _entry_stat(path)
+            except OSError:
+                continue
+            entries.append((mtime, size, path))
+    else:
+        for root, _, files in os.walk(directory):
+            for file_name in files:
+                path = os.path.join(root, file_name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+    return entries
+
+def _remove(path: str, area_name: str) -> bool:
+    if is_pinned(path):
+        return False
+    try:
+        if os.path.isdir(path) and not os.path.islink(path):
+            shutil.rmtree(path)
+        else:
+            os.remove(path)
+    except OSError:
+        return False
+    metrics.increment("storage_evictions", area=area_name)
+    return True
+
+def enforce_area(name: str) -> int:
+    """
+    1つの領域にTTLと容量上限を適用し、削除したバイト数を返します。
+    """
+    area = STORAGE_AREAS[name]
+    if not area["ttl"] and not area["max_bytes"]:
+        return 0
+    now = time.time()
+    freed = 0
+    remaining = []
+    for mtime, size, path in _area_entries(name):
+        if area["ttl"] and now - mtime > area["ttl"] and _remove(path, name):
+            freed += size
+        else:
+            remaining.append((mtime, size, path))
+    if area["max_bytes"]:
+        total = sum(size for _, size, _ in remaining)
+        for _, size, path in sorted(remaining):
+            if total <= area["max_bytes"]:
+                break
+            if _remove(path, name):
+                total -= size
+                freed += size
+    return freed
+
+def enforce_quotas() -> int:
+    """
+    全領域にTTLと容量上限を適用し、削除したバイト数の合計を返します。
+    """
+    global _usage_cache
+    freed = 0
+    with metrics.span("storage_enforce"):
+        for name in STORAGE_AREAS:
+            freed += enforce_area(name)
+    _usage_cache = (0.0, None)
+    return freed
+
+def ensure_free_space(required_bytes: int = None) -> bool:
+    """
+    ディスクの空き容量がrequired_bytes（省略時は MIN_FREE_BYTES）以上になるまで、PRESSURE_EVICTION_ORDER の順に古いものから削除します。
+    十分な空き容量を確保できた場合はTrueを返します。
+    """
+    global _usage_cache
+    required_bytes = MIN_FREE_BYTES if required_bytes is None else required_bytes
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    if shutil.disk_usage(CACHE_DIR).free >= required_bytes:
+        return True
+    enforce_quotas()
+    for name in PRESSURE_EVICTION_ORDER:
+        for _, _, path in sorted(_area_entries(name)):
+            if shutil.disk_usage(CACHE_DIR).free >= required_bytes:
+                return True
+            _remove(path, name)
+    _usage_cache = (0.0, None)
+    return shutil.disk_usage(CACHE_DIR).free >= required_bytes
+
+def discard_output(path: str):
+    """
+    レンダリング結果をジョブのディレクトリごと削除します。outputs 領域の外のファイルはそのファイルだけを削除します。
+    """
+    outputs_dir = os.path.abspath(area_path("outputs"))
+    directory = os.path.dirname(os.path.abspath(path))
+    if os.path.dirname(directory) == outputs_dir:
+        shutil.rmtree(directory, ignore_errors=True)
+    elif os.path.exists(path):
+        os.remove(path)
+
+def get_usage(refresh: bool = False) -> Dict:
+    """
+    領域ごとの使用量 {"areas": {名前: {"path", "bytes", "entries", "max_bytes", "ttl"}}, "disk": {"total", "used", "free"}} を返します。
+    集計結果は USAGE_CACHE_SECONDS 秒間再利用します。
+    """
+    global _usage_cache
+    cached_at, cached = _usage_cache
+    if cached and not refresh and time.time() - cached_at < USAGE_CACHE_SECONDS:
+        return cached
+    areas = {}
+    for name, area in STORAGE_AREAS.items():
+        entries = _area_entries(name)
+        total = sum(size for _, size, _ in entries)
+        areas[name] = {"path": area["path"], "bytes": total, "entries": len(entries), "max_bytes": area["max_bytes"], "ttl": area["ttl"]}
+        metrics.set_gauge("storage_bytes", total, area=name)
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    disk = shutil.disk_usage(CACHE_DIR)
+    usage = {"areas": areas, "disk": {"total": disk.total, "used": disk.used, "free": disk.free}}
+    _usage_cache = (time.time(), usage)
+    return usage
+
+def _janitor_loop(interval: int):
+    while True:
+        try:
+            enforce_quotas()
+            ensure_free_space()
+        except Exception as e:
+            print(f"ストレージの整理中にエラーが発生しました: {e}")
+        time.sleep(interval)
+
+def start_janitor(interval: int = None):
+    """
+    容量上限・TTL・空き容量の確保を定期的に行うバックグラウンドスレッドを起動します。プロセスごとに一度だけ起動します。
+    """
+    global _janitor
+    with _lock:
+        if _janitor is None:
+            _janitor = threading.Thread(target=_janitor_loop, args=(interval or JANITOR_INTERVAL,), name="storage-janitor", daemon=True)
+            _janitor.start()
@@ -0,0 +1,210 @@
+import os
+import shutil
+from typing import Dict, List, Tuple
+
+from PIL import ImageColor
+
+from modules import caption_renderer
+
+# 編集クリップのテロップを字幕ファイル (SRT / ASS) として書き出す処理
+# ASSではクリップごとのフォント・サイズ・色・位置・背景を字幕スタイルに変換し、ffmpeg (libass) で一度に焼き込めるようにします。
+# 字幕の時刻はソース動画ではなく、クリップを結合した出力動画のタイムライン上の時刻です。
+
+SUBTITLE_FORMATS = ("srt", "ass")
+# フォントが指定されていない場合にlibassへ渡すフォント名（fontconfigで代替フォントが選ばれる）
+DEFAULT_FONT_NAME = "Sans"
+
+def caption_events(edited_clips_data: List[Dict]) -> List[Tuple[float, float, Dict]]:
+    """
+    テロップのあるクリップを、出力動画上の (開始秒, 終了秒, text_params) のリストに変換します。
+    """
+    events = []
+    offset = 0.0
+    for clip_data in edited_clips_data:
+        duration = float(clip_data["end_time"]) - float(clip_data["start_time"])
+        if duration <= 0:
+            continue
+        text_params = clip_data.get("text_params")
+        if text_params and text_params.get("text"):
+            events.append((offset, offset + duration, text_params))
+        offset += duration
+    return events
+
+def _format_srt_time(seconds: float) -> str:
+    millis = int(round(seconds * 1000))
+    hours, millis = divmod(millis, 3600 * 1000)
+    minutes, millis = divmod(millis, 60 * 1000)
+    secs, millis = divmod(millis, 1000)
+    return f"{hours:02d}:{minutes:02d}:{secs:02d},{millis:03d}"
+
+def _format_ass_time(seconds: float) -> str:
+    centis = int(round(seconds * 100))
+    hours, centis = divmod(centis, 3600 * 100)
+    minutes, centis = divmod(centis, 60 * 100)
+    secs, centis = divmod(centis, 100)
+    return f"{hours:d}:{minutes:02d}:{secs:02d}.{centis:02d}"
+
+def build_srt(edited_clips_data: List[Dict]) -> str:
+    """
+    テロップをSRT形式の文字列に変換します。SRTにはスタイルがないため、テキストと時刻のみを出力します。
+    """
+    blocks = []
+    for index, (start, end, text_params) in enumerate(caption_events(edited_clips_data), start=1):
+        blocks.append(f"{index}\n{_format_srt_time(start)} --> {_format_srt_time(end)}\n{text_params['text'].strip()}\n")
+    return "\n".join(blocks)
+
+def _ass_color(color: str, alpha: int = 0) -> str:
+    """
+    '#RRGGBB' や 'white' などの色指定をASSの &HAABBGGRR 形式に変換します（alphaは0が不透明）。
+    """
+    rgb = ImageColor.getrgb(color)
+    if len(rgb) == 4:
+        alpha = 255 - rgb[3]
+    return f"&H{alpha:02X}{rgb[2]:02X}{rgb[1]:02X}{rgb[0]:02X}"
+
+def _anchor(position, frame_size: int, padding: int) -> Tuple[int, int]:
+    """
+    テロップ位置の1軸分を、ASSの配置（0: 左/上、1: 中央、2: 右/下）と基準座標に変換します。
+    caption_rendererと同じく、テロップの背景（余白を含む）の端が指定位置に来るように余白分ずらします。
+    """
+    if position == "center":
+        return 1, frame_size // 2
+    if position in ("right", "bottom"):
+        return 2, frame_size - padding
+    return 0, caption_renderer.resolve_position(position, frame_size, 0) + padding
+
+def _caption_style(text_params: Dict, video_size: Tuple[int, int], safe_area: float = 0.0) -> Tuple[Dict, str]:
+    """
+    text_paramsからASSのスタイルと、折り返し済みのテキスト（位置指定が必要な場合は \\pos タグ付き）を作成します。
+    safe_areaは上下の端から空けておく領域の割合で、top / bottom 指定のテロップをその分だけ内側に置きます。
+    """
+    width, height = video_size
+    font_path = text_params.get("font_path")
+    font_size = int(text_params.get("font_size", 50))
+    font = caption_renderer.load_font(font_path, font_size)
+    padding = max(2, int(font_size * 0.2))
+
+    font_name = DEFAULT_FONT_NAME
+    if font_path and os.path.exists(font_path):
+        font_name = font.getname()[0] or DEFAULT_FONT_NAME
+    # libassのフォントサイズはアセントとディセントの合計（行の高さ）なので、Pillowの描画と同じ大きさになるよう換算する
+    ascent, descent = font.getmetrics()
+
+    position = text_params.get("text_position") or ("center", "bottom")
+    column, x = _anchor(position[0], width, padding)
+    row, y = _anchor(position[1], height, padding)
+    # テンキー配置: 下段 1-3, 中段 4-6, 上段 7-9
+    alignment = {0: 7, 1: 4, 2: 1}[row] + column
+
+    bg_color = text_params.get("bg_color")
+    style = {
+        "Fontname": font_name,
+        "Fontsize": ascent + descent,
+        "PrimaryColour": _ass_color(text_params.get("font_color", "white")),
+        # BorderStyle=3 (背景ボックス) ではOutlineColourがボックスの色になる
+        "OutlineColour": _ass_color(bg_color) if bg_color else "&H00000000",
+        "BackColour": _ass_color(bg_color) if bg_color else "&H00000000",
+        "BorderStyle": 3 if bg_color else 1,
+        "Outline": padding if bg_color else 0,
+        "Alignment": alignment,
+        "MarginL": padding,
+        "MarginR": padding,
+        "MarginV": padding + int(height * safe_area),
+    }
+
+    lines = caption_renderer.wrap_text(text_params["text"], font, int(width * 0.9) - 2 * padding)
+    text = "\\N".join(line.replace("{", "\\{").replace("}", "\\}") for line in lines)
+    # left/center/right などのキーワードだけならスタイルの配置と余白で表現できる。割合やピクセルの指定は \pos で位置を固定する
+    if not all(p in ("left", "center", "right", "top", "bottom") for p in position):
+        text = f"{{\\pos({x},{y})}}" + text
+    return style, text
+
+_ASS_STYLE_FIELDS = [
+    "Name", "Fontname", "Fontsize", "PrimaryColour", "SecondaryColour", "OutlineColour", "BackColour",
+    "Bold", "Italic", "Underline", "StrikeOut", "ScaleX", "ScaleY", "Spacing", "Angle",
+    "BorderStyle", "Outline", "Shadow", "Alignment", "MarginL", "MarginR", "MarginV", "Encoding",
+]
+_ASS_STYLE_DEFAULTS = {
+    "SecondaryColour": "&H00FFFFFF", "Bold": 0, "Italic": 0, "Underline": 0, "StrikeOut": 0,
+    "ScaleX": 100, "ScaleY": 100, "Spacing": 0, "Angle": 0, "Shadow": 0, "Encoding": 1,
+}
+
+def build_ass(edited_clips_data: List[Dict], video_size: Tuple[int, int], safe_area: float = 0.0) -> str:
+    """
+    テロップをASS形式の文字列に変換します。同じ見た目のテロップは1つのスタイルにまとめます。
+    video_sizeは出力動画の (幅, 高さ) で、ASSの座標系 (PlayResX/PlayResY) として使われます。
+    safe_areaを指定すると、上下の端に寄せたテロップをフレームの高さのその割合だけ内側に置きます（縦型動画でアプリのUIを避ける用途）。
+    """
+    styles = {}
+    dialogues = []
+    for start, end, text_params in caption_events(edited_clips_data):
+        style, text = _caption_style(text_params, video_size, safe_area)
+        key = tuple(sorted(style.items()))
+        if key not in styles:
+            styles[key] = dict(_ASS_STYLE_DEFAULTS, Name=f"Caption{len(styles) + 1}", **style)
+        dialogues.append(f"Dialogue: 0,{_format_ass_time(start)},{_format_ass_time(end)},{styles[key]['Name']},,0,0,0,,{text}")
+
+    lines = [
+        "[Script Info]",
+        "ScriptType: v4.00+",
+        f"PlayResX: {video_size[0]}",
+        f"PlayResY: {video_size[1]}",
+        # 折り返しは caption_renderer と同じ規則で事前に行うため、libassの自動折り返しは無効にする
+        "WrapStyle: 2",
+        "ScaledBorderAndShadow: yes",
+        "YCbCr Matrix: None",
+        "",
+        "[V4+ Styles]",
+        "Format: " + ", ".join(_ASS_STYLE_FIELDS),
+    ]
+    lines += ["Style: " + ",".join(str(style[field]) for field in _ASS_STYLE_FIELDS) for style in styles.values()]
+    lines += ["", "[Events]", "Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text"]
+    lines += dialogues
+    return "\n".join(lines) + "\n"
+
+def write_subtitles(edited_clips_data: List[Dict], output_path: str, video_size: Tuple[int, int] = None, safe_area: float = 0.0) -> str:
+    """
+    拡張子 (.srt / .ass) に応じた形式で字幕ファイルを書き出し、そのパスを返します。ASSの場合はvideo_sizeが必要です。
+    """
+    subtitle_format = os.path.splitext(output_path)[1].lstrip(".").lower()
+    if subtitle_format not in SUBTITLE_FORMATS:
+        raise ValueError(f"対応していない字幕形式です: {output_path} (指定可能: {', '.join(SUBTITLE_FORMATS)})")
+    content = build_ass(edited_clips_data, video_size, safe_area) if subtitle_format == "ass" else build_srt(edited_clips_data)
+    with open(output_path, "w", encoding="utf-8") as f:
+        f.write(content)
+    return output_path
+
+def link_fonts(edited_clips_data: List[Dict], fonts_dir: str) -> str:
+    """
+    テロップで使うフォントファイルをfonts_dirにまとめます（シンボリックリンク、作れない場合はコピー）。
+    libassにはこのディレクトリを fontsdir として渡し、システムにないフォントも名前で見つけられるようにします。
+    """
+    os.makedirs(fonts_dir, exist_ok=True)
+    font_paths = {os.path.abspath(text_params["font_path"]) for _, _, text_params in caption_events(edited_clips_data)
+                  if text_params.get("font_path") and os.path.exists(text_params["font_path"])}
+    for i, font_path in enumerate(sorted(font_paths)):
+        link_path = os.path.join(fonts_dir, f"{i:03d}_{os.path.basename(font_path)}")
+        try:
+            os.symlink(font_path, link_path)
+        except OSError:
+            shutil.copyfile(font_path, link_path)
+    return fonts_dir
+
+def _escape_filter_value(value: str) -> str:
+    """
+    フィルタのオプション値として渡す文字列を、オプションとフィルタグラフの2段階でエスケープします。
+    """
+    for char in "\\':":
+        value = value.replace(char, "\\" + char)
+    for char in "\\'[],;":
+        value = value.replace(char, "\\" + char)
+    return value
+
+def ass_filter(ass_path: str, fonts_dir: str = None) -> str:
+    """
+    ASS字幕を焼き込むffmpegのフィルタ指定を返します。
+    """
+    options = f"filename={_escape_filter_value(os.path.abspath(ass_path))}"
+    if fonts_dir:
+        options += f":fontsdir={_escape_filter_value(os.path.abspath(fonts_dir))}"
+    return f"ass={options}"
@@ -1,60 +1,745 @@
 import streamlit as st
-import google.generativeai as genai
+import asyncio
+import hashlib
+import json
 import os
+import random
+import shutil
+import threading
+import time
+import unicodedata
+from typing import Dict, List, Tuple, TYPE_CHECKING
+
+from modules import ffmpeg_tools, media_index, metrics, source_store, storage_manager
+from modules.disk_cache import DiskCache
+
+if TYPE_CHECKING:
+    import numpy as np
 
 # Google Gemini APIキーの設定
-# 環境変数 'GEMINI_API_KEY' から取得するか、st.secrets を使用
-# genai.configure(api_key=os.environ.get("GEMINI_API_KEY"))
+# google.generativeai は読み込みに時間がかかるため、初めてAPIを呼び出す時点で読み込む（コールドスタート対策）
+_gemini_api_key = None
+_genai = None
+# APIの接続先（例: http://127.0.0.1:8080 のローカルの擬似エンドポイント）。設定した場合はRESTで接続する
+GEMINI_API_ENDPOINT = os.environ.get("GEMINI_API_ENDPOINT")
+
+def configure_gemini(api_key: str):
+    """
+    Gemini APIキーを設定します。SDKが未読み込みの場合は、読み込み時に適用されます。
+    """
+    global _gemini_api_key
+    _gemini_api_key = api_key
+    if _genai is not None:
+        _configure(_genai)
+
+def _get_genai():
+    """
+    google.generativeai を必要になった時点で読み込み、APIキーを設定して返します。
+    """
+    global _genai
+    if _genai is None:
+        import google.generativeai as genai
+        _configure(genai)
+        _genai = genai
+    return _genai
+
+def _configure(genai):
+    """
+    APIキーと、GEMINI_API_ENDPOINT が設定されている場合は接続先を設定します。
+    """
+    if not _gemini_api_key and not GEMINI_API_ENDPOINT:
+        return
+    options = {"api_key": _gemini_api_key}
+    if GEMINI_API_ENDPOINT:
+        options.update(transport="rest", client_options={"api_endpoint": GEMINI_API_ENDPOINT})
+        # File APIへのアップロードは探索ドキュメント (discovery) に書かれた接続先に送られるため、探索ドキュメントも同じ接続先から取得する
+        from google.generativeai import client
+        client.GENAI_API_DISCOVERY_URL = f"{GEMINI_API_ENDPOINT.rstrip('/')}/$discovery/rest"
+    genai.configure(**options)
+
+# アップロード済みGeminiファイルのレジストリ（コンテンツハッシュ → ファイル名・状態・有効期限）
+GEMINI_REGISTRY_PATH = os.path.join(storage_manager.CACHE_DIR, "gemini_files.json")
+# File APIのファイルは48時間で削除される。expiration_timeが取得できない場合はこの値を使う
+GEMINI_FILE_DEFAULT_TTL = 48 * 60 * 60
+# 期限切れ直前のファイルは再利用せず、再アップロードする
+GEMINI_FILE_EXPIRY_MARGIN = 60 * 60
+_registry_lock = threading.Lock()
+
+# シーン抽出に使うモデル（環境変数 GEMINI_MODEL で変更可能）
+DEFAULT_ANALYSIS_MODEL = os.environ.get("GEMINI_MODEL", "gemini-2.5-flash")
+# シーン抽出結果のキャッシュ（動画ハッシュ・正規化したプロンプト・モデル名をキーとする）
+ANALYSIS_CACHE_DIR = storage_manager.area_path("analysis")
+ANALYSIS_CACHE_VERSION = 1
+analysis_cache = DiskCache(ANALYSIS_CACHE_DIR, max_bytes=storage_manager.STORAGE_AREAS["analysis"]["max_bytes"], ttl=storage_manager.STORAGE_AREAS["analysis"]["ttl"])
+
+# ローカルのショット検出（縮小フレームを一度だけデコードしてカットを検出する）
+SHOT_INDEX_CACHE_DIR = storage_manager.area_path("shots")
+SHOT_INDEX_VERSION = 1
+SHOT_DETECTION_FPS = 4
+SHOT_DETECTION_SIZE = (64, 36)
+shot_index_cache = DiskCache(SHOT_INDEX_CACHE_DIR, max_bytes=storage_manager.STORAGE_AREAS["shots"]["max_bytes"])
+# キーフレームのみを送る場合の1リクエストあたりの最大枚数
+MAX_KEYFRAMES_PER_REQUEST = 60
+
+SCENE_EXTRACTION_INSTRUCTION = """あなたは動画編集アシスタントです。次の指示に従って、この動画から該当するシーンを抽出してください。
+
+指示: {prompt}
+
+結果は次の形式のJSON配列のみで返してください。時間は動画の先頭からの秒数です。
+[{{"start_time": 0.0, "end_time": 5.0, "caption": "シーンに付けるテロップ"}}]
+"""
+
+def ingest_uploaded_video(uploaded_file) -> Tuple[str, str] or None:
+    """
+    StreamlitのUploadedFileオブジェクトをチャンク単位でソースストアに保存します。
+    成功した場合、(コンテンツハッシュ, 保存先パス) を返します。
+    """
+    if uploaded_file is None:
+        return None
+    try:
+        # Note: 1GB対応のため、getbuffer()でまとめて書き込まず固定サイズのチャンクでコピーする
+        with metrics.span("source_ingest") as span:
+            content_hash, source_path = source_store.ingest_upload(uploaded_file)
+            span.set(bytes=os.path.getsize(source_path))
+        return content_hash, source_path
+    except Exception as e:
+        st.error(f"動画ファイルの保存中にエラーが発生しました: {e}", icon="\u274C")
+        return None
+
+def _load_gemini_registry() -> Dict[str, Dict]:
+    """
+    コンテンツハッシュ → Geminiファイル情報 のレジストリをディスクから読み込みます。
+    """
+    try:
+        with open(GEMINI_REGISTRY_PATH, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def _save_gemini_registry(registry: Dict[str, Dict]):
+    """
+    レジストリを一時ファイル経由で書き込み、途中で壊れたファイルが残らないようにします。
+    """
+    os.makedirs(os.path.dirname(GEMINI_REGISTRY_PATH), exist_ok=True)
+    temp_path = f"{GEMINI_REGISTRY_PATH}.{os.getpid()}.tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        json.dump(registry, f, ensure_ascii=False, indent=2)
+    os.replace(temp_path, GEMINI_REGISTRY_PATH)
+
+def _file_state_name(file) -> str:
+    """
+    FileオブジェクトからPROCESSING / ACTIVE / FAILED などの状態名を取り出します。
+    """
+    state = getattr(file, "state", None)
+    return getattr(state, "name", None) or (str(state) if state is not None else "STATE_UNSPECIFIED")
+
+def _record_gemini_file(content_hash: str, file, display_name: str = None) -> Dict:
+    """
+    Fileオブジェクトの状態と有効期限をレジストリに記録します。
+    """
+    expiration = getattr(file, "expiration_time", None)
+    with _registry_lock:
+        registry = _load_gemini_registry()
+        previous = registry.get(content_hash, {}) if registry.get(content_hash, {}).get("name") == file.name else {}
+        entry = {
+            "name": file.name,
+            "display_name": display_name or getattr(file, "display_name", None) or previous.get("display_name"),
+            "state": _file_state_name(file),
+            "expires_at": expiration.timestamp() if expiration else previous.get("expires_at", time.time() + GEMINI_FILE_DEFAULT_TTL),
+            "checked_at": time.time(),
+        }
+        registry[content_hash] = entry
+        _save_gemini_registry(registry)
+    return entry
+
+def get_registered_gemini_file(content_hash: str) -> Dict or None:
+    """
+    コンテンツハッシュに対応する、まだ有効なGeminiファイルの登録情報を返します。
+    期限切れ間近または処理に失敗したファイルはNoneを返します。
+    """
+    if not content_hash:
+        return None
+    with _registry_lock:
+        entry = _load_gemini_registry().get(content_hash)
+    if not entry or entry.get("state") == "FAILED":
+        return None
+    if entry.get("expires_at", 0) - GEMINI_FILE_EXPIRY_MARGIN < time.time():
+        return None
+    return entry
+
+def _discard_failed_gemini_file(content_hash: str):
+    """
+    処理に失敗したファイルをレジストリから外し、File APIからも削除します（再アップロードの前に呼び出します）。
+    期限切れ間近のファイルは他のセッションが解析中の可能性があるため削除せず、File APIの自動削除に任せます。
+    """
+    if not content_hash:
+        return
+    with _registry_lock:
+        registry = _load_gemini_registry()
+        entry = registry.get(content_hash)
+        if not entry or entry.get("state") != "FAILED":
+            return
+        registry.pop(content_hash)
+        _save_gemini_registry(registry)
+    try:
+        _get_genai().delete_file(name=entry["name"])
+    except Exception as e:
+        print(f"処理に失敗したGeminiファイルの削除中にエラーが発生しました: {e}")
 
-def upload_video_to_gemini(uploaded_file):
+def upload_video_to_gemini(video_path: str, display_name: str, content_hash: str = None):
     """
-    StreamlitのUploadedFileオブジェクトを受け取り、Gemini File APIに動画をアップロードします。
+    ソースストアに保存済みの動画をGemini File APIにアップロードします。
+    同じ内容の動画が有効期限内にアップロード済みの場合は、転送せずに既存のファイルを再利用します。
     アップロードが成功した場合、Fileオブジェクトのname (ファイルID) を返します。
     """
-    if uploaded_file is not None:
-        st.info(f"動画ファイル '{uploaded_file.name}' をアップロード中...", icon="upload")
-        try:
-            # アップロードされたファイルを一時的に保存（File APIがファイルパスを必要とするため）
-            # Note: 1GB対応のため、メモリに直接読み込まずファイルとして扱う
-            temp_file_path = os.path.join("/tmp", uploaded_file.name)
-            with open(temp_file_path, "wb") as f:
-                f.write(uploaded_file.getbuffer())
+    registered = get_registered_gemini_file(content_hash)
+    if registered:
+        st.success(f"動画ファイル '{display_name}' はアップロード済みのため再利用します。ファイルID: {registered['name']}", icon="\u2705")
+        return registered["name"]
+    _discard_failed_gemini_file(content_hash)
 
-            # Gemini File APIにアップロード
-            # get_default_retrying_client().upload_file(file_path=temp_file_path) のように使うことも可能
-            file = genai.upload_file(path=temp_file_path, display_name=uploaded_file.name)
-            st.success(f"動画ファイル '{uploaded_file.name}' のアップロードが完了しました。ファイルID: {file.name}", icon="\u2705")
+    st.info(f"動画ファイル '{display_name}' をアップロード中...", icon=":material/upload:")
+    try:
+        # Gemini File APIにアップロード（ソースストアのファイルはレンダリングでも使うため削除しない）
+        # get_default_retrying_client().upload_file(file_path=video_path) のように使うことも可能
+        with metrics.span("gemini_upload") as span:
+            file = _get_genai().upload_file(path=video_path, display_name=display_name)
+            span.set(bytes=os.path.getsize(video_path))
+        if content_hash:
+            _record_gemini_file(content_hash, file, display_name)
+        st.success(f"動画ファイル '{display_name}' のアップロードが完了しました。ファイルID: {file.name}", icon="\u2705")
+        return file.name # ファイルIDを返す
 
-            # 一時ファイルを削除
-            os.remove(temp_file_path)
+    except Exception as e:
+        st.error(f"動画ファイルのアップロード中にエラーが発生しました: {e}", icon="\u274C")
+        if "429 Resource Exhausted" in str(e):
+            st.warning("APIレート制限に達した可能性があります。しばらく待ってから再試行してください。")
+        return None
 
-            return file.name # ファイルIDを返す
+def refresh_gemini_file_state(file_id: str, content_hash: str = None) -> str:
+    """
+    Geminiファイルの処理状態を一度だけ問い合わせ、レジストリを更新して状態名を返します。
+    ブロックしないため、Streamlitのフラグメントから定期的に呼び出せます。
+    ファイルが見つからない場合はレジストリから削除し、'MISSING' を返します。
+    """
+    try:
+        with metrics.span("gemini_get_file"):
+            file = _get_genai().get_file(name=file_id)
+    except Exception as e:
+        if "404" in str(e) or "not found" in str(e).lower():
+            if content_hash:
+                with _registry_lock:
+                    registry = _load_gemini_registry()
+                    registry.pop(content_hash, None)
+                    _save_gemini_registry(registry)
+            return "MISSING"
+        print(f"Geminiファイルの状態取得中にエラーが発生しました: {e}")
+        return "UNKNOWN"
+    if content_hash:
+        _record_gemini_file(content_hash, file)
+    return _file_state_name(file)
 
-        except Exception as e:
-            st.error(f"動画ファイルのアップロード中にエラーが発生しました: {e}", icon="\u274C")
-            if "429 Resource Exhausted" in str(e):
-                st.warning("APIレート制限に達した可能性があります。しばらく待ってから再試行してください。")
-            return None
-    return None
+def wait_for_gemini_file_active(file_id: str, content_hash: str = None, timeout: float = 600, initial_delay: float = 1.0, max_delay: float = 30.0) -> bool:
+    """
+    ファイルがACTIVEになるまで指数バックオフで状態をポーリングします。
+    バックグラウンド処理やバッチ処理向けで、Streamlitのスクリプトからは refresh_gemini_file_state を使ってください。
+    """
+    delay = initial_delay
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        state = refresh_gemini_file_state(file_id, content_hash)
+        if state == "ACTIVE":
+            return True
+        if state in ("FAILED", "MISSING"):
+            return False
+        time.sleep(min(delay, max(0.0, deadline - time.time())))
+        delay = min(delay * 2, max_delay)
+    return False
 
 def get_gemini_file(file_id: str):
     """
     Gemini File APIからファイルIDに基づいてFileオブジェクトを取得します。
     """
     try:
-        file = genai.get_file(name=file_id)
+        file = _get_genai().get_file(name=file_id)
         return file
     except Exception as e:
         st.error(f"Gemini File APIからのファイル取得中にエラーが発生しました: {e}", icon="\u274C")
         return None
 
+def detect_scene_cuts(frames: "np.ndarray", sample_fps: float, threshold: float = 0.3, min_shot_length: float = 1.0) -> List[float]:
+    """
+    縮小済みのグレースケールフレーム (N, H, W) からカット位置（秒）を検出します。
+    隣接フレーム間の輝度ヒストグラム差分と平均輝度差分をベクトル演算でまとめて計算し、
+    固定しきい値と全体の分布（中央値 + MAD）の両方を超えたフレームをカットとみなします。
+    """
+    import numpy as np
+    count = len(frames)
+    if count < 2:
+        return []
+    pixels = frames.reshape(count, -1)
+    # 32ビンのヒストグラムを全フレーム分まとめてbincountで求める
+    bins = (pixels >> 3).astype(np.int64) + (np.arange(count, dtype=np.int64) * 32)[:, None]
+    histograms = np.bincount(bins.ravel(), minlength=count * 32).reshape(count, 32) / pixels.shape[1]
+    histogram_diff = 0.5 * np.abs(np.diff(histograms, axis=0)).sum(axis=1)
+    luma_diff = np.abs(np.diff(pixels.astype(np.int16), axis=0)).mean(axis=1) / 255.0
+    scores = 0.5 * histogram_diff + 0.5 * luma_diff
+
+    median = np.median(scores)
+    mad = np.median(np.abs(scores - median))
+    adaptive = median + 6.0 * mad
+    candidates = np.flatnonzero((scores > threshold) & (scores > adaptive))
+
+    cuts = []
+    min_gap = int(round(min_shot_length * sample_fps))
+    for index in candidates:
+        frame_index = index + 1
+        if cuts and frame_index - cuts[-1] < min_gap:
+            # 近接した候補はスコアの高い方を残す
+            if scores[index] > scores[cuts[-1] - 1]:
+                cuts[-1] = frame_index
+            continue
+        cuts.append(frame_index)
+    return [round(float(i) / sample_fps, 3) for i in cuts]
+
+def get_shot_index(video_path: str, content_hash: str) -> Dict:
+    """
+    動画のショットインデックス（カット位置とショット区間）を返します。
+    一度計算した結果はコンテンツハッシュをキーにキャッシュされ、同じ動画では再デコードしません。
+    """
+    key = hashlib.sha256(json.dumps([SHOT_INDEX_VERSION, content_hash, SHOT_DETECTION_FPS]).encode("utf-8")).hexdigest()
+    cached = shot_index_cache.get_json(key)
+    if cached is not None:
+        return cached
+
+    with metrics.span("shot_detection") as span:
+        frames = ffmpeg_tools.read_raw_frames(video_path, SHOT_DETECTION_FPS, *SHOT_DETECTION_SIZE)
+        duration = round(len(frames) / SHOT_DETECTION_FPS, 3)
+        cuts = detect_scene_cuts(frames, SHOT_DETECTION_FPS)
+        span.set(duration=duration, cuts=len(cuts))
+    boundaries = [0.0] + cuts + [duration]
+    shot_index = {
+        "duration": duration,
+        "cuts": cuts,
+        "shots": [[start, end] for start, end in zip(boundaries[:-1], boundaries[1:]) if end > start],
+    }
+    shot_index_cache.put_json(key, shot_index)
+    return shot_index
+
+def snap_scenes_to_cuts(scenes: List[Dict], shot_index: Dict, tolerance: float = 1.0) -> List[Dict]:
+    """
+    AIが返したstart_time / end_timeを、tolerance秒以内にある実際のカット位置に合わせます。
+    """
+    import numpy as np
+    boundaries = np.array([0.0] + shot_index["cuts"] + [shot_index["duration"]])
+
+    def snap(value: float) -> float:
+        nearest = boundaries[np.abs(boundaries - value).argmin()]
+        return float(nearest) if abs(nearest - value) <= tolerance else value
+
+    snapped = []
+    for scene in scenes:
+        start_time, end_time = snap(scene["start_time"]), snap(scene["end_time"])
+        if end_time <= start_time:
+            start_time, end_time = scene["start_time"], scene["end_time"]
+        snapped.append(dict(scene, start_time=start_time, end_time=end_time))
+    return snapped
+
+def _describe_shots(shot_index: Dict) -> str:
+    """
+    ショット区間をプロンプトに含めるための文字列に変換します。
+    """
+    return "\n".join(f"- ショット{i + 1}: {start:.2f}秒 〜 {end:.2f}秒" for i, (start, end) in enumerate(shot_index["shots"]))
+
+def _select_keyframe_shots(shot_index: Dict) -> List[List[float]]:
+    """
+    キーフレームを送るショットを選びます。ショット数が上限を超える場合は等間隔に間引きます。
+    """
+    import numpy as np
+    shots = shot_index["shots"]
+    if len(shots) <= MAX_KEYFRAMES_PER_REQUEST:
+        return shots
+    indices = np.linspace(0, len(shots) - 1, MAX_KEYFRAMES_PER_REQUEST).round().astype(int)
+    return [shots[i] for i in sorted(set(indices))]
+
+def _normalize_prompt(prompt: str) -> str:
+    """
+    全角・半角や空白の違いだけの指示が同じキャッシュキーになるよう、プロンプトを正規化します。
+    """
+    return " ".join(unicodedata.normalize("NFKC", prompt).split())
+
+def _analysis_cache_key(content_hash: str, prompt: str, model_name: str) -> str:
+    payload = json.dumps([ANALYSIS_CACHE_VERSION, content_hash, _normalize_prompt(prompt), model_name], ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def _parse_timestamp(value) -> float:
+    """
+    秒数、または 'MM:SS' / 'HH:MM:SS' 形式のタイムスタンプを秒に変換します。
+    """
+    if isinstance(value, (int, float)):
+        return float(value)
+    seconds = 0.0
+    for part in str(value).strip().split(":"):
+        seconds = seconds * 60 + float(part)
+    return seconds
+
+def parse_scene_response(text: str) -> List[Dict]:
+    """
+    Geminiの応答（JSON）を {"start_time", "end_time", "caption"} のリストに変換します。
+    """
+    cleaned = text.strip()
+    if cleaned.startswith("```"):
+        cleaned = cleaned.strip("`")
+        cleaned = cleaned[cleaned.find("\n") + 1:] if "\n" in cleaned else cleaned
+    data = json.loads(cleaned)
+    if isinstance(data, dict):
+        data = data.get("scenes", [])
+    scenes = []
+    for item in data:
+        try:
+            start_time = _parse_timestamp(item["start_time"])
+            end_time = _parse_timestamp(item["end_time"])
+        except (KeyError, TypeError, ValueError):
+            continue
+        if end_time > start_time:
+            scenes.append({"start_time": start_time, "end_time": end_time, "caption": str(item.get("caption", ""))})
+    return sorted(scenes, key=lambda scene: scene["start_time"])
+
+class TokenBucket:
+    """
+    Gemini APIへのリクエスト数を制限するトークンバケットです（1分あたりrate_per_minute回、最大burst回まで連続可能）。
+    スレッドセーフで、どのイベントループからでも共有できます。トークンが足りない場合は前借りして待ち時間を返すため、
+    待っているリクエストは到着順に送られます。
+    """
+
+    def __init__(self, rate_per_minute: float, burst: int = 1):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = float(max(1, burst))
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def reserve(self) -> float:
+        """
+        トークンを1つ確保し、使えるようになるまでの待ち時間（秒）を返します。
+        """
+        with self._lock:
+            self._refill()
+            self.tokens -= 1
+            return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    async def acquire(self):
+        wait = self.reserve()
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def pause(self, seconds: float):
+        """
+        レート制限 (429) を受けた場合に、全リクエストの送信をseconds秒止めます。
+        """
+        with self._lock:
+            self._refill()
+            self.tokens = min(self.tokens, 0.0) - seconds * self.rate
+
+# 長い動画は重なりのある時間窓に分割し、窓ごとのリクエストを並行して送る
+ANALYSIS_WINDOW_SECONDS = float(os.environ.get("ANALYSIS_WINDOW_SECONDS", "600"))
+ANALYSIS_WINDOW_OVERLAP = float(os.environ.get("ANALYSIS_WINDOW_OVERLAP", "30"))
+# Gemini APIのレート制限（全セッション・全動画で共有）と同時リクエスト数
+GEMINI_REQUESTS_PER_MINUTE = float(os.environ.get("GEMINI_REQUESTS_PER_MINUTE", "10"))
+GEMINI_MAX_CONCURRENCY = int(os.environ.get("GEMINI_MAX_CONCURRENCY", "4"))
+# 一時的なエラー (429 / 5xx / タイムアウト) の再試行回数と待ち時間（指数バックオフ＋ジッター）
+GEMINI_MAX_RETRIES = int(os.environ.get("GEMINI_MAX_RETRIES", "5"))
+GEMINI_RETRY_BASE_DELAY = 2.0
+GEMINI_RETRY_MAX_DELAY = 60.0
+GEMINI_REQUEST_TIMEOUT = float(os.environ.get("GEMINI_REQUEST_TIMEOUT", "600"))
+_RETRYABLE_STATUS_CODES = (429, 500, 502, 503, 504)
+_RETRYABLE_ERRORS = ("ResourceExhausted", "TooManyRequests", "ServiceUnavailable", "InternalServerError", "DeadlineExceeded", "TimeoutError", "ConnectionError")
+# 窓の重なり部分で重複したシーンとみなす重なりの割合（短い方のシーンの長さに対する割合）
+SCENE_MERGE_MIN_OVERLAP = 0.5
+
+gemini_rate_limiter = TokenBucket(GEMINI_REQUESTS_PER_MINUTE, burst=GEMINI_MAX_CONCURRENCY)
+
+WINDOW_INSTRUCTION = """
+この動画の {start:.1f}秒 〜 {end:.1f}秒 の区間だけを対象にしてください。時間は区間の先頭ではなく、動画の先頭からの秒数で返してください。
+"""
+# 時間窓ごとに切り出した動画を送る場合の指示（時間は切り出した動画の先頭からの秒数で受け取り、元の動画の時刻に戻す）
+CLIP_WINDOW_INSTRUCTION = """
+この動画は長い動画の一部を切り出したものです。この動画の {start:.1f}秒 〜 {end:.1f}秒 の区間だけを対象にし、時間はこの動画の先頭からの秒数で返してください。
+"""
+
+def plan_analysis_windows(duration: float, window: float = ANALYSIS_WINDOW_SECONDS, overlap: float = ANALYSIS_WINDOW_OVERLAP) -> List[Tuple[float, float]]:
+    """
+    動画を長さwindow秒・重なりoverlap秒の時間窓に分割します。短い動画は1つの窓になります。
+    """
+    if not duration or duration <= window:
+        return [(0.0, duration)] if duration else []
+    step = max(window - overlap, 1.0)
+    windows = []
+    start = 0.0
+    while start + overlap < duration:
+        windows.append((round(start, 3), round(min(start + window, duration), 3)))
+        if start + window >= duration:
+            break
+        start += step
+    return windows
+
+def _is_retryable(error: Exception) -> bool:
+    code = getattr(error, "code", None)
+    code = getattr(code, "value", code)
+    return code in _RETRYABLE_STATUS_CODES or type(error).__name__ in _RETRYABLE_ERRORS or "429" in str(error)
+
+def _retry_delay(attempt: int) -> float:
+    return min(GEMINI_RETRY_MAX_DELAY, GEMINI_RETRY_BASE_DELAY * 2 ** attempt) * random.uniform(0.5, 1.0)
+
+async def _generate_with_retry(model, contents: List, model_name: str, log_fields: Dict = None, **span_fields):
+    """
+    レート制限に従ってリクエストを送り、一時的なエラーの場合は指数バックオフで再試行します。
+    SDKの呼び出しは同期的なため、スレッドで実行してイベントループを止めないようにします。
+    span_fieldsはメトリクスのラベル（値の種類が限られるもの）、log_fieldsは構造化ログだけに残す値です。
+    """
+    for attempt in range(GEMINI_MAX_RETRIES + 1):
+        await gemini_rate_limiter.acquire()
+        try:
+            # 試行回数や時間窓の位置はラベルにすると系列数が際限なく増えるため、ログのフィールドとしてだけ記録する
+            with metrics.span("gemini_generate", model=model_name, **span_fields) as span:
+                span.set(attempt=attempt, **(log_fields or {}))
+                response = await asyncio.to_thread(
+                    model.generate_content, contents,
+                    generation_config={"response_mime_type": "application/json"},
+                    request_options={"timeout": GEMINI_REQUEST_TIMEOUT}
+                )
+                usage = getattr(response, "usage_metadata", None)
+                if usage is not None:
+                    span.set(prompt_tokens=getattr(usage, "prompt_token_count", None), output_tokens=getattr(usage, "candidates_token_count", None))
+            return response
+        except Exception as e:
+            if attempt >= GEMINI_MAX_RETRIES or not _is_retryable(e):
+                raise
+            delay = _retry_delay(attempt)
+            metrics.increment("gemini_retries")
+            print(f"Geminiへのリクエストが失敗しました ({e})。{delay:.1f}秒後に再試行します ({attempt + 1}/{GEMINI_MAX_RETRIES})。")
+            if "429" in str(e) or type(e).__name__ in ("ResourceExhausted", "TooManyRequests"):
+                gemini_rate_limiter.pause(delay)
+            await asyncio.sleep(delay)
+
+def _shots_in_window(shot_index: Dict, window: Tuple[float, float], offset: float = 0.0) -> Dict:
+    """
+    時間窓と重なるショットだけを含むショットインデックスを返します。offsetを指定すると各ショットの時刻からその値を引きます。
+    """
+    start, end = window
+    shots = [[s, e] for s, e in shot_index["shots"] if e > start and s < end]
+    return dict(shot_index, shots=[[round(s - offset, 3), round(e - offset, 3)] for s, e in shots] if offset else shots)
+
+def _window_clip_start(index: media_index.MediaIndex or None, window: Tuple[float, float]) -> float:
+    """
+    時間窓を切り出すときの開始時刻を返します。ストリームコピーで切り出すため、窓の先頭以前で最も近いキーフレームから始めます。
+    """
+    return index.keyframe_at_or_before(window[0]) if index else window[0]
+
+def _upload_window_clip(video_path: str, content_hash: str, window: Tuple[float, float], clip_start: float) -> str:
+    """
+    時間窓の区間を再エンコードせずに切り出してGemini File APIにアップロードし、ACTIVEになったファイルのIDを返します。
+    窓ごとにレジストリへ登録するため、有効期限内の再解析では切り出し・アップロードを省きます。
+    """
+    key = f"{content_hash}#window:{window[0]:.3f}-{window[1]:.3f}"
+    registered = get_registered_gemini_file(key)
+    if registered and registered.get("state") == "ACTIVE":
+        return registered["name"]
+    _discard_failed_gemini_file(key)
+    work_dir = storage_manager.make_work_dir("quickclip_window_")
+    try:
+        clip_path = os.path.join(work_dir, "window.mp4")
+        with metrics.span("gemini_window_cut"):
+            ffmpeg_tools.stream_copy_segment(video_path, clip_start, window[1], clip_path)
+        with metrics.span("gemini_upload") as span:
+            file = _get_genai().upload_file(path=clip_path, display_name=f"{content_hash[:12]}_{window[0]:.0f}-{window[1]:.0f}.mp4")
+            span.set(bytes=os.path.getsize(clip_path))
+        _record_gemini_file(key, file)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    if not wait_for_gemini_file_active(file.name, key):
+        raise RuntimeError(f"切り出した区間 ({window[0]:.1f}〜{window[1]:.1f}秒) のGemini側での処理に失敗しました。")
+    return file.name
+
+async def _window_contents(file, instruction: str, shot_index: Dict = None, video_path: str = None, keyframes_only: bool = False) -> List:
+    """
+    1つの時間窓のリクエスト内容を作成します。keyframes_only=True の場合は動画全体の代わりに窓内の各ショットの代表フレームだけを送ります。
+    """
+    if keyframes_only and shot_index and video_path:
+        contents = []
+        shots = _select_keyframe_shots(shot_index)
+        # 窓内の全ショットの代表フレームを1回のffmpegの実行で取り出す
+        frames = await asyncio.to_thread(ffmpeg_tools.extract_frames_jpeg, video_path, [(start + end) / 2 for start, end in shots])
+        for (start, end), frame in zip(shots, frames):
+            contents.append(f"{start:.2f}秒 〜 {end:.2f}秒 のショットの代表フレーム:")
+            contents.append({"mime_type": "image/jpeg", "data": frame})
+        contents.append(instruction)
+        return contents
+    return [file, instruction]
+
+async def _analyze_window(model, file, prompt: str, model_name: str, window: Tuple[float, float] or None, shot_index: Dict = None, video_path: str = None, keyframes_only: bool = False, semaphore: asyncio.Semaphore = None, clip_start: float = None, content_hash: str = None) -> List[Dict]:
+    """
+    1つの時間窓（Noneの場合は動画全体）のシーン抽出を行い、窓の範囲に収めたシーンのリストを返します。
+    clip_startを指定すると、動画全体の代わりにclip_startから窓の終わりまでを切り出した動画を送り、返された時刻にclip_startを足します。
+    """
+    offset = clip_start or 0.0
+    instruction = SCENE_EXTRACTION_INSTRUCTION.format(prompt=prompt)
+    if window:
+        template = CLIP_WINDOW_INSTRUCTION if clip_start is not None else WINDOW_INSTRUCTION
+        instruction += template.format(start=window[0] - offset, end=window[1] - offset)
+        if shot_index:
+            shot_index = _shots_in_window(shot_index, window, offset)
+    if shot_index:
+        instruction += "\n参考: ローカル解析で検出したショット区間です。シーンの境界はできるだけこれに合わせてください。\n" + _describe_shots(shot_index)
+
+    if clip_start is not None:
+        async with semaphore:
+            file_id = await asyncio.to_thread(_upload_window_clip, video_path, content_hash, window, clip_start)
+            file = await asyncio.to_thread(_get_genai().get_file, name=file_id)
+    async with semaphore:
+        contents = await _window_contents(file, instruction, shot_index, video_path, keyframes_only)
+        response = await _generate_with_retry(model, contents, model_name, log_fields={"window_start": window[0] if window else None}, keyframes_only=bool(keyframes_only and shot_index and video_path))
+    scenes = parse_scene_response(response.text)
+    if offset:
+        scenes = [dict(scene, start_time=round(scene["start_time"] + offset, 3), end_time=round(scene["end_time"] + offset, 3)) for scene in scenes]
+    if window:
+        scenes = [dict(scene, start_time=max(scene["start_time"], window[0]), end_time=min(scene["end_time"], window[1])) for scene in scenes]
+        scenes = [scene for scene in scenes if scene["end_time"] > scene["start_time"]]
+    return scenes
+
+def merge_window_scenes(window_scenes: List[List[Dict]], min_overlap: float = SCENE_MERGE_MIN_OVERLAP) -> List[Dict]:
+    """
+    時間窓ごとのシーンのリストを1つにまとめます。窓の重なり部分で同じシーンが重複して返された場合
+    （短い方のシーンのmin_overlap以上が重なる場合）は1つのシーンに統合し、長い方のテロップを残します。
+    """
+    scenes = sorted((scene for scenes in window_scenes for scene in scenes), key=lambda scene: (scene["start_time"], scene["end_time"]))
+    merged = []
+    for scene in scenes:
+        if merged:
+            last = merged[-1]
+            overlap = min(last["end_time"], scene["end_time"]) - max(last["start_time"], scene["start_time"])
+            last_length = last["end_time"] - last["start_time"]
+            scene_length = scene["end_time"] - scene["start_time"]
+            if overlap > 0 and overlap >= min_overlap * min(last_length, scene_length):
+                longer = last if last_length >= scene_length else scene
+                merged[-1] = dict(longer, start_time=min(last["start_time"], scene["start_time"]), end_time=max(last["end_time"], scene["end_time"]))
+                continue
+        merged.append(dict(scene))
+    return merged
+
+def _source_index(video_path: str, content_hash: str, shot_index: Dict = None) -> Tuple[float or None, media_index.MediaIndex or None]:
+    """
+    ソースの長さとメディアインデックス（時間窓を切り出す位置の決定に使う）を返します。
+    """
+    index = media_index.get_media_index(video_path, content_hash)
+    duration = shot_index["duration"] if shot_index else (index.duration if index else None)
+    return duration, index
+
+async def _extract_scenes_async(file_id: str, content_hash: str, prompt: str, model_name: str, video_path: str = None, keyframes_only: bool = False, semaphore: asyncio.Semaphore = None) -> List[Dict]:
+    """
+    1つの動画のシーン抽出です。長い動画は時間窓に分割して並行に解析し、結果を統合します。
+    窓ごとの結果をキャッシュするため、一部の窓が失敗した場合も再実行時には残りの窓だけを解析します。
+    """
+    semaphore = semaphore or asyncio.Semaphore(max(1, GEMINI_MAX_CONCURRENCY))
+    shot_index = None
+    if video_path:
+        try:
+            shot_index = await asyncio.to_thread(get_shot_index, video_path, content_hash)
+        except Exception as e:
+            print(f"ショット検出中にエラーが発生しました: {e}")
+
+    mode = "keyframes" if keyframes_only and shot_index else ("video+shots" if shot_index else "video")
+    duration, index = await asyncio.to_thread(_source_index, video_path, content_hash, shot_index) if video_path else (None, None)
+    windows = plan_analysis_windows(duration, ANALYSIS_WINDOW_SECONDS, ANALYSIS_WINDOW_OVERLAP) if duration else []
+    # 1つの窓に収まる動画は従来どおり動画全体として解析する（キャッシュのキーも同じ）
+    windows = windows if len(windows) > 1 else [None]
+    # 動画を送るモードで複数の窓に分ける場合は、窓ごとに切り出した動画を送る（動画全体を窓の数だけ送るとトークンを窓の数倍消費する）
+    clip_windows = mode != "keyframes" and windows != [None]
+
+    keys = [_analysis_cache_key(content_hash, prompt, f"{model_name}/{mode}" + (f"/window:{w[0]:.3f}-{w[1]:.3f}" if w else "")) for w in windows]
+    results = [analysis_cache.get_json(key) for key in keys]
+    pending = [i for i, scenes in enumerate(results) if scenes is None]
+    if pending:
+        model = _get_genai().GenerativeModel(model_name)
+        file = None if mode == "keyframes" or clip_windows else await asyncio.to_thread(_get_genai().get_file, name=file_id)
+        analyzed = await asyncio.gather(*(
+            _analyze_window(model, file, prompt, model_name, windows[i], shot_index, video_path, keyframes_only, semaphore,
+                            clip_start=_window_clip_start(index, windows[i]) if clip_windows else None, content_hash=content_hash)
+            for i in pending
+        ), return_exceptions=True)
+        errors = []
+        for i, scenes in zip(pending, analyzed):
+            if isinstance(scenes, BaseException):
+                errors.append(scenes)
+                continue
+            analysis_cache.put_json(keys[i], scenes)
+            results[i] = scenes
+        if errors:
+            raise errors[0]
+
+    scenes = merge_window_scenes(results) if len(windows) > 1 else results[0]
+    if shot_index:
+        scenes = snap_scenes_to_cuts(scenes, shot_index)
+    return scenes
+
+async def extract_scenes_for_videos_async(videos: List[Dict], prompt: str, model_name: str = DEFAULT_ANALYSIS_MODEL, keyframes_only: bool = False) -> List[List[Dict] or BaseException]:
+    """
+    複数の動画（{"file_id", "content_hash", "video_path"} のリスト）のシーン抽出を並行して行います。
+    同時に送るリクエストは GEMINI_MAX_CONCURRENCY 件まで、送信の間隔は共有のレート制限に従います。
+    戻り値は動画ごとのシーンのリスト、または失敗した場合はその例外です。
+    """
+    semaphore = asyncio.Semaphore(max(1, GEMINI_MAX_CONCURRENCY))
+    return await asyncio.gather(*(
+        _extract_scenes_async(video["file_id"], video["content_hash"], prompt, model_name, video.get("video_path"), keyframes_only, semaphore)
+        for video in videos
+    ), return_exceptions=True)
+
+def extract_scenes_batch(videos: List[Dict], prompt: str, model_name: str = DEFAULT_ANALYSIS_MODEL, keyframes_only: bool = False) -> List[List[Dict] or None]:
+    """
+    extract_scenes_for_videos_async の同期版です。失敗した動画の結果はNoneになります。
+    """
+    results = asyncio.run(extract_scenes_for_videos_async(videos, prompt, model_name, keyframes_only))
+    for video, result in zip(videos, results):
+        if isinstance(result, BaseException):
+            print(f"シーン抽出中にエラーが発生しました ({video.get('file_id')}): {result}")
+    return [None if isinstance(result, BaseException) else result for result in results]
+
+def extract_scenes(file_id: str, content_hash: str, prompt: str, model_name: str = DEFAULT_ANALYSIS_MODEL, video_path: str = None, keyframes_only: bool = False) -> List[Dict] or None:
+    """
+    動画からシーンを抽出します。(動画のハッシュ, 正規化したプロンプト, モデル名) が同じ結果はディスクキャッシュから返し、
+    Geminiへのリクエストとクォータの消費を省きます。
+    video_pathを渡すとローカルのショット検出を行い、ショット区間をヒントとして送ったうえで結果の境界を実際のカットに合わせます。
+    ANALYSIS_WINDOW_SECONDS より長い動画は重なりのある時間窓に分割して並行に解析し、重複を除いて統合します。
+    """
+    result = asyncio.run(extract_scenes_for_videos_async(
+        [{"file_id": file_id, "content_hash": content_hash, "video_path": video_path}], prompt, model_name, keyframes_only
+    ))[0]
+    if isinstance(result, BaseException):
+        st.error(f"シーン抽出中にエラーが発生しました: {result}", icon="\u274C")
+        if "429" in str(result):
+            st.warning("APIレート制限に達した可能性があります。しばらく待ってから再試行してください。")
+        return None
+    return result
+
+def get_analysis_cache_stats() -> Dict[str, int]:
+    """
+    解析結果キャッシュのヒット数・ミス数・削除数を返します。
+    """
+    return analysis_cache.stats()
+
 # Streamlit Session Stateでの利用例
 # if 'uploaded_video_file_id' not in st.session_state:
 #     st.session_state.uploaded_video_file_id = None
 
 # uploaded_file = st.sidebar.file_uploader("動画をアップロード", type=["mp4", "mov", "avi"])
 # if uploaded_file and st.session_state.uploaded_video_file_id is None:
-#     file_id = upload_video_to_gemini(uploaded_file)
+#     content_hash, video_path = ingest_uploaded_video(uploaded_file)
+#     file_id = upload_video_to_gemini(video_path, uploaded_file.name, content_hash)
 #     if file_id:
 #         st.session_state.uploaded_video_file_id = file_id
 #         st.session_state.uploaded_video_name = uploaded_file.name
@@ -1,39 +1,109 @@
-from moviepy.editor import VideoFileClip, TextClip, CompositeVideoClip, concatenate_videoclips
-from moviepy.config import change_settings
+import hashlib
+import json
+import multiprocessing
 import os
-from typing import List, Dict, Tuple
+import shutil
+import threading
+import time
+import uuid
+from bisect import bisect_left, bisect_right
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Dict, Tuple
 
-# ImageMagickのパスを設定（環境に合わせて適宜変更してください）
-# Streamlitアプリ内で設定する場合、os.environで設定する方が良いかもしれません。
-# 例えば、ユーザーにImageMagickのインストールパスを入力させ、それを基に設定する。
-# change_settings({"IMAGEMAGICK_BINARY": r"C:\Program Files\ImageMagick-7.1.1-Q16-HDRI\magick.exe"})
-# change_settings({"IMAGEMAGICK_BINARY": "/usr/local/bin/magick"})
+from modules import caption_renderer, ffmpeg_tools, media_index, metrics, storage_manager, subtitles
+from modules.disk_cache import DiskCache
 
-def set_imagemagick_binary(path: str):
+# MoviePy (moviepy.editor)・NumPy・proglog は読み込みに時間がかかるため、実際にレンダリングする関数の中で読み込む（コールドスタート対策）
+
+def _env_choice(name: str, choices, default: str) -> str:
     """
-    ImageMagickのバイナリパスを設定します。
+    環境変数の値が選択肢に含まれていればそれを、含まれていなければ警告を表示してdefaultを返します。
     """
-    change_settings({"IMAGEMAGICK_BINARY": path})
+    value = os.environ.get(name, default)
+    if value not in choices:
+        print(f"環境変数 {name} の値 '{value}' は無効です（指定可能: {', '.join(choices)}）。'{default}' を使用します。")
+        return default
+    return value
+
+# 並列レンダリング時のデフォルトのワーカー数（1 vCPU環境では1のまま、バッチ用マシンでは増やす）
+DEFAULT_RENDER_WORKERS = int(os.environ.get("RENDER_WORKERS", "1"))
+
+# セグメント単位でレンダリングする際の共通エンコード設定（全セグメントで一致させ、再エンコードなしで結合できるようにする）
+SEGMENT_ENCODER_SETTINGS = {
+    "codec": "libx264",
+    "audio_codec": "aac",
+    "ffmpeg_params": ["-pix_fmt", "yuv420p"],
+    "x264_params": "repeat-headers=1",
+}
+# スマートレンダリングで再エンコードするセグメントをソースに合わせられるH.264のプロファイル（profile_idc → x264のプロファイル名）
+SMART_RENDER_H264_PROFILES = {66: "baseline", 77: "main", 100: "high"}
+# ソースのBフレームの並べ替えによるDTSの遅れ（フレーム数）と、同じ遅れになるx264の設定
+# 遅れが一致しないと、結合したときにセグメントの継ぎ目でDTSが逆行する
+SMART_RENDER_REORDER_PARAMS = {0: "bframes=0", 1: "bframes=1", 2: "bframes=3:b-pyramid=normal"}
+# エンコードプロファイル（速度と画質・サイズのトレードオフ）
+# draft: 編集中の確認用。ultrafastプリセットで解像度も下げる
+# standard: 従来と同じ設定（x264の既定値 preset=medium, CRF 23）
+# final: 納品用。時間をかけて画質とファイルサイズを優先する
+ENCODER_PROFILES = {
+    "draft": {"preset": "ultrafast", "crf": 30, "max_height": 480, "audio_bitrate": "96k"},
+    "standard": {"preset": "medium", "crf": 23, "max_height": None, "audio_bitrate": "128k"},
+    "final": {"preset": "slow", "crf": 20, "max_height": None, "audio_bitrate": "192k"},
+}
+DEFAULT_ENCODER_PROFILE = _env_choice("ENCODER_PROFILE", ENCODER_PROFILES, "standard")
+# x264のスレッド数（0 の場合はx264が自動で決定する）
+ENCODER_THREADS = int(os.environ.get("ENCODER_THREADS", "0"))
+# レンダリングエンジン
+# moviepy: クリップごとにPythonでフレームを合成する従来の方式（スマートレンダリング・セグメントキャッシュ・音声コピーに対応）
+# ffmpeg: テロップをASS字幕に変換し、切り出し・結合・字幕の焼き込みを1回のffmpegのフィルタ処理で行う（フレームごとのPython処理なし）
+RENDER_ENGINES = ("moviepy", "ffmpeg")
+DEFAULT_RENDER_ENGINE = _env_choice("RENDER_ENGINE", RENDER_ENGINES, "moviepy")
+# ffmpegエンジンでのテロップの出力方法（burn: 映像に焼き込む / soft: 切り替え可能な字幕トラック (mov_text) として格納する）
+SUBTITLE_MODES = ("burn", "soft")
+# 1回のレンダリングで同時に書き出せる出力形式（ffmpegエンジンのみ）
+# aspect: 中央を切り抜くアスペクト比（Noneは元の比率のまま） / height: 高さの上限（Noneはプロファイルに従う、拡大はしない）
+# safe_area: 上下の端に寄せたテロップを内側に置く割合。縦型ではSNSアプリのUIと重ならないよう上下を空ける
+RENDITION_PRESETS = {
+    "original": {"aspect": None, "height": None, "safe_area": 0.0},
+    "landscape": {"aspect": (16, 9), "height": None, "safe_area": 0.0},
+    "vertical": {"aspect": (9, 16), "height": 1920, "safe_area": 0.15},
+    "review": {"aspect": None, "height": 720, "safe_area": 0.0},
+}
+# 並列レンダリング中にキャンセル要求（進捗コールバック）を確認する間隔（秒）
+SEGMENT_POLL_INTERVAL = 0.5
+# この誤差（秒）以内でAACフレームの境界に揃っていれば、クリップの継ぎ目で音声をコピーしても同期がずれないとみなす
+AAC_ALIGNMENT_TOLERANCE = 0.002
 
-def create_text_clip(text: str, font_path: str, font_size: int, font_color: str, text_position: Tuple[str, str], bg_color: str = None, duration: float = None):
+# クリップごとのレンダリング済みセグメントのキャッシュ（合計サイズが上限を超えると古いものから削除）
+SEGMENT_CACHE_DIR = storage_manager.area_path("segments")
+SEGMENT_CACHE_VERSION = 3
+segment_cache = DiskCache(SEGMENT_CACHE_DIR, max_bytes=storage_manager.STORAGE_AREAS["segments"]["max_bytes"], suffix=".mp4")
+
+# プレビュー用のプロキシ動画とプレビュー出力の保存先
+PROXY_DIR = storage_manager.area_path("proxies")
+PREVIEW_DIR = storage_manager.area_path("previews")
+PROXY_HEIGHT = 360
+# プロキシ作成はバックグラウンドで1本ずつ行う（レンダリングとCPUを奪い合わないように）
+_proxy_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="proxy")
+_proxy_futures = {}
+_proxy_lock = threading.Lock()
+
+def create_text_clip(text: str, font_path: str, font_size: int, font_color: str, text_position: Tuple[str, str], bg_color: str = None, duration: float = None, max_width: int = None):
     """
-    MoviePyのTextClipを作成します。
+    Pillowで描画したテロップ画像からMoviePyのImageClipを作成します。
+    テロップ画像はcaption_rendererによりディスクにキャッシュされるため、同じテロップの再描画は発生しません。
     """
+    import numpy as np
+    from moviepy.editor import ImageClip
     try:
-        txt_clip = TextClip(
-            text,
-            fontsize=font_size,
-            color=font_color,
-            font=font_path, # フォントファイルの絶対パスを指定
-            bg_color=bg_color,
-            method='caption' # 日本語対応のために 'caption' を推奨
-        )
+        rgba = np.array(caption_renderer.get_caption_image(text, font_path, font_size, font_color, bg_color, max_width))
+        mask = ImageClip(rgba[:, :, 3] / 255.0, ismask=True)
+        txt_clip = ImageClip(rgba[:, :, :3]).set_mask(mask)
         if duration:
             txt_clip = txt_clip.set_duration(duration)
         txt_clip = txt_clip.set_position(text_position)
         return txt_clip
     except Exception as e:
-        print(f"TextClipの作成中にエラーが発生しました: {e}")
+        print(f"テロップクリップの作成中にエラーが発生しました: {e}")
         return None
 
 def process_subclip_with_text(video_path: str, start_time: float, end_time: float, text_params: Dict = None):
@@ -41,25 +111,13 @@ def process_subclip_with_text(video_path: str, start_time: float, end_time: floa
     指定された開始時間と終了時間に基づいて動画クリップを抽出し、テロップを合成します。
     動画全体をメモリに読み込まず、必要なサブクリップのみを処理します。
     """
+    from moviepy.editor import VideoFileClip
     try:
         full_clip = VideoFileClip(video_path, audio=True, video=True)
         subclip = full_clip.subclip(start_time, end_time)
 
-        final_clip = subclip
-
-        if text_params:
-            txt_clip = create_text_clip(
-                text=text_params.get("text", ""),
-                font_path=text_params.get("font_path"),
-                font_size=text_params.get("font_size", 50),
-                font_color=text_params.get("font_color", "white"),
-                text_position=text_params.get("text_position", ("center", "bottom")),
-                bg_color=text_params.get("bg_color"),
-                duration=subclip.duration
-            )
-            if txt_clip:
-                final_clip = CompositeVideoClip([subclip, txt_clip])
-        
+        final_clip = _apply_text_params(subclip, text_params)
+
         # full_clipはまだ閉じない。後続の処理で再びsubclipを生成する可能性があるため。
         # 各process_subclip_with_textの呼び出し後、full_clip.close()はしない。
         # 最終的なレンダリング時に一度だけ閉じる。
@@ -69,40 +127,687 @@ def process_subclip_with_text(video_path: str, start_time: float, end_time: floa
         print(f"動画サブクリップの処理中にエラーが発生しました: {e}")
         return None
 
-def render_video(video_path: str, edited_clips_data: List[Dict], output_filename: str = "output.mp4"):
+def _has_caption(text_params: Dict = None) -> bool:
+    """
+    text_paramsに表示すべきテロップが含まれているかを返します。
+    """
+    return bool(text_params and text_params.get("text"))
+
+class _FrameTimer:
+    """
+    クリップ1本分のフレームのデコード時間とテロップ合成時間を集計します。メトリクスが有効な場合のみ使用します。
+    書き出し全体の時間からこれらを引いた残りが、x264によるエンコードと音声の多重化にかかった時間の目安になります。
+    """
+
+    def __init__(self):
+        self.decode_seconds = 0.0
+        self.composite_seconds = 0.0
+        self.frames = 0
+
+    def wrap_decode(self, clip):
+        def timed_get_frame(get_frame, t):
+            start = time.perf_counter()
+            frame = get_frame(t)
+            self.decode_seconds += time.perf_counter() - start
+            self.frames += 1
+            return frame
+        return clip.fl(timed_get_frame)
+
+    def wrap_composite(self, apply: Callable):
+        def timed_apply(frame):
+            start = time.perf_counter()
+            result = apply(frame)
+            self.composite_seconds += time.perf_counter() - start
+            return result
+        return timed_apply
+
+    def fields(self, write_seconds: float = None) -> Dict:
+        fields = {"frames": self.frames, "decode_seconds": round(self.decode_seconds, 4), "composite_seconds": round(self.composite_seconds, 4)}
+        if write_seconds is not None:
+            fields["encode_seconds"] = round(max(0.0, write_seconds - self.decode_seconds - self.composite_seconds), 4)
+        return fields
+
+def _apply_text_params(subclip, text_params: Dict = None, timer: _FrameTimer = None):
+    """
+    サブクリップにテロップを合成したクリップを返します。テロップがない場合はそのまま返します。
+    全画面のCompositeVideoClipは使わず、テロップの領域だけを各フレームにブレンドします。
+    timerが渡された場合は、フレームのデコード時間とテロップ合成時間を計測します。
+    """
+    if timer:
+        subclip = timer.wrap_decode(subclip)
+    if not _has_caption(text_params):
+        return subclip
+    try:
+        with metrics.span("caption_build"):
+            image = caption_renderer.get_caption_image(
+                text_params.get("text", ""),
+                text_params.get("font_path"),
+                text_params.get("font_size", 50),
+                text_params.get("font_color", "white"),
+                text_params.get("bg_color"),
+                int(subclip.w * 0.9)
+            )
+    except Exception as e:
+        print(f"テロップ画像の作成中にエラーが発生しました: {e}")
+        return subclip
+    overlay = caption_renderer.CaptionOverlay(image, text_params.get("text_position", ("center", "bottom")), subclip.size)
+    return subclip.fl_image(timer.wrap_composite(overlay.apply) if timer else overlay.apply)
+
+def plan_smart_segments(edited_clips_data: List[Dict], keyframe_times: List[float], min_gap: float = 0.05) -> List[Dict]:
+    """
+    スマートレンダリング用のセグメント計画を作成します。
+    テロップのあるクリップは全体を再エンコードし、テロップのないクリップは
+    キーフレーム間をストリームコピー、キーフレームに乗らない前後の端だけを再エンコードします。
+    keyframe_timesは昇順である必要があります（クリップごとに二分探索で範囲内のキーフレームを探します）。
+    戻り値は {"mode": "encode" | "copy", "start_time", "end_time", "text_params"} のリストです。
+    """
+    segments = []
+    for clip_data in edited_clips_data:
+        start_time = float(clip_data["start_time"])
+        end_time = float(clip_data["end_time"])
+        text_params = clip_data.get("text_params")
+        if end_time - start_time <= 0:
+            continue
+
+        inner = [float(t) for t in keyframe_times[bisect_left(keyframe_times, start_time - 1e-3):bisect_right(keyframe_times, end_time + 1e-3)]]
+        if _has_caption(text_params) or len(inner) < 2 or inner[-1] - inner[0] < min_gap:
+            segments.append({"mode": "encode", "start_time": start_time, "end_time": end_time, "text_params": text_params})
+            continue
+
+        copy_start, copy_end = inner[0], inner[-1]
+        if copy_start - start_time > min_gap:
+            segments.append({"mode": "encode", "start_time": start_time, "end_time": copy_start, "text_params": None})
+        else:
+            copy_start = max(copy_start, start_time)
+        segments.append({"mode": "copy", "start_time": copy_start, "end_time": copy_end, "text_params": None})
+        if end_time - copy_end > min_gap:
+            segments.append({"mode": "encode", "start_time": copy_end, "end_time": end_time, "text_params": None})
+    return segments
+
+def _progress_logger(progress_callback: Callable[[str, int, int], None] = None):
+    """
+    progress_callbackがあれば進捗ロガーを、なければ出力なし (None) を返します。
+    """
+    if not progress_callback:
+        return None
+    # proglogはMoviePyと一緒に使うため、実際にレンダリングする時点で読み込む（コールドスタート対策）
+    from proglog import ProgressBarLogger
+
+    class RenderProgressLogger(ProgressBarLogger):
+        """
+        MoviePyの書き出し進捗（フレーム数・音声チャンク数）をprogress_callbackに転送するロガーです。
+        コールバックが例外を送出すると書き出しが中断されるため、キャンセルにも利用できます。
+        """
+
+        def bars_callback(self, bar, attr, value, old_value=None):
+            if attr == "index":
+                stage = "frames" if bar == "t" else "audio"
+                progress_callback(stage, value + 1, self.bars[bar].get("total") or 0)
+
+    return RenderProgressLogger()
+
+def get_encoder_profile(name: str = None) -> Dict:
+    """
+    名前に対応するエンコードプロファイルを返します。省略した場合は DEFAULT_ENCODER_PROFILE を使います。
+    未知の名前の場合は ValueError を送出します。
+    """
+    name = name or DEFAULT_ENCODER_PROFILE
+    if name not in ENCODER_PROFILES:
+        raise ValueError(f"不明なエンコードプロファイルです: {name} (指定可能: {', '.join(ENCODER_PROFILES)})")
+    return dict(ENCODER_PROFILES[name], name=name, threads=ENCODER_THREADS or None)
+
+def _profile_ffmpeg_params(profile: Dict, height: int) -> List[str]:
+    """
+    プロファイルのCRFと、最大の高さを超える場合の縮小フィルタをffmpegの引数として返します。
+    """
+    params = ["-crf", str(profile["crf"])]
+    if profile["max_height"] and height > profile["max_height"]:
+        params += ["-vf", f"scale=-2:{profile['max_height']}"]
+    return params
+
+def _match_source_encoding(index: media_index.MediaIndex = None) -> Dict or None:
+    """
+    スマートレンダリングで再エンコードするセグメントを、ストリームコピーするセグメントと同じH.264のプロファイル・レベル・
+    Bフレームの並べ替えの遅れ・タイムベースで書き出すための設定を返します。
+    ソースのパラメータが分からない場合や、x264で同じパラメータを再現できない場合はNoneを返します。
+    """
+    video = index.video if index else None
+    if not video:
+        return None
+    x264_profile = SMART_RENDER_H264_PROFILES.get(video.get("profile_idc"))
+    reorder_params = SMART_RENDER_REORDER_PARAMS.get(video.get("reorder_delay"))
+    if video.get("pix_fmt") != "yuv420p" or not x264_profile or not reorder_params or not video.get("level_idc") or not video.get("time_base"):
+        return None
+    level_idc = video["level_idc"]
+    return {
+        "profile": x264_profile,
+        "level": "1b" if level_idc == 9 else f"{level_idc / 10:g}",
+        "x264_params": reorder_params,
+        "timescale": video["time_base"],
+    }
+
+def _write_segment(clip, segment_path: str, fps: float, audio_fps: int, profile: Dict, audio: bool = True, logger=None, source_params: Dict = None):
+    """
+    セグメントを結合可能な共通のコーデックパラメータで書き出します。
+    repeat-headers によりSPS/PPSを各キーフレームに埋め込み、ストリームコピーしたセグメントと混在させても復号できるようにします。
+    audio=False の場合は映像のみを書き出します（音声は後からタイムライン全体で1回だけ作成して多重化します）。
+    source_paramsが渡された場合は、プロファイル・レベル・Bフレーム・タイムベースをソースに合わせます（スマートレンダリング用）。
+    """
+    x264_params = SEGMENT_ENCODER_SETTINGS["x264_params"]
+    ffmpeg_params = list(SEGMENT_ENCODER_SETTINGS["ffmpeg_params"])
+    if source_params:
+        x264_params += ":" + source_params["x264_params"]
+        ffmpeg_params += [
+            "-profile:v", source_params["profile"], "-level:v", source_params["level"],
+            "-video_track_timescale", str(source_params["timescale"]),
+        ]
+    clip.write_videofile(
+        segment_path,
+        fps=fps,
+        codec=SEGMENT_ENCODER_SETTINGS["codec"],
+        audio=audio,
+        audio_codec=SEGMENT_ENCODER_SETTINGS["audio_codec"],
+        audio_fps=audio_fps,
+        audio_bitrate=profile["audio_bitrate"],
+        preset=profile["preset"],
+        threads=profile["threads"],
+        temp_audiofile=segment_path + ".m4a",
+        remove_temp=True,
+        ffmpeg_params=ffmpeg_params + ["-x264-params", x264_params] + _profile_ffmpeg_params(profile, clip.h),
+        logger=logger
+    )
+
+def _timeline_ranges(edited_clips_data: List[Dict]) -> List[Tuple[float, float]]:
+    """
+    クリップのソース上の区間を、連続するものを1区間にまとめて返します。
+    """
+    ranges = []
+    for clip_data in edited_clips_data:
+        start_time, end_time = float(clip_data["start_time"]), float(clip_data["end_time"])
+        if ranges and abs(start_time - ranges[-1][1]) < 1e-3:
+            ranges[-1] = (ranges[-1][0], end_time)
+        else:
+            ranges.append((start_time, end_time))
+    return ranges
+
+def _audio_passthrough_ranges(video_path: str, edited_clips_data: List[Dict], index: media_index.MediaIndex = None) -> List[Tuple[float, float]] or None:
+    """
+    ソースの音声をコピーできる場合は、コピーするソース上の区間のリストを返します。できない場合はNoneを返します。
+    ソースの音声がAACで、連続するクリップを1区間にまとめた後のすべての継ぎ目がAACフレーム（1024サンプル）の境界に揃っている必要があります。
+    1区間にまとまった場合も、先頭がフレームの境界からずれていると映像に対して音声が前後するため、区間の先頭を確認します。
+    """
+    audio = index.audio if index else ffmpeg_tools.probe_audio_stream(video_path)
+    if not audio or audio["codec"] != "aac" or not edited_clips_data:
+        return None
+
+    ranges = _timeline_ranges(edited_clips_data)
+
+    frame_duration = 1024 / audio["sample_rate"]
+    boundaries = [boundary for start_time, end_time in ranges for boundary in (start_time, end_time)] if len(ranges) > 1 else [ranges[0][0]]
+    for boundary in boundaries:
+        if abs(boundary - round(boundary / frame_duration) * frame_duration) > AAC_ALIGNMENT_TOLERANCE:
+            return None
+    return ranges
+
+def _mux_timeline_audio(video_path: str, audio_ranges: List[Tuple[float, float]], video_only_path: str, output_path: str, encode_profile: Dict = None, sample_rate: int = None):
+    """
+    映像のみのファイルに、ソースの音声を区間ごとに切り出して結合したものを多重化して output_path に書き出します。
+    encode_profileを省略した場合は再エンコードせずにコピーし、指定した場合はタイムライン全体を1回だけAACで再エンコードします。
+    """
+    audio_path = output_path + ".audio.m4a"
+    try:
+        if encode_profile:
+            with metrics.span("audio_encode"):
+                ffmpeg_tools.encode_audio_ranges(video_path, audio_ranges, audio_path, encode_profile["audio_bitrate"], sample_rate)
+        else:
+            with metrics.span("audio_passthrough"):
+                ffmpeg_tools.copy_audio_ranges(video_path, audio_ranges, audio_path)
+        ffmpeg_tools.mux_audio(video_only_path, audio_path, output_path)
+    finally:
+        for path in (audio_path, video_only_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+def _segment_cache_key(content_hash: str, segment: Dict, fps: float, audio_fps: int, profile: Dict, audio: bool = True, source_params: Dict = None) -> str:
+    """
+    セグメントキャッシュのキーを生成します。
+    ソース動画のハッシュ、区間、text_params全体、テロップに使うフォントファイルの状態、エンコード設定が同じなら同じキーになります。
+    """
+    text_params = segment.get("text_params") or {}
+    font_path = text_params.get("font_path")
+    font_state = None
+    if font_path and os.path.exists(font_path):
+        stat = os.stat(font_path)
+        font_state = [stat.st_size, stat.st_mtime_ns]
+    payload = json.dumps(
+        [SEGMENT_CACHE_VERSION, content_hash, segment["mode"], round(float(segment["start_time"]), 3), round(float(segment["end_time"]), 3),
+         text_params, font_state, SEGMENT_ENCODER_SETTINGS, profile, audio, fps, audio_fps, source_params],
+        sort_keys=True, ensure_ascii=False, default=str
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def _render_segment(video_path: str, segment: Dict, segment_path: str, fps: float, audio_fps: int, profile: Dict, audio: bool = True, full_video_clip=None, logger=None, source_params: Dict = None) -> str:
+    """
+    1つのセグメントをレンダリングします。プロセスプールのワーカーからも呼び出されます。
+    full_video_clipが渡されない場合（ワーカープロセス内）は、ソース動画をワーカー側で開きます。
+    """
+    from moviepy.editor import VideoFileClip
+    if segment["mode"] == "copy":
+        with metrics.span("segment_render", mode="copy"):
+            ffmpeg_tools.stream_copy_segment(
+                video_path, segment["start_time"], segment["end_time"], segment_path, audio=audio,
+                inband_headers=True, timescale=source_params["timescale"] if source_params else None, frame_count=segment.get("frames")
+            )
+        return segment_path
+
+    own_clip = full_video_clip is None
+    if own_clip:
+        full_video_clip = VideoFileClip(video_path, audio=True, video=True)
+    timer = _FrameTimer() if metrics.enabled() else None
+    try:
+        with metrics.span("segment_render", mode="encode") as span:
+            # サブクリップは全体クリップとリーダーを共有するため、ここでは閉じない
+            subclip = full_video_clip.subclip(segment["start_time"], segment["end_time"])
+            start = time.perf_counter()
+            _write_segment(_apply_text_params(subclip, segment["text_params"], timer), segment_path, fps, audio_fps, profile, audio, logger, source_params)
+            if timer:
+                span.set(start_time=segment["start_time"], end_time=segment["end_time"], **timer.fields(time.perf_counter() - start))
+    finally:
+        if own_clip:
+            full_video_clip.close()
+    return segment_path
+
+# ワーカープロセスがエンコードしたフレーム数をタスクごとに書き込む共有メモリ（プールの initializer で受け取る）
+_worker_frame_counts = None
+
+def _init_segment_worker(frame_counts):
+    global _worker_frame_counts
+    _worker_frame_counts = frame_counts
+
+def _render_segment_task(task: Tuple) -> int:
+    """
+    プロセスプールのワーカーで _render_segment を呼び出し、タスクの番号を返します（imap_unorderedは引数を1つしか渡せないため）。
+    エンコードしたフレーム数は共有メモリのタスクの番号の位置に書き込み、親プロセスが全ワーカーの進捗をまとめて報告します。
+    """
+    slot, video_path, segment, segment_path, fps, audio_fps, profile, audio, source_params = task
+
+    def report(stage: str, done: int, total: int):
+        if stage == "frames" and _worker_frame_counts is not None:
+            _worker_frame_counts[slot] = done
+
+    _render_segment(video_path, segment, segment_path, fps, audio_fps, profile, audio, None, _progress_logger(report), source_params)
+    return slot
+
+def _render_segments(full_video_clip, video_path: str, segments: List[Dict], output_path: str, profile: Dict, workers: int = 1, content_hash: str = None, progress_callback: Callable[[str, int, int], None] = None, audio_ranges: List[Tuple[float, float]] = None, audio_copy: bool = True, source_params: Dict = None, sample_rate: int = None):
+    """
+    セグメントを個別のファイルとしてレンダリングし、concat demuxerで再エンコードせずに結合します。
+    workers > 1 の場合、セグメントはプロセスプールで並列にレンダリングされ、進捗は 'parallel_frames' の段階として
+    全ワーカーのエンコード済みフレーム数の合計（再利用したセグメントを含むタイムライン全体に対する値）で報告されます。
+    content_hashが渡された場合はセグメントキャッシュを使い、キーが変わったセグメントだけを再レンダリングします。
+    audio_rangesが渡された場合は映像のみのセグメントを結合し、ソースの音声をその区間から切り出して多重化します
+    （audio_copy=True ならAACをコピー、False ならタイムライン全体を1回だけ再エンコード。空のリストなら音声なし）。
+    source_paramsはスマートレンダリングで再エンコードするセグメントをソースに合わせるための設定です。
+    """
+    audio = audio_ranges is None
+    fps = full_video_clip.fps
+    audio_fps = full_video_clip.audio.fps if full_video_clip.audio else 44100
+    work_dir = storage_manager.make_work_dir("quickclip_segments_")
+    pinned_paths = []
+    try:
+        segment_paths = [os.path.join(work_dir, f"segment_{i:04d}.mp4") for i in range(len(segments))]
+        cache_keys = [_segment_cache_key(content_hash, segment, fps, audio_fps, profile, audio, source_params) for segment in segments] if content_hash else [None] * len(segments)
+        pending = []
+        for i, key in enumerate(cache_keys):
+            cached_path = segment_cache.get_path(key) if key else None
+            if cached_path:
+                # 結合が終わるまで、他のレンダリングのキャッシュ格納や定期的な整理で削除されないようにする
+                storage_manager.pin(cached_path)
+                pinned_paths.append(cached_path)
+                segment_paths[i] = cached_path
+            else:
+                pending.append(i)
+
+        report = progress_callback or (lambda stage, done, total: None)
+        report("segments", len(segments) - len(pending), len(segments))
+        workers = max(1, min(workers, len(pending), os.cpu_count() or 1))
+        if workers == 1:
+            for done, i in enumerate(pending, start=len(segments) - len(pending) + 1):
+                _render_segment(video_path, segments[i], segment_paths[i], fps, audio_fps, profile, audio, full_video_clip, _progress_logger(progress_callback), source_params)
+                report("segments", done, len(segments))
+        else:
+            segment_frames = [max(1, round((segment["end_time"] - segment["start_time"]) * fps)) for segment in segments]
+            pending_frames = [segment_frames[i] for i in pending]
+            reused_frames = sum(segment_frames) - sum(pending_frames)
+            # Streamlitのスレッドを持つプロセスをforkしないよう、spawnでワーカーを起動する
+            context = multiprocessing.get_context("spawn")
+            frame_counts = context.RawArray("q", len(pending))
+            pool = context.Pool(processes=workers, initializer=_init_segment_worker, initargs=(frame_counts,))
+
+            def report_frames():
+                # ワーカーの処理中も進捗コールバックを定期的に呼び出し、キャンセル要求があればここで中断する
+                report("parallel_frames", reused_frames + sum(min(count, frames) for count, frames in zip(frame_counts, pending_frames)), sum(segment_frames))
+
+            try:
+                results = pool.imap_unordered(_render_segment_task, [
+                    (slot, video_path, segments[i], segment_paths[i], fps, audio_fps, profile, audio, source_params)
+                    for slot, i in enumerate(pending)
+                ])
+                done = len(segments) - len(pending)
+                while done < len(segments):
+                    try:
+                        slot = results.next(timeout=SEGMENT_POLL_INTERVAL)
+                    except multiprocessing.TimeoutError:
+                        report_frames()
+                        continue
+                    # ストリームコピーのセグメントはフレーム数を報告しないため、完了した時点で全フレームを済みにする
+                    frame_counts[slot] = pending_frames[slot]
+                    done += 1
+                    report("segments", done, len(segments))
+                    report_frames()
+                pool.close()
+            except BaseException:
+                # キャンセル・エラー時は実行中のセグメントの完了を待たず、ワーカープロセスごと終了する
+                pool.terminate()
+                raise
+            finally:
+                pool.join()
+
+        report("concat", 0, 1)
+
+        if content_hash:
+            print(f"セグメントキャッシュ: {len(segments) - len(pending)} / {len(segments)} セグメントを再利用しました。")
+            metrics.increment("segment_cache_hits", len(segments) - len(pending))
+            metrics.increment("segment_cache_misses", len(pending))
+        # 結合が終わるまで退避されないよう、キャッシュへの格納は結合後に行う
+        with metrics.span("concat"):
+            if audio or not audio_ranges:
+                ffmpeg_tools.concat_segments(segment_paths, output_path)
+            else:
+                video_only_path = output_path + ".video.mp4"
+                ffmpeg_tools.concat_segments(segment_paths, video_only_path)
+                _mux_timeline_audio(video_path, audio_ranges, video_only_path, output_path, None if audio_copy else profile, sample_rate)
+        for i in pending:
+            if cache_keys[i]:
+                segment_cache.put_file(cache_keys[i], segment_paths[i], move=True)
+    finally:
+        for path in pinned_paths:
+            storage_manager.unpin(path)
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+def _smart_render(full_video_clip, video_path: str, edited_clips_data: List[Dict], output_path: str, profile: Dict, workers: int = 1, content_hash: str = None, progress_callback: Callable[[str, int, int], None] = None, index: media_index.MediaIndex = None) -> bool:
+    """
+    キャプションやキーフレーム外のカットに関わるGOPのみを再エンコードし、残りをストリームコピーして結合します。
+    再エンコードするセグメントはソースと同じH.264のプロファイル・レベル・Bフレームの構成・タイムベースで書き出し、
+    各セグメントは映像のみとして、音声はタイムライン全体で1回だけ作成します（AACフレームに揃っていればコピー、そうでなければ再エンコード）。
+    ソースがH.264でない場合、エンコードパラメータをソースに合わせられない場合、プロファイルが解像度を下げる場合はFalseを返し、
+    呼び出し側で通常のレンダリングに切り替えます。ソースのパラメータとキーフレームの位置はメディアインデックスから取得します。
+    """
+    codec = index.video["codec"] if index else ffmpeg_tools.probe_video_codec(video_path)
+    if codec != "h264":
+        print("ソースがH.264ではないため、スマートレンダリングを使用できません。通常レンダリングに切り替えます。")
+        return False
+    if profile["max_height"] and full_video_clip.h > profile["max_height"]:
+        print(f"'{profile['name']}' プロファイルは解像度を下げるため、スマートレンダリングを使用できません。通常レンダリングに切り替えます。")
+        return False
+    source_params = _match_source_encoding(index)
+    if source_params is None:
+        print("ソースのエンコードパラメータ（プロファイル・レベル・Bフレーム・タイムベース）に合わせられないため、スマートレンダリングを使用できません。通常レンダリングに切り替えます。")
+        return False
+
+    segments = plan_smart_segments(edited_clips_data, index.keyframes)
+    if not segments:
+        return False
+    for segment in segments:
+        if segment["mode"] == "copy":
+            segment["frames"] = index.frame_count_between(segment["start_time"], segment["end_time"])
+
+    audio_ranges = _audio_passthrough_ranges(video_path, edited_clips_data, index)
+    audio_copy = audio_ranges is not None
+    if not audio_copy:
+        audio_ranges = _timeline_ranges(edited_clips_data) if index.audio else []
+    _render_segments(
+        full_video_clip, video_path, segments, output_path, profile, workers, content_hash, progress_callback,
+        audio_ranges, audio_copy, source_params, index.audio["sample_rate"] if index.audio else None
+    )
+    copied = sum(1 for s in segments if s["mode"] == "copy")
+    print(f"スマートレンダリング: {len(segments)} セグメント中 {copied} セグメントをストリームコピーしました。")
+    return True
+
+def get_rendition(rendition, position: int = 0) -> Dict:
+    """
+    出力形式の名前（RENDITION_PRESETSのキー）または設定の辞書から、name / aspect / height / safe_area を持つ設定を返します。
+    辞書にnameがない場合は custom<position> という名前を付けます。heightはH.264で扱えるよう偶数に切り下げます。
+    未知の名前や不正な設定の場合は ValueError を送出します。
+    """
+    if not isinstance(rendition, dict):
+        if rendition not in RENDITION_PRESETS:
+            raise ValueError(f"不明な出力形式です: {rendition} (指定可能: {', '.join(RENDITION_PRESETS)})")
+        return dict(RENDITION_PRESETS[rendition], name=rendition)
+
+    rendition = dict({"aspect": None, "height": None, "safe_area": 0.0}, **rendition)
+    rendition["name"] = str(rendition.get("name") or f"custom{position}")
+    aspect = rendition["aspect"]
+    if aspect is not None:
+        if (not isinstance(aspect, (list, tuple)) or len(aspect) != 2
+                or not all(isinstance(v, (int, float)) and not isinstance(v, bool) and v > 0 for v in aspect)):
+            raise ValueError(f"出力形式 {rendition['name']} のaspectは正の数2つで指定してください: {aspect}")
+        rendition["aspect"] = tuple(aspect)
+    height = rendition["height"]
+    if height is not None:
+        if not isinstance(height, int) or isinstance(height, bool) or height < 2:
+            raise ValueError(f"出力形式 {rendition['name']} のheightは2以上の整数で指定してください: {height}")
+        rendition["height"] = height // 2 * 2
+    if not isinstance(rendition["safe_area"], (int, float)) or not 0.0 <= rendition["safe_area"] < 0.5:
+        raise ValueError(f"出力形式 {rendition['name']} のsafe_areaは0以上0.5未満で指定してください: {rendition['safe_area']}")
+    return rendition
+
+def _rendition_geometry(rendition: Dict, width: int, height: int, profile: Dict) -> Tuple[Tuple[int, int] or None, Tuple[int, int], int or None]:
+    """
+    出力形式に応じた (中央切り抜きのサイズまたはNone, テロップを配置するフレームのサイズ, 縮小後の高さまたはNone) を返します。
+    高さの上限は出力形式の指定を優先し、なければプロファイルの max_height を使います。拡大は行いません。
+    """
+    crop = None
+    frame_w, frame_h = width, height
+    if rendition["aspect"]:
+        aspect_w, aspect_h = rendition["aspect"]
+        if width * aspect_h > height * aspect_w:
+            frame_w = int(round(height * aspect_w / aspect_h)) // 2 * 2
+        else:
+            frame_h = int(round(width * aspect_h / aspect_w)) // 2 * 2
+        if abs(frame_w - width) > 1 or abs(frame_h - height) > 1:
+            crop = (frame_w, frame_h)
+        else:
+            frame_w, frame_h = width, height
+    max_height = rendition["height"] or profile["max_height"]
+    if max_height:
+        max_height = max_height // 2 * 2
+    return crop, (frame_w, frame_h), max_height if max_height and frame_h > max_height else None
+
+def _render_with_ffmpeg(video_path: str, edited_clips_data: List[Dict], outputs: List[Tuple[str, Dict]], profile: Dict, subtitle_mode: str = "burn", progress_callback: Callable[[str, int, int], None] = None, index: media_index.MediaIndex = None):
+    """
+    クリップの切り出し・結合とテロップの出力を1回のffmpegの実行で行います。
+    各クリップは入力側のシーク (-ss/-t) で必要な区間だけをデコードし、concatフィルタで結合します。
+    outputsは (出力パス, 出力形式の設定) のリストです。複数の場合は結合後の映像と音声を split で分岐し、
+    出力形式ごとに切り抜き・テロップ・縮小を行って、それぞれのエンコーダで並行してエンコードします（デコードは1回のみ）。
+    subtitle_mode='burn' の場合はASS字幕をlibassで焼き込み、'soft' の場合はSRTを字幕トラック (mov_text) として格納します。
+    """
+    if subtitle_mode not in SUBTITLE_MODES:
+        raise ValueError(f"不明な字幕の出力方法です: {subtitle_mode} (指定可能: {', '.join(SUBTITLE_MODES)})")
+    video_info = index.video if index else ffmpeg_tools.probe_video_stream(video_path)
+    if not video_info:
+        raise RuntimeError("ソース動画の映像ストリームを読み取れません。")
+    has_audio = (index.audio if index else ffmpeg_tools.probe_audio_stream(video_path)) is not None
+    clips = [c for c in edited_clips_data if float(c["end_time"]) > float(c["start_time"])]
+    if not clips:
+        raise ValueError("レンダリングするクリップがありません。")
+
+    work_dir = storage_manager.make_work_dir("quickclip_subtitles_")
+    try:
+        args = ["-y"]
+        for clip_data in clips:
+            start_time, end_time = float(clip_data["start_time"]), float(clip_data["end_time"])
+            args += ["-ss", f"{start_time:.6f}", "-t", f"{end_time - start_time:.6f}", "-i", video_path]
+        has_captions = bool(subtitles.caption_events(clips))
+        soft_subtitles = has_captions and subtitle_mode == "soft"
+        if soft_subtitles:
+            args += ["-i", subtitles.write_subtitles(clips, os.path.join(work_dir, "captions.srt"))]
+        fonts_dir = subtitles.link_fonts(clips, os.path.join(work_dir, "fonts")) if has_captions and subtitle_mode == "burn" else None
+
+        inputs = "".join(f"[{i}:v:0]" + (f"[{i}:a:0]" if has_audio else "") for i in range(len(clips)))
+        graph = [f"{inputs}concat=n={len(clips)}:v=1:a={int(has_audio)}[vcat]" + ("[acat]" if has_audio else "")]
+        if len(outputs) > 1:
+            graph.append("[vcat]split=" + str(len(outputs)) + "".join(f"[vsrc{i}]" for i in range(len(outputs))))
+            if has_audio:
+                graph.append("[acat]asplit=" + str(len(outputs)) + "".join(f"[aout{i}]" for i in range(len(outputs))))
+        video_sources = [f"[vsrc{i}]" for i in range(len(outputs))] if len(outputs) > 1 else ["[vcat]"]
+        audio_outputs = [f"[aout{i}]" for i in range(len(outputs))] if len(outputs) > 1 else ["[acat]"]
+
+        output_args = []
+        for i, (output_path, rendition) in enumerate(outputs):
+            crop, frame_size, scale_height = _rendition_geometry(rendition, video_info["width"], video_info["height"], profile)
+            video_filters = [f"crop={crop[0]}:{crop[1]}"] if crop else []
+            if fonts_dir:
+                # 字幕は切り抜き後・縮小前のフレームの座標で配置し、出力形式ごとに折り返しと位置を決め直す
+                ass_path = subtitles.write_subtitles(clips, os.path.join(work_dir, f"captions_{i}.ass"), frame_size, rendition["safe_area"])
+                video_filters.append(subtitles.ass_filter(ass_path, fonts_dir))
+            if scale_height:
+                video_filters.append(f"scale=-2:{scale_height}")
+            video_filters.append("format=yuv420p")
+            graph.append(f"{video_sources[i]}{','.join(video_filters)}[vout{i}]")
+
+            output_args += ["-map", f"[vout{i}]"]
+            if has_audio:
+                output_args += ["-map", audio_outputs[i], "-c:a", "aac", "-b:a", profile["audio_bitrate"]]
+            if soft_subtitles:
+                output_args += ["-map", f"{len(clips)}:s:0", "-c:s", "mov_text", "-metadata:s:s:0", "language=jpn"]
+            output_args += ["-c:v", "libx264", "-preset", profile["preset"], "-crf", str(profile["crf"])]
+            if profile["threads"]:
+                output_args += ["-threads", str(profile["threads"])]
+            output_args += ["-movflags", "+faststart", output_path]
+        args += ["-filter_complex", ";".join(graph)] + output_args
+
+        if video_info["fps"]:
+            total_frames = int(sum(float(c["end_time"]) - float(c["start_time"]) for c in clips) * video_info["fps"])
+        else:
+            total_frames = 0
+        report = progress_callback or (lambda stage, done, total: None)
+        with metrics.span("ffmpeg_render", profile=profile["name"], subtitle_mode=subtitle_mode, outputs=len(outputs)) as span:
+            ffmpeg_tools.run_ffmpeg_with_progress(args, lambda frame: report("frames", frame, total_frames))
+            span.set(clips=len(clips), frames=total_frames)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+def render_renditions(video_path: str, edited_clips_data: List[Dict], renditions: List, output_filename: str = "output.mp4", profile: str = None, subtitle_mode: str = "burn", progress_callback: Callable[[str, int, int], None] = None, content_hash: str = None) -> Dict[str, str]:
+    """
+    同じタイムラインを複数の出力形式（例: 'landscape' / 'vertical' / 'review'）で一度に書き出し、{形式名: 出力パス} を返します。
+    ソースのデコードとクリップの結合は1回だけ行い、形式ごとの切り抜き・テロップ配置・エンコードを1回のffmpegの実行で並行して行います。
+    出力ファイル名は output_filename に形式名を付けたもの（例: output_vertical.mp4）です。
+    失敗した場合は書きかけの出力を削除したうえで例外をそのまま送出し、呼び出し側（ジョブ・バッチ）がffmpegのエラーを表示できるようにします。
+    content_hashを渡すと、アップロード時に作成したメディアインデックスを使います。
+    """
+    base, ext = os.path.splitext(os.path.join(".", output_filename))
+    outputs = []
+    try:
+        with metrics.span("render_renditions", profile=profile or DEFAULT_ENCODER_PROFILE) as span:
+            outputs = [(f"{base}_{r['name']}{ext or '.mp4'}", r) for r in (get_rendition(r, i) for i, r in enumerate(renditions))]
+            if not outputs:
+                raise ValueError("出力形式が指定されていません。")
+            names = [rendition["name"] for _, rendition in outputs]
+            if len(set(names)) != len(names):
+                raise ValueError(f"出力形式の名前が重複しています: {', '.join(names)}")
+            index = media_index.get_media_index(video_path, content_hash)
+            if index:
+                edited_clips_data = media_index.validate_clips(edited_clips_data, index)
+            _render_with_ffmpeg(video_path, edited_clips_data, outputs, get_encoder_profile(profile), subtitle_mode, progress_callback, index)
+            span.set(clips=len(edited_clips_data), renditions=len(outputs))
+        metrics.record_peak_memory("render_renditions")
+        print(f"{len(outputs)} 形式の動画が正常にレンダリングされました: {', '.join(path for path, _ in outputs)}")
+        return {rendition["name"]: path for path, rendition in outputs}
+    except Exception:
+        for path, _ in outputs:
+            if os.path.exists(path):
+                os.remove(path)
+        raise
+
+def render_video(video_path: str, edited_clips_data: List[Dict], output_filename: str = "output.mp4", smart_render: bool = False, workers: int = None, content_hash: str = None, progress_callback: Callable[[str, int, int], None] = None, profile: str = None, source_clip=None, engine: str = None, subtitle_mode: str = "burn"):
     """
     編集されたクリップデータに基づいて最終動画をレンダリングします。
+    smart_render=True の場合、テロップのない区間をストリームコピーし、必要なGOPのみを再エンコードします。
+    workers > 1 の場合、各クリップを個別のセグメントとして並列にレンダリングし、再エンコードせずに結合します。
+    workersを省略した場合は環境変数 RENDER_WORKERS の値を使用します。
+    content_hash（ソース動画のSHA-256）を渡すと、クリップごとのセグメントをキャッシュし、変更のあったクリップだけを再レンダリングします。
+    progress_callback(stage, done, total) には 'frames' / 'audio' / 'segments' / 'concat'（並列レンダリングでは 'parallel_frames' も）の各段階の進捗が渡されます。
+    コールバックから例外を送出するとレンダリングは中断されます。
+    profileにはENCODER_PROFILESの名前（'draft' / 'standard' / 'final'）を指定します。省略時は環境変数 ENCODER_PROFILE の値を使用します。
+    ソースの音声がAACでクリップの継ぎ目がAACフレームに揃っている場合、音声は再エンコードせずにコピーします。
+    source_clipに開いたままのVideoFileClipを渡すと、ソースを開き直さずに再利用します（閉じるのは呼び出し側の責任です）。
+    engineにはRENDER_ENGINESの名前を指定します。省略時は環境変数 RENDER_ENGINE の値を使用します。
+    engine='ffmpeg' の場合はsubtitle_mode（'burn' / 'soft'）に従ってテロップを出力し、smart_render・workers・source_clipは使いません。
+    ソースのメディアインデックス（キーフレーム・長さ・ストリーム情報）を使い、クリップの区間は実際の長さに収まるように調整します。
     """
+    engine = engine or DEFAULT_RENDER_ENGINE
+    if engine not in RENDER_ENGINES:
+        raise ValueError(f"不明なレンダリングエンジンです: {engine} (指定可能: {', '.join(RENDER_ENGINES)})")
+    with metrics.span("render_video", smart_render=smart_render, profile=profile or DEFAULT_ENCODER_PROFILE, engine=engine) as span:
+        index = media_index.get_media_index(video_path, content_hash)
+        if index:
+            edited_clips_data = media_index.validate_clips(edited_clips_data, index)
+        if engine == "ffmpeg":
+            output_path = _render_video_ffmpeg(video_path, edited_clips_data, output_filename, progress_callback, profile, subtitle_mode, index)
+        else:
+            output_path = _render_video(video_path, edited_clips_data, output_filename, smart_render, workers, content_hash, progress_callback, profile, source_clip, index)
+        span.set(clips=len(edited_clips_data), ok=bool(output_path))
+    metrics.record_peak_memory("render_video")
+    return output_path
+
+def _render_video_ffmpeg(video_path: str, edited_clips_data: List[Dict], output_filename: str, progress_callback: Callable[[str, int, int], None] = None, profile: str = None, subtitle_mode: str = "burn", index: media_index.MediaIndex = None):
+    output_path = os.path.join(".", output_filename)
+    try:
+        _render_with_ffmpeg(video_path, edited_clips_data, [(output_path, get_rendition("original"))], get_encoder_profile(profile), subtitle_mode, progress_callback, index)
+        print(f"動画が正常にレンダリングされました (ffmpeg): {output_path}")
+        return output_path
+    except Exception as e:
+        print(f"動画のレンダリング中にエラーが発生しました: {e}")
+        if os.path.exists(output_path):
+            os.remove(output_path)
+        return False
+
+def _render_video(video_path: str, edited_clips_data: List[Dict], output_filename: str = "output.mp4", smart_render: bool = False, workers: int = None, content_hash: str = None, progress_callback: Callable[[str, int, int], None] = None, profile: str = None, source_clip=None, index: media_index.MediaIndex = None):
+    from moviepy.editor import VideoFileClip, concatenate_videoclips
+    if workers is None:
+        workers = DEFAULT_RENDER_WORKERS
     final_clips = []
     full_video_clip = None # 全体動画クリップは一度だけ生成し、再利用する
 
     try:
+        encoder_profile = get_encoder_profile(profile)
         # 動画ファイルを一度だけ読み込む
-        full_video_clip = VideoFileClip(video_path, audio=True, video=True)
+        full_video_clip = source_clip or VideoFileClip(video_path, audio=True, video=True)
+        output_path = os.path.join(".", output_filename)
+
+        if smart_render and _smart_render(full_video_clip, video_path, edited_clips_data, output_path, encoder_profile, workers, content_hash, progress_callback, index):
+            print(f"動画が正常にレンダリングされました: {output_path}")
+            return output_path
 
-        for clip_data in edited_clips_data:
+        audio_ranges = _audio_passthrough_ranges(video_path, edited_clips_data, index)
+        if content_hash or (workers > 1 and len(edited_clips_data) > 1):
+            segments = [
+                {"mode": "encode", "start_time": c["start_time"], "end_time": c["end_time"], "text_params": c.get("text_params")}
+                for c in edited_clips_data
+            ]
+            _render_segments(full_video_clip, video_path, segments, output_path, encoder_profile, workers, content_hash, progress_callback, audio_ranges)
+            print(f"動画が正常にレンダリングされました ({workers} ワーカー): {output_path}")
+            return output_path
+
+        timers = [_FrameTimer() if metrics.enabled() else None for _ in edited_clips_data]
+        for clip_data, timer in zip(edited_clips_data, timers):
             start_time = clip_data["start_time"]
             end_time = clip_data["end_time"]
             text_params = clip_data.get("text_params")
 
             # subclipを生成
             subclip = full_video_clip.subclip(start_time, end_time)
-
-            processed_clip = subclip
-            if text_params:
-                txt_clip = create_text_clip(
-                    text=text_params.get("text", ""),
-                    font_path=text_params.get("font_path"),
-                    font_size=text_params.get("font_size", 50),
-                    font_color=text_params.get("font_color", "white"),
-                    text_position=text_params.get("text_position", ("center", "bottom")),
-                    bg_color=text_params.get("bg_color"),
-                    duration=subclip.duration
-                )
-                if txt_clip:
-                    processed_clip = CompositeVideoClip([subclip, txt_clip])
-            
-            final_clips.append(processed_clip)
+            final_clips.append(_apply_text_params(subclip, text_params, timer))
 
         if not final_clips:
             print("レンダリングするクリップがありません。")
@@ -112,8 +817,27 @@ def render_video(video_path: str, edited_clips_data: List[Dict], output_filename
         final_video = concatenate_videoclips(final_clips)
 
         # ビデオの書き出し
-        output_path = os.path.join(".", output_filename)
-        final_video.write_videofile(output_path, codec="libx264", audio_codec="aac", temp_audiofile="temp-audio.m4a", remove_temp=True)
+        # ソースのAAC音声をコピーできる場合は映像のみを書き出し、後から音声を多重化する
+        write_path = output_path + ".video.mp4" if audio_ranges else output_path
+        with metrics.span("write_video", profile=encoder_profile["name"]) as span:
+            final_video.write_videofile(
+                write_path,
+                codec="libx264",
+                audio=not audio_ranges,
+                audio_codec="aac",
+                audio_bitrate=encoder_profile["audio_bitrate"],
+                preset=encoder_profile["preset"],
+                threads=encoder_profile["threads"],
+                ffmpeg_params=_profile_ffmpeg_params(encoder_profile, final_video.h),
+                temp_audiofile=output_path + ".temp-audio.m4a",
+                remove_temp=True,
+                logger=_progress_logger(progress_callback) or "bar"
+            )
+        if audio_ranges:
+            _mux_timeline_audio(video_path, audio_ranges, write_path, output_path)
+        if metrics.enabled():
+            for i, (clip_data, timer) in enumerate(zip(edited_clips_data, timers)):
+                metrics.log_event("clip_render", clip=i, start_time=clip_data["start_time"], end_time=clip_data["end_time"], **timer.fields())
 
         print(f"動画が正常にレンダリングされました: {output_path}")
         return output_path
@@ -122,11 +846,124 @@ def render_video(video_path: str, edited_clips_data: List[Dict], output_filename
         print(f"動画のレンダリング中にエラーが発生しました: {e}")
         return False
     finally:
-        # 全体動画クリップと中間クリップを閉じる
+        # 全体動画クリップと中間クリップを閉じる（呼び出し側から渡されたクリップは閉じない）
+        if full_video_clip and full_video_clip is not source_clip:
+            full_video_clip.close()
+        # サブクリップはソースとリーダーを共有するため、ソースを再利用する場合は閉じない
+        if source_clip is None:
+            for clip in final_clips:
+                clip.close()
+
+def get_proxy_path(content_hash: str) -> str:
+    """
+    コンテンツハッシュに対応するプロキシ動画のパスを返します（存在するとは限りません）。
+    """
+    return os.path.join(PROXY_DIR, f"{content_hash}.mp4")
+
+def build_proxy(video_path: str, content_hash: str) -> str:
+    """
+    プレビュー用の低解像度・低ビットレートのプロキシ動画を作成します。
+    シークを速くするため、キーフレーム間隔を1秒程度に短くしています。
+    """
+    proxy_path = get_proxy_path(content_hash)
+    if os.path.exists(proxy_path):
+        return proxy_path
+    os.makedirs(PROXY_DIR, exist_ok=True)
+    temp_path = f"{proxy_path}.{os.getpid()}.part.mp4"
+    try:
+        ffmpeg_tools.run_ffmpeg([
+            "-y", "-i", video_path,
+            "-map", "0:v:0", "-map", "0:a:0?",
+            "-vf", f"scale=-2:'min({PROXY_HEIGHT},ih)'",
+            "-c:v", "libx264", "-preset", "veryfast", "-crf", "30", "-g", "30", "-pix_fmt", "yuv420p",
+            "-c:a", "aac", "-b:a", "64k", "-ac", "2",
+            "-movflags", "+faststart",
+            temp_path,
+        ])
+        os.replace(temp_path, proxy_path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+    return proxy_path
+
+def start_proxy_build(video_path: str, content_hash: str):
+    """
+    プロキシ動画の作成をバックグラウンドで開始します。作成済み・作成中の場合は何もしません。
+    """
+    with _proxy_lock:
+        if os.path.exists(get_proxy_path(content_hash)):
+            return
+        future = _proxy_futures.get(content_hash)
+        if future and not future.done():
+            return
+        _proxy_futures[content_hash] = _proxy_executor.submit(build_proxy, video_path, content_hash)
+
+def get_ready_proxy(content_hash: str) -> str or None:
+    """
+    作成済みのプロキシ動画のパスを返します。まだ作成されていない場合はNoneを返します。
+    """
+    proxy_path = get_proxy_path(content_hash) if content_hash else None
+    return proxy_path if proxy_path and os.path.exists(proxy_path) else None
+
+def _scale_text_params(text_params: Dict, scale: float) -> Dict:
+    """
+    プロキシの解像度に合わせてフォントサイズを縮小したtext_paramsを返します。
+    """
+    if not text_params or scale == 1.0:
+        return text_params
+    return dict(text_params, font_size=max(1, int(round(text_params.get("font_size", 50) * scale))))
+
+def render_preview(video_path: str, edited_clips_data: List[Dict], content_hash: str = None, clip_index: int = None):
+    """
+    確認用のプレビュー動画を高速にレンダリングします。
+    プロキシ動画が作成済みであればそれを使い、ultrafastプリセットでエンコードします。
+    clip_indexを指定するとそのクリップだけを、省略するとタイムライン全体をレンダリングします。
+    同じソースを編集している別のセッションのプレビューを上書きしないよう、出力ファイル名は呼び出しごとに一意にします。
+    """
+    from moviepy.editor import VideoFileClip, concatenate_videoclips
+    clips_data = [edited_clips_data[clip_index]] if clip_index is not None else edited_clips_data
+    if not clips_data:
+        print("プレビューするクリップがありません。")
+        return False
+
+    proxy_path = get_ready_proxy(content_hash)
+    source_path = proxy_path or video_path
+    preview_clips = []
+    full_video_clip = None
+    try:
+        full_video_clip = VideoFileClip(source_path, audio=True, video=True)
+        scale = 1.0
+        if proxy_path:
+            index = media_index.get_media_index(video_path, content_hash)
+            source_height = index.video["height"] if index else ffmpeg_tools.probe_video_stream(video_path)["height"]
+            scale = full_video_clip.h / source_height if source_height else 1.0
+
+        for clip_data in clips_data:
+            end_time = min(clip_data["end_time"], full_video_clip.duration)
+            subclip = full_video_clip.subclip(clip_data["start_time"], end_time)
+            preview_clips.append(_apply_text_params(subclip, _scale_text_params(clip_data.get("text_params"), scale)))
+
+        os.makedirs(PREVIEW_DIR, exist_ok=True)
+        suffix = f"clip{clip_index + 1}" if clip_index is not None else "timeline"
+        output_path = os.path.join(PREVIEW_DIR, f"preview_{content_hash or 'source'}_{suffix}_{uuid.uuid4().hex}.mp4")
+        concatenate_videoclips(preview_clips).write_videofile(
+            output_path,
+            codec="libx264",
+            audio_codec="aac",
+            preset="ultrafast",
+            ffmpeg_params=["-crf", "32", "-pix_fmt", "yuv420p"],
+            temp_audiofile=output_path + ".m4a",
+            remove_temp=True,
+            logger=None
+        )
+        return output_path
+
+    except Exception as e:
+        print(f"プレビューのレンダリング中にエラーが発生しました: {e}")
+        return False
+    finally:
         if full_video_clip:
             full_video_clip.close()
-        for clip in final_clips:
-            clip.close()
 
 # 使用例 (StreamlitのSession Stateで管理されるデータ構造を想定)
 # video_file_path = "path/to/your/uploaded_video.mp4"
@@ -155,7 +992,6 @@ def render_video(video_path: str, edited_clips_data: List[Dict], output_filename
 #         }
 #     }
 # ]
-# set_imagemagick_binary("/usr/local/bin/magick") # 環境に合わせる
 # rendered_video_path = render_video(video_file_path, edited_clips, "final_output.mp4")
 # if rendered_video_path:
 #     st.video(rendered_video_path)
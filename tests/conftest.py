@@ -0,0 +1,15 @@
+import os
+import sys
+
+import pytest
+
+# リポジトリのルート（app.pyと同じ階層）から modules を読み込めるようにする
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    """
+    作業ディレクトリ（./cache・./static などの保存先）を一時ディレクトリに切り替えます。
+    """
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
@@ -0,0 +1,38 @@
+import importlib
+import types
+
+from modules import video_editor
+
+# 48kHzのAACフレーム（1024サンプル）の長さ
+FRAME = 1024 / 48000
+AAC_INDEX = types.SimpleNamespace(audio={"codec": "aac", "sample_rate": 48000})
+
+def clips(*ranges):
+    return [{"start_time": start, "end_time": end} for start, end in ranges]
+
+def test_aligned_ranges_are_copied():
+    ranges = [(0.0, 100 * FRAME), (200 * FRAME, 300 * FRAME)]
+    assert video_editor._audio_passthrough_ranges("unused.mp4", clips(*ranges), AAC_INDEX) == ranges
+
+def test_misaligned_seam_falls_back_to_encode():
+    assert video_editor._audio_passthrough_ranges("unused.mp4", clips((0.0, 1.01), (2.0, 3.0)), AAC_INDEX) is None
+
+def test_single_range_checks_start():
+    # 連続するクリップが1区間にまとまっても、先頭がフレームの境界からずれていればコピーしない
+    assert video_editor._audio_passthrough_ranges("unused.mp4", clips((1.01, 2.0), (2.0, 3.0)), AAC_INDEX) is None
+    assert video_editor._audio_passthrough_ranges("unused.mp4", clips((100 * FRAME, 2.0), (2.0, 3.01)), AAC_INDEX) == [(100 * FRAME, 3.01)]
+
+def test_non_aac_is_not_copied():
+    index = types.SimpleNamespace(audio={"codec": "mp3", "sample_rate": 48000})
+    assert video_editor._audio_passthrough_ranges("unused.mp4", clips((0.0, 1.0)), index) is None
+
+def test_invalid_env_choice_falls_back(monkeypatch):
+    monkeypatch.setenv("ENCODER_PROFILE", "ultra")
+    monkeypatch.setenv("RENDER_ENGINE", "gstreamer")
+    try:
+        reloaded = importlib.reload(video_editor)
+        assert reloaded.DEFAULT_ENCODER_PROFILE == "standard"
+        assert reloaded.DEFAULT_RENDER_ENGINE == "moviepy"
+    finally:
+        monkeypatch.undo()
+        importlib.reload(video_editor)
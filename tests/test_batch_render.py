@@ -0,0 +1,23 @@
+import json
+import os
+
+from modules import batch_render
+
+def test_manifest_paths_are_resolved_relative_to_manifest(tmp_path, workdir):
+    project_dir = tmp_path / "projects"
+    project_dir.mkdir()
+    manifest_path = project_dir / "manifest.json"
+    manifest_path.write_text(json.dumps({
+        "source": "videos/input.mp4",
+        "clips": [
+            {"start_time": 0.0, "end_time": 1.0, "text_params": {"text": "a", "font_path": "fonts/Custom.ttf"}},
+            {"start_time": 1.0, "end_time": 2.0, "text_params": {"text": "b", "font_path": "Noto Sans JP"}},
+            {"start_time": 2.0, "end_time": 3.0, "text_params": {"text": "c", "font_path": "/abs/Font.otf"}},
+            {"start_time": 3.0, "end_time": 4.0},
+        ],
+    }), encoding="utf-8")
+    # カレントディレクトリ（workdir）ではなく、マニフェストのディレクトリを基準にする
+    project = batch_render.load_manifests([str(manifest_path)])[0]
+    assert project["source"] == os.path.join(str(project_dir), "videos", "input.mp4")
+    fonts = [clip.get("text_params", {}).get("font_path") for clip in project["clips"]]
+    assert fonts == [os.path.join(str(project_dir), "fonts", "Custom.ttf"), "Noto Sans JP", "/abs/Font.otf", None]
@@ -0,0 +1,58 @@
+import os
+
+import pytest
+
+from modules import caption_renderer, video_editor
+
+pytest.importorskip("moviepy.editor")
+
+def test_second_text_clip_reuses_cached_png(workdir, monkeypatch):
+    rendered = []
+    render_caption_image = caption_renderer.render_caption_image
+    monkeypatch.setattr(caption_renderer, "render_caption_image", lambda *args: rendered.append(args) or render_caption_image(*args))
+
+    first = video_editor.create_text_clip("テロップ", None, 24, "white", ("center", "bottom"), bg_color="black", duration=1.0)
+    second = video_editor.create_text_clip("テロップ", None, 24, "white", ("center", "bottom"), bg_color="black", duration=1.0)
+    # 2回目はディスク上のPNGを読み込み、描画し直さない
+    assert len(rendered) == 1
+    assert len([name for _, _, files in os.walk(caption_renderer.CAPTION_CACHE_DIR) for name in files if name.endswith(".png")]) == 1
+    assert (first.get_frame(0) == second.get_frame(0)).all()
+    assert (first.mask.get_frame(0) == second.mask.get_frame(0)).all()
+
+    video_editor.create_text_clip("別のテロップ", None, 24, "white", ("center", "bottom"), bg_color="black", duration=1.0)
+    assert len(rendered) == 2
+
+def _reference_composite(frame, rgba, x, y):
+    """
+    テロップ画像を (x, y) に置き、画素ごとに out = rgb * a + frame * (1 - a) で合成した参照結果を返します。
+    """
+    import numpy as np
+    out = frame.astype(np.float64)
+    height, width = frame.shape[:2]
+    for row in range(rgba.shape[0]):
+        for col in range(rgba.shape[1]):
+            fy, fx = y + row, x + col
+            if 0 <= fy < height and 0 <= fx < width:
+                alpha = rgba[row, col, 3] / 255.0
+                out[fy, fx] = rgba[row, col, :3] * alpha + out[fy, fx] * (1 - alpha)
+    return np.floor(out + 0.5).astype(np.uint8)
+
+@pytest.mark.parametrize("position", [(3, 2), (-4, 10), ("right", "bottom")])
+def test_caption_overlay_matches_reference_alpha_composite(position):
+    import numpy as np
+    from PIL import Image
+
+    rng = np.random.default_rng(0)
+    frame = rng.integers(0, 256, size=(16, 20, 3), dtype=np.uint8)
+    rgba = rng.integers(0, 256, size=(8, 10, 4), dtype=np.uint8)
+    rgba[:, :2, 3] = 0 # 完全に透明な余白（バウンディングボックスの外）
+    rgba[0, 2:, 3] = 255
+    frame.setflags(write=False) # デコーダが返すフレームと同じく読み取り専用
+
+    overlay = caption_renderer.CaptionOverlay(Image.fromarray(rgba, "RGBA"), position, (20, 16))
+    x = caption_renderer.resolve_position(position[0], 20, 10)
+    y = caption_renderer.resolve_position(position[1], 16, 8)
+    blended = overlay.apply(frame)
+    # 四捨五入まで含めて参照結果と一致する
+    assert (blended == _reference_composite(frame, rgba, x, y)).all()
+    assert blended.dtype == np.uint8 and blended is not frame
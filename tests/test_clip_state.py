@@ -0,0 +1,17 @@
+from modules.clip_state import ClipState
+
+def test_from_dict_converts_legacy_session_clip():
+    legacy = {
+        "start_time": 1, "end_time": "4.5", "text": "テロップ", "font_path": None, "font_size": "40",
+        "font_color": "#FF0000", "text_position": ["left", "bottom"], "bg_color": "#000000",
+    }
+    clip = ClipState.from_dict(legacy)
+    assert clip.id
+    assert clip.duration == 3.5
+    assert clip.text_position_label == "下部左"
+    assert clip.to_render_dict() == {
+        "start_time": 1.0,
+        "end_time": 4.5,
+        "text_params": {"text": "テロップ", "font_path": None, "font_size": 40, "font_color": "#FF0000",
+                        "text_position": ("left", "bottom"), "bg_color": "#000000"},
+    }
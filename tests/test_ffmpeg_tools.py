@@ -0,0 +1,41 @@
+import subprocess
+
+import pytest
+
+from modules import ffmpeg_tools
+
+@pytest.fixture
+def source_video(workdir):
+    path = str(workdir / "source.mp4")
+    proc = subprocess.run([
+        ffmpeg_tools.get_ffmpeg_binary(), "-hide_banner", "-nostdin", "-loglevel", "error", "-y",
+        "-f", "lavfi", "-i", "testsrc2=size=320x180:rate=25", "-t", "6", "-g", "25",
+        "-c:v", "libx264", "-pix_fmt", "yuv420p", path,
+    ], capture_output=True, text=True)
+    assert proc.returncode == 0, proc.stderr
+    return path
+
+def _seek_frame_jpeg(video_path: str, time_sec: float) -> bytes:
+    # 時刻ごとにシークして1枚だけ取り出す（比較用）
+    return subprocess.run([
+        ffmpeg_tools.get_ffmpeg_binary(), "-hide_banner", "-nostdin", "-loglevel", "error",
+        "-ss", f"{time_sec:.3f}", "-i", video_path, "-frames:v", "1", "-vf", "scale='min(384,iw)':-2",
+        "-f", "image2", "-c:v", "mjpeg", "-q:v", "5", "-",
+    ], capture_output=True).stdout
+
+def test_extract_frames_jpeg_matches_per_frame_seeks_in_one_run(source_video, monkeypatch):
+    times = [3.5, 0.3, 1.02, 1.03, 5.9]
+    runs = []
+    run = subprocess.run
+    monkeypatch.setattr(ffmpeg_tools.subprocess, "run", lambda *args, **kwargs: (runs.append(args), run(*args, **kwargs))[1])
+
+    frames = ffmpeg_tools.extract_frames_jpeg(source_video, times)
+
+    assert len(runs) == 1
+    monkeypatch.undo()
+    assert [frame == _seek_frame_jpeg(source_video, t) for frame, t in zip(frames, times)] == [True] * len(times)
+    # 同じフレームに入る近い時刻は同じ画像になる
+    assert frames[2] == frames[3]
+
+def test_extract_frames_jpeg_empty():
+    assert ffmpeg_tools.extract_frames_jpeg("unused.mp4", []) == []
@@ -0,0 +1,53 @@
+import os
+import subprocess
+
+import pytest
+
+from modules import ffmpeg_tools, filmstrip, media_index
+
+@pytest.fixture(autouse=True)
+def fresh_state(workdir, monkeypatch):
+    monkeypatch.setattr(filmstrip, "_loaded", {})
+    monkeypatch.setattr(filmstrip, "_filmstrip_futures", {})
+    monkeypatch.setattr(media_index, "_loaded", {})
+    monkeypatch.setattr(media_index, "_failed", {})
+    monkeypatch.setattr(media_index, "_index_futures", {})
+
+def _wait(content_hash: str):
+    future = filmstrip._filmstrip_futures.get(content_hash)
+    if future:
+        future.result(timeout=60)
+
+def test_filmstrip_build_becomes_ready(workdir):
+    path = str(workdir / "source.mp4")
+    proc = subprocess.run([
+        ffmpeg_tools.get_ffmpeg_binary(), "-hide_banner", "-nostdin", "-loglevel", "error", "-y",
+        "-f", "lavfi", "-i", "testsrc2=size=320x180:rate=25", "-t", "3",
+        "-c:v", "libx264", "-pix_fmt", "yuv420p", path,
+    ], capture_output=True, text=True)
+    assert proc.returncode == 0, proc.stderr
+
+    assert filmstrip.get_filmstrip_status("good") is None
+    filmstrip.start_filmstrip_build(path, "good")
+    _wait("good")
+    assert filmstrip.get_filmstrip_status("good") == "ready"
+    posters = filmstrip.get_posters("good", [0.0, 2.0])
+    assert posters[0].shape == (90, 160, 3)
+
+def test_failed_build_is_remembered(workdir, monkeypatch):
+    broken = workdir / "broken.mp4"
+    broken.write_bytes(b"not a video")
+    builds = []
+    build_filmstrip = filmstrip.build_filmstrip
+    monkeypatch.setattr(filmstrip, "build_filmstrip", lambda *args: builds.append(args) or build_filmstrip(*args))
+
+    filmstrip.start_filmstrip_build(str(broken), "broken")
+    _wait("broken")
+    assert filmstrip.get_filmstrip_status("broken") == "failed"
+    assert os.path.exists(os.path.join(filmstrip.filmstrip_dir("broken"), "failed"))
+    assert filmstrip.get_ready_filmstrip("broken") is None
+
+    # 失敗の記録が残っている間は、画面の再実行ごとに作り直さない
+    filmstrip.start_filmstrip_build(str(broken), "broken")
+    assert "broken" not in filmstrip._filmstrip_futures
+    assert len(builds) == 1
@@ -0,0 +1,178 @@
+import hashlib
+import http.server
+import os
+import struct
+import threading
+
+import pytest
+
+from modules import font_manager
+from modules.disk_cache import DiskCache
+
+# TrueTypeの先頭4バイトを持つ、テスト用の偽のフォント
+FONT_BYTES = b"\x00\x01\x00\x00" + os.urandom(200 * 1024)
+FONT_SHA256 = hashlib.sha256(FONT_BYTES).hexdigest()
+FONT_ETAG = '"font-v1"'
+
+class FontHandler(http.server.BaseHTTPRequestHandler):
+    """
+    /font.ttf・/not-font.ttf を返し、それ以外は404を返すテスト用のハンドラーです。ETagによる条件付きリクエストに対応します。
+    """
+    requests_log = []
+
+    def do_GET(self):
+        self.requests_log.append((self.path, self.headers.get("If-None-Match")))
+        if self.path == "/font.ttf":
+            if self.headers.get("If-None-Match") == FONT_ETAG:
+                self.send_response(304)
+                self.end_headers()
+                return
+            body = FONT_BYTES
+        elif self.path == "/not-font.ttf":
+            body = b"<html>not a font</html>"
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", FONT_ETAG)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture
+def font_server():
+    FontHandler.requests_log = []
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), FontHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+@pytest.fixture
+def fonts_dir(tmp_path, monkeypatch):
+    directory = tmp_path / "google_fonts"
+    monkeypatch.setattr(font_manager, "GOOGLE_FONTS_DIR", str(directory))
+    monkeypatch.setattr(font_manager, "FONT_MANIFEST_PATH", str(directory / "manifest.json"))
+    return directory
+
+def fetch(server, path="/font.ttf", digest=FONT_SHA256, **kwargs):
+    return font_manager.fetch_google_fonts(
+        ["Test.ttf"], urls={"Test.ttf": server + path}, digests={"Test.ttf": digest}, **kwargs
+    )["Test.ttf"]
+
+def test_fetch_places_font_matching_pinned_digest(font_server, fonts_dir):
+    assert fetch(font_server) is None
+    assert (fonts_dir / "Test.ttf").read_bytes() == FONT_BYTES
+    entry = font_manager.load_font_manifest()["Test.ttf"]
+    assert entry["sha256"] == FONT_SHA256
+    assert entry["size"] == len(FONT_BYTES)
+    assert entry["etag"] == FONT_ETAG
+
+def test_fetch_rejects_digest_mismatch(font_server, fonts_dir):
+    error = fetch(font_server, digest="0" * 64)
+    assert "ハッシュ" in error
+    assert not (fonts_dir / "Test.ttf").exists()
+    assert "Test.ttf" not in font_manager.load_font_manifest()
+    assert not [name for name in os.listdir(fonts_dir) if name.endswith(".part")]
+
+def test_strict_mode_requires_pinned_digest(font_server, fonts_dir, monkeypatch):
+    monkeypatch.setattr(font_manager, "REQUIRE_PINNED_FONT_DIGESTS", True)
+    assert "ハッシュ" in fetch(font_server, digest=None)
+    assert FontHandler.requests_log == []
+
+def test_unpinned_font_is_trusted_on_first_use(font_server, fonts_dir):
+    assert fetch(font_server, digest=None) is None
+    assert (fonts_dir / "Test.ttf").read_bytes() == FONT_BYTES
+    assert font_manager.load_font_manifest()["Test.ttf"]["sha256"] == FONT_SHA256
+
+    # 以降の取得は、初回に記録したハッシュと照合する
+    manifest = font_manager.load_font_manifest()
+    manifest["Test.ttf"]["sha256"] = "0" * 64
+    font_manager._save_font_manifest(manifest)
+    assert "ハッシュ" in fetch(font_server, digest=None, revalidate=True)
+    assert font_manager.load_font_manifest()["Test.ttf"]["sha256"] == "0" * 64
+
+def test_revalidate_uses_conditional_request(font_server, fonts_dir):
+    assert fetch(font_server) is None
+    assert fetch(font_server) is None
+    # マニフェストと一致するファイルはリクエストを送らない
+    assert len(FontHandler.requests_log) == 1
+    assert fetch(font_server, revalidate=True) is None
+    assert FontHandler.requests_log[-1] == ("/font.ttf", FONT_ETAG)
+    assert (fonts_dir / "Test.ttf").read_bytes() == FONT_BYTES
+
+def test_corrupted_font_is_downloaded_again(font_server, fonts_dir):
+    assert fetch(font_server) is None
+    (fonts_dir / "Test.ttf").write_bytes(b"\x00\x01\x00\x00" + b"\x00" * (len(FONT_BYTES) - 4))
+    assert fetch(font_server, revalidate=True) is None
+    # 壊れたファイルには条件付きリクエストを送らず、取得し直す
+    assert FontHandler.requests_log[-1] == ("/font.ttf", None)
+    assert (fonts_dir / "Test.ttf").read_bytes() == FONT_BYTES
+
+def test_fetch_reports_http_error(font_server, fonts_dir):
+    assert "404" in fetch(font_server, path="/missing.ttf")
+    assert not (fonts_dir / "Test.ttf").exists()
+
+def test_fetch_rejects_non_font(font_server, fonts_dir):
+    error = fetch(font_server, path="/not-font.ttf", digest=hashlib.sha256(b"<html>not a font</html>").hexdigest())
+    assert "フォントファイルではありません" in error
+    assert not (fonts_dir / "Test.ttf").exists()
+
+def _sfnt_with_cmap(codepoints) -> bytes:
+    """
+    cmapテーブル（format 12、1文字ごとに1グループ）だけを持つ最小限のTrueTypeフォントを作成します。
+    """
+    groups = b"".join(struct.pack(">III", cp, cp, i + 1) for i, cp in enumerate(sorted(codepoints)))
+    subtable = struct.pack(">HHIII", 12, 0, 16 + len(groups), 0, len(groups) // 12) + groups
+    cmap = struct.pack(">HHHHI", 0, 1, 3, 10, 12) + subtable
+    return struct.pack(">IHHHH", 0x00010000, 1, 16, 0, 0) + struct.pack(">4sIII", b"cmap", 0, 28, len(cmap)) + cmap
+
+def _sfnt_with_ascii_cmap() -> bytes:
+    """
+    ASCIIの印字可能文字だけを収録したcmapテーブル（format 4）を持つ最小限のTrueTypeフォントを作成します。
+    """
+    seg_count = 2
+    end_codes, start_codes = (0x7E, 0xFFFF), (0x20, 0xFFFF)
+    subtable = struct.pack(">HHHHHHH", 4, 16 + 8 * seg_count, 0, 2 * seg_count, 4, 1, 0)
+    subtable += struct.pack(">2H", *end_codes) + b"\0\0" + struct.pack(">2H", *start_codes) + struct.pack(">2h", -0x1F, 1) + struct.pack(">2H", 0, 0)
+    cmap = struct.pack(">HHHHI", 0, 1, 3, 1, 12) + subtable
+    return struct.pack(">IHHHH", 0x00010000, 1, 16, 0, 0) + struct.pack(">4sIII", b"cmap", 0, 28, len(cmap)) + cmap
+
+@pytest.fixture
+def font_dir(workdir, monkeypatch):
+    directory = workdir / "fonts"
+    directory.mkdir()
+    monkeypatch.setattr(font_manager, "FONT_DIR", str(directory))
+    monkeypatch.setattr(font_manager, "font_metadata_cache", DiskCache(str(workdir / "font_metadata")))
+    monkeypatch.setattr(font_manager, "_font_registry", {"signature": None, "fonts": {}, "by_display_name": {}})
+    return directory
+
+def test_japanese_coverage_is_read_from_cmap(font_dir):
+    (font_dir / "Japanese.ttf").write_bytes(_sfnt_with_cmap(ord(c) for c in font_manager.JAPANESE_SAMPLE_CHARS))
+    (font_dir / "Latin.otf").write_bytes(_sfnt_with_ascii_cmap())
+
+    japanese = font_manager.get_font_info(str(font_dir / "Japanese.ttf"))
+    latin = font_manager.get_font_info(str(font_dir / "Latin.otf"))
+    assert japanese["japanese_coverage"] == 1.0 and japanese["supports_japanese"]
+    assert latin["japanese_coverage"] == 0.0 and not latin["supports_japanese"]
+    assert font_manager._read_cmap_codepoints(str(font_dir / "Latin.otf")) == set(range(0x20, 0x7F))
+
+def test_registry_is_rebuilt_when_directory_mtime_changes(font_dir, monkeypatch):
+    (font_dir / "Japanese.ttf").write_bytes(_sfnt_with_cmap(ord(c) for c in font_manager.JAPANESE_SAMPLE_CHARS))
+    read = []
+    read_font_metadata = font_manager._read_font_metadata
+    monkeypatch.setattr(font_manager, "_read_font_metadata", lambda path, stat: read.append(path) or read_font_metadata(path, stat))
+
+    assert font_manager.get_available_fonts() == [str(font_dir / "Japanese.ttf")]
+    assert font_manager.get_available_fonts() == [str(font_dir / "Japanese.ttf")]
+    assert len(read) == 1
+
+    # フォントを追加するとディレクトリの更新時刻が変わり、次の呼び出しで再走査する（変更のないフォントは再読み込みしない）
+    (font_dir / "Latin.otf").write_bytes(_sfnt_with_ascii_cmap())
+    os.utime(font_dir, ns=(os.stat(font_dir).st_atime_ns, os.stat(font_dir).st_mtime_ns + 1_000_000_000))
+    assert font_manager.get_available_fonts() == [str(font_dir / "Japanese.ttf"), str(font_dir / "Latin.otf")]
+    assert read == [str(font_dir / "Japanese.ttf"), str(font_dir / "Latin.otf")]
@@ -0,0 +1,132 @@
+import datetime
+import json
+import threading
+import types
+
+import pytest
+
+from modules import video_analyzer
+
+class FakeFileAPI:
+    """
+    google.generativeai の upload_file / get_file / delete_file だけを持つ、メモリ上のFile APIの代わりです。
+    """
+
+    def __init__(self, ttl: float = 48 * 60 * 60):
+        self.ttl = ttl
+        self.files = {}
+        self.uploads = []
+        self.deleted = []
+        self._lock = threading.Lock()
+
+    def _file(self, name: str):
+        entry = self.files[name]
+        return types.SimpleNamespace(
+            name=name,
+            display_name=entry["display_name"],
+            state=types.SimpleNamespace(name=entry["state"]),
+            expiration_time=entry["expiration_time"],
+        )
+
+    def upload_file(self, path: str, display_name: str = None):
+        with self._lock:
+            name = f"files/fake-{len(self.uploads) + 1}"
+            self.uploads.append(path)
+            expiration = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(seconds=self.ttl)
+            self.files[name] = {"display_name": display_name, "state": "PROCESSING", "expiration_time": expiration}
+        return self._file(name)
+
+    def get_file(self, name: str):
+        if name not in self.files:
+            raise RuntimeError(f"404 File {name} not found.")
+        return self._file(name)
+
+    def delete_file(self, name: str):
+        self.deleted.append(name)
+        self.files.pop(name, None)
+
+    def set_state(self, name: str, state: str):
+        self.files[name]["state"] = state
+
+@pytest.fixture
+def file_api(workdir, monkeypatch):
+    api = FakeFileAPI()
+    monkeypatch.setattr(video_analyzer, "_genai", api)
+    return api
+
+@pytest.fixture
+def video_file(workdir):
+    path = workdir / "video.mp4"
+    path.write_bytes(b"\0" * 1024)
+    return str(path)
+
+def test_registry_hit_skips_upload(file_api, video_file):
+    first = video_analyzer.upload_video_to_gemini(video_file, "video.mp4", "hash-a")
+    file_api.set_state(first, "ACTIVE")
+    assert video_analyzer.refresh_gemini_file_state(first, "hash-a") == "ACTIVE"
+
+    second = video_analyzer.upload_video_to_gemini(video_file, "video.mp4", "hash-a")
+
+    assert second == first
+    assert len(file_api.uploads) == 1
+    assert video_analyzer.get_registered_gemini_file("hash-a")["state"] == "ACTIVE"
+
+def test_expiring_file_is_uploaded_again(file_api, video_file):
+    file_api.ttl = video_analyzer.GEMINI_FILE_EXPIRY_MARGIN / 2
+    first = video_analyzer.upload_video_to_gemini(video_file, "video.mp4", "hash-a")
+    assert video_analyzer.get_registered_gemini_file("hash-a") is None
+
+    file_api.ttl = 48 * 60 * 60
+    second = video_analyzer.upload_video_to_gemini(video_file, "video.mp4", "hash-a")
+
+    assert second != first
+    assert len(file_api.uploads) == 2
+    assert file_api.deleted == []
+    assert video_analyzer.get_registered_gemini_file("hash-a")["name"] == second
+
+def test_missing_file_is_removed_from_registry(file_api, video_file):
+    file_id = video_analyzer.upload_video_to_gemini(video_file, "video.mp4", "hash-a")
+    file_api.files.clear()
+
+    assert video_analyzer.refresh_gemini_file_state(file_id, "hash-a") == "MISSING"
+    assert video_analyzer.get_registered_gemini_file("hash-a") is None
+
+def test_failed_file_is_deleted_and_uploaded_again(file_api, video_file):
+    first = video_analyzer.upload_video_to_gemini(video_file, "video.mp4", "hash-a")
+    file_api.set_state(first, "FAILED")
+
+    assert not video_analyzer.wait_for_gemini_file_active(first, "hash-a", timeout=1, initial_delay=0.01)
+    assert video_analyzer.get_registered_gemini_file("hash-a") is None
+
+    second = video_analyzer.upload_video_to_gemini(video_file, "video.mp4", "hash-a")
+    assert second != first
+    assert file_api.deleted == [first]
+    assert video_analyzer.get_registered_gemini_file("hash-a")["name"] == second
+
+def test_wait_for_active_polls_until_active(file_api, video_file):
+    file_id = video_analyzer.upload_video_to_gemini(video_file, "video.mp4", "hash-a")
+    polls = []
+    get_file = file_api.get_file
+
+    def get_file_then_activate(name):
+        polls.append(name)
+        if len(polls) == 3:
+            file_api.set_state(name, "ACTIVE")
+        return get_file(name)
+
+    file_api.get_file = get_file_then_activate
+    assert video_analyzer.wait_for_gemini_file_active(file_id, "hash-a", timeout=5, initial_delay=0.01, max_delay=0.02)
+    assert len(polls) == 3
+
+def test_concurrent_registry_writes_keep_every_entry(file_api, video_file):
+    hashes = [f"hash-{i}" for i in range(32)]
+    threads = [threading.Thread(target=video_analyzer.upload_video_to_gemini, args=(video_file, "video.mp4", h)) for h in hashes]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    with open(video_analyzer.GEMINI_REGISTRY_PATH, "r", encoding="utf-8") as f:
+        registry = json.load(f)
+    assert sorted(registry) == sorted(hashes)
+    assert sorted(entry["name"] for entry in registry.values()) == sorted(file_api.files)
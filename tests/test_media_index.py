@@ -0,0 +1,50 @@
+import subprocess
+import threading
+
+import pytest
+
+from modules import ffmpeg_tools, media_index
+
+@pytest.fixture(autouse=True)
+def fresh_state(workdir, monkeypatch):
+    monkeypatch.setattr(media_index, "_loaded", {})
+    monkeypatch.setattr(media_index, "_failed", {})
+    monkeypatch.setattr(media_index, "_index_futures", {})
+
+@pytest.fixture
+def source_video(workdir):
+    path = str(workdir / "source.mp4")
+    proc = subprocess.run([
+        ffmpeg_tools.get_ffmpeg_binary(), "-hide_banner", "-nostdin", "-loglevel", "error", "-y",
+        "-f", "lavfi", "-i", "testsrc2=size=160x90:rate=25", "-t", "3", "-g", "25",
+        "-c:v", "libx264", "-pix_fmt", "yuv420p", path,
+    ], capture_output=True, text=True)
+    assert proc.returncode == 0, proc.stderr
+    return path
+
+def test_get_ready_index_does_not_wait(source_video, monkeypatch):
+    release = threading.Event()
+    build_media_index = media_index.build_media_index
+    monkeypatch.setattr(media_index, "build_media_index", lambda path: release.wait(10) and build_media_index(path))
+
+    assert media_index.get_ready_index(source_video, "hash") is None
+    future = media_index._index_futures["hash"]
+    assert not future.done()
+    release.set()
+    future.result(timeout=30)
+    index = media_index.get_ready_index(source_video, "hash")
+    assert index is not None and abs(index.duration - 3.0) < 0.1
+
+def test_failed_build_is_not_retried(workdir, monkeypatch):
+    broken = workdir / "broken.mp4"
+    broken.write_bytes(b"not a video")
+    builds = []
+    build_media_index = media_index.build_media_index
+    monkeypatch.setattr(media_index, "build_media_index", lambda path: builds.append(path) or build_media_index(path))
+
+    assert media_index.get_media_index(str(broken), "broken") is None
+    assert "broken" in media_index._failed
+    assert media_index.start_index_build(str(broken), "broken") is None
+    assert media_index.get_ready_index(str(broken), "broken") is None
+    assert media_index.get_media_index(str(broken), "broken") is None
+    assert len(builds) == 1
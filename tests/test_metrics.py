@@ -0,0 +1,54 @@
+import pytest
+
+from modules import metrics
+
+@pytest.fixture
+def records(monkeypatch):
+    monkeypatch.setattr(metrics, "METRICS_ENABLED", True)
+    monkeypatch.setattr(metrics, "_spans", {})
+    monkeypatch.setattr(metrics, "_counters", {})
+    monkeypatch.setattr(metrics, "_gauges", {})
+    logged = []
+    monkeypatch.setattr(metrics, "_log", logged.append)
+    return logged
+
+def test_render_prometheus(records):
+    with metrics.span("concat", mode="copy") as span:
+        span.set(bytes=1024)
+    with pytest.raises(ValueError):
+        with metrics.span("concat", mode="copy"):
+            raise ValueError("失敗")
+    metrics.increment("segment_cache_hits", 3)
+    metrics.set_gauge("peak_rss_bytes", 2048, stage='render "final"', process="self")
+
+    lines = metrics.render_prometheus().splitlines()
+    assert lines[0] == "# TYPE quickclip_concat_seconds summary"
+    assert 'quickclip_concat_seconds_count{mode="copy"} 2' in lines
+    assert any(line.startswith('quickclip_concat_seconds_sum{mode="copy"} ') for line in lines)
+    assert "# TYPE quickclip_concat_seconds_max gauge" in lines
+    assert "# TYPE quickclip_concat_errors_total counter" in lines
+    assert 'quickclip_concat_errors_total{mode="copy"} 1' in lines
+    assert 'quickclip_concat_bytes_total{mode="copy"} 1024' in lines
+    assert "quickclip_segment_cache_hits_total 3" in lines
+    # ラベルの値の引用符はエスケープする
+    assert 'quickclip_peak_rss_bytes{process="self",stage="render \\"final\\""} 2048' in lines
+
+    assert [record["span"] for record in records if "span" in record] == ["concat", "concat"]
+    assert records[1]["error"] == "ValueError"
+    assert "bytes_per_second" in records[0]
+
+def test_spans_are_noops_when_disabled(records, monkeypatch):
+    monkeypatch.setattr(metrics, "METRICS_ENABLED", False)
+    with metrics.span("concat", mode="copy") as span:
+        span.set(bytes=1024)
+    metrics.increment("segment_cache_hits")
+    metrics.set_gauge("peak_rss_bytes", 2048)
+    metrics.log_event("clip_render", clip=0)
+
+    # 無効な場合は共有の何もしないスパンを返し、集計もログ出力も行わない
+    assert span is metrics._NOOP_SPAN
+    assert metrics.span("other") is span
+    assert metrics._spans == {} and metrics._counters == {} and metrics._gauges == {}
+    assert records == []
+    assert metrics.render_prometheus() == "\n"
+    assert metrics.start_metrics_server(9) is None
@@ -0,0 +1,60 @@
+import multiprocessing
+import subprocess
+from types import SimpleNamespace
+
+import pytest
+
+from modules import ffmpeg_tools, render_jobs, video_editor
+
+FPS = 25
+
+@pytest.fixture
+def source_video(workdir):
+    """
+    1秒間隔のキーフレームを持つ、音声なしのH.264のテスト用ソースを作成します。
+    """
+    path = str(workdir / "source.mp4")
+    proc = subprocess.run([
+        ffmpeg_tools.get_ffmpeg_binary(), "-hide_banner", "-nostdin", "-loglevel", "error", "-y",
+        "-f", "lavfi", "-i", f"testsrc2=size=160x90:rate={FPS}",
+        "-t", "4", "-c:v", "libx264", "-g", str(FPS), "-pix_fmt", "yuv420p", path,
+    ], capture_output=True, text=True)
+    assert proc.returncode == 0, proc.stderr
+    return path
+
+@pytest.fixture
+def segments(monkeypatch):
+    # 実行環境のCPU数に関わらず、2つのワーカーでプロセスプールを使う
+    monkeypatch.setattr(video_editor.os, "cpu_count", lambda: 2)
+    return [
+        {"mode": "copy", "start_time": 0.0, "end_time": 2.0, "frames": 2 * FPS, "text_params": None},
+        {"mode": "copy", "start_time": 2.0, "end_time": 4.0, "frames": 2 * FPS, "text_params": None},
+    ]
+
+def test_spawn_pool_renders_segments(source_video, segments, workdir):
+    stages = []
+    output_path = str(workdir / "output.mp4")
+    video_editor._render_segments(
+        SimpleNamespace(fps=FPS, audio=None), source_video, segments, output_path, video_editor.get_encoder_profile(),
+        workers=2, progress_callback=lambda stage, done, total: stages.append((stage, done, total)),
+    )
+    assert len(ffmpeg_tools.read_raw_frames(output_path, FPS, 16, 9)) == 4 * FPS
+    assert ("segments", 2, 2) in stages
+    assert ("parallel_frames", 4 * FPS, 4 * FPS) in stages
+    assert not multiprocessing.active_children()
+
+def test_cancel_terminates_spawn_pool(source_video, segments, workdir, monkeypatch):
+    def cancel(stage, done, total):
+        if stage == "parallel_frames":
+            raise render_jobs.RenderCancelled()
+
+    monkeypatch.setattr(video_editor, "SEGMENT_POLL_INTERVAL", 0.05)
+    output_path = workdir / "output.mp4"
+    with pytest.raises(render_jobs.RenderCancelled):
+        video_editor._render_segments(
+            SimpleNamespace(fps=FPS, audio=None), source_video, segments, str(output_path), video_editor.get_encoder_profile(),
+            workers=2, progress_callback=cancel,
+        )
+    # ワーカーの完了を待たずにプールを終了し、結合も行わない
+    assert not multiprocessing.active_children()
+    assert not output_path.exists()
@@ -0,0 +1,102 @@
+import multiprocessing
+import threading
+import time
+
+import pytest
+
+from modules import render_jobs, storage_manager, video_editor
+
+@pytest.fixture
+def job(monkeypatch):
+    job_id = "test-job"
+    monkeypatch.setitem(render_jobs._jobs, job_id, {
+        "status": "running", "stage": "prepare", "progress": 0.0, "started_at": time.time() - 10,
+        "frames_encoded": 0, "frames_base": 0, "frame_done": 0, "frame_total": 0,
+        "segments_done": 0, "segments_total": 0, "parallel_done": 0, "parallel_total": 0, "eta_seconds": None,
+    })
+    return job_id
+
+def test_parallel_frames_advance_progress_between_segments(job):
+    callback = render_jobs._make_progress_callback(job, threading.Event())
+    callback("segments", 0, 2)
+    callback("parallel_frames", 30, 120)
+    assert render_jobs._jobs[job]["progress"] == pytest.approx(0.25)
+    callback("parallel_frames", 90, 120)
+    # セグメントの完了を待たずに、フレーム数の合計で進捗と残り時間が進む
+    assert render_jobs._jobs[job]["progress"] == pytest.approx(0.75)
+    assert render_jobs._jobs[job]["frames_encoded"] == 90
+    assert render_jobs._jobs[job]["eta_seconds"] == pytest.approx(10 / 3, rel=0.2)
+
+def test_worker_reports_frames_to_shared_counts(monkeypatch):
+    def fake_render_segment(video_path, segment, segment_path, fps, audio_fps, profile, audio, full_video_clip, logger, source_params):
+        for _ in logger.iter_bar(t=range(10)):
+            pass
+        return segment_path
+
+    counts = multiprocessing.get_context("spawn").RawArray("q", 2)
+    monkeypatch.setattr(video_editor, "_render_segment", fake_render_segment)
+    monkeypatch.setattr(video_editor, "_worker_frame_counts", None)
+    video_editor._init_segment_worker(counts)
+    assert video_editor._render_segment_task((1, "src.mp4", {}, "out.mp4", 25, 44100, {}, True, None)) == 1
+    # proglogは末尾で総数より1つ多く報告することがある（親プロセスでセグメントのフレーム数に頭打ちする）
+    assert counts[0] == 0 and counts[1] in (10, 11)
+
+@pytest.fixture
+def jobs(workdir, monkeypatch):
+    monkeypatch.setattr(render_jobs, "_jobs", {})
+    monkeypatch.setattr(storage_manager, "_pinned", {})
+    monkeypatch.setattr(storage_manager, "_leases", {})
+
+def _wait(job_id: str) -> dict:
+    render_jobs._jobs[job_id]["_future"].result(timeout=30)
+    return render_jobs.get_render_job(job_id)
+
+def test_job_progress_advances_and_completes(jobs, monkeypatch):
+    reported, proceed = threading.Event(), threading.Event()
+
+    def fake_render_video(video_path, clips, output_filename, progress_callback=None, **options):
+        progress_callback("frames", 25, 100)
+        reported.set()
+        assert proceed.wait(10)
+        progress_callback("frames", 100, 100)
+        return output_filename
+
+    monkeypatch.setattr(video_editor, "render_video", fake_render_video)
+    job_id = render_jobs.submit_render_job("source.mp4", [{"start_time": 0.0, "end_time": 4.0}], "output.mp4")
+    assert reported.wait(10)
+    job = render_jobs.get_render_job(job_id)
+    assert job["status"] == "running" and job["stage"] == "frames"
+    assert job["progress"] == pytest.approx(0.25) and job["frames_encoded"] == 25
+    # レンダリング中のソースと出力先は容量上限による削除の対象から外す
+    assert storage_manager.is_pinned("source.mp4") and storage_manager.is_pinned("output.mp4")
+    proceed.set()
+
+    job = _wait(job_id)
+    assert job["status"] == "completed" and job["progress"] == 1.0 and job["output_path"] == "output.mp4"
+    assert not storage_manager.is_pinned("source.mp4") and not storage_manager.is_pinned("output.mp4")
+
+def test_cancel_raises_render_cancelled_and_unpins_output(jobs, monkeypatch):
+    started, raised = threading.Event(), []
+
+    def fake_render_video(video_path, clips, output_filename, progress_callback=None, **options):
+        try:
+            for done in range(1000):
+                progress_callback("frames", done, 1000)
+                started.set()
+                time.sleep(0.01)
+        except render_jobs.RenderCancelled as e:
+            raised.append(e)
+            raise
+        return output_filename
+
+    monkeypatch.setattr(video_editor, "render_video", fake_render_video)
+    job_id = render_jobs.submit_render_job("source.mp4", [{"start_time": 0.0, "end_time": 4.0}], "output.mp4")
+    assert started.wait(10)
+    assert render_jobs.cancel_render_job(job_id)
+
+    job = _wait(job_id)
+    # キャンセルは次の進捗報告で RenderCancelled として届き、レンダリングを中断する
+    assert len(raised) == 1
+    assert job["status"] == "cancelled" and job["progress"] < 1.0
+    assert not storage_manager.is_pinned("source.mp4") and not storage_manager.is_pinned("output.mp4")
+    assert not render_jobs.cancel_render_job(job_id)
@@ -0,0 +1,60 @@
+import os
+import re
+import subprocess
+
+import pytest
+
+from modules import ffmpeg_tools, render_jobs, video_editor
+
+def test_custom_rendition_defaults_name_and_even_height():
+    rendition = video_editor.get_rendition({"aspect": [1, 1], "height": 301}, 2)
+    assert rendition["name"] == "custom2"
+    assert rendition["aspect"] == (1, 1)
+    assert rendition["height"] == 300
+
+@pytest.mark.parametrize("rendition", [
+    {"aspect": [16, 0]},
+    {"aspect": "16:9"},
+    {"height": 1},
+    {"height": 720.5},
+    {"safe_area": 0.5},
+])
+def test_invalid_custom_rendition_is_rejected(rendition):
+    with pytest.raises(ValueError):
+        video_editor.get_rendition(rendition)
+
+def test_odd_height_rendition_renders(workdir):
+    source = str(workdir / "source.mp4")
+    proc = subprocess.run([
+        ffmpeg_tools.get_ffmpeg_binary(), "-hide_banner", "-nostdin", "-loglevel", "error", "-y",
+        "-f", "lavfi", "-i", "testsrc2=size=640x360:rate=25", "-t", "2",
+        "-c:v", "libx264", "-pix_fmt", "yuv420p", source,
+    ], capture_output=True, text=True)
+    assert proc.returncode == 0, proc.stderr
+
+    outputs = video_editor.render_renditions(
+        source, [{"start_time": 0.0, "end_time": 1.0, "text_params": None}],
+        [{"aspect": [1, 1], "height": 301}, "original"], "out.mp4", profile="draft"
+    )
+    assert outputs and set(outputs) == {"custom0", "original"}
+    log = subprocess.run([ffmpeg_tools.get_ffmpeg_binary(), "-hide_banner", "-i", outputs["custom0"]], capture_output=True, text=True).stderr
+    assert re.search(r"Video: h264.*, 300x300", log)
+
+def test_duplicate_rendition_names_fail(workdir):
+    with pytest.raises(ValueError, match="重複"):
+        video_editor.render_renditions("missing.mp4", [{"start_time": 0.0, "end_time": 1.0}], ["review", {"name": "review"}])
+
+def test_render_error_reaches_job_and_partial_outputs_are_removed(workdir, monkeypatch):
+    def failing_render(video_path, clips, outputs, *args):
+        for path, _ in outputs:
+            open(path, "wb").close()
+        raise RuntimeError("ffmpeg: Unable to open subtitles file")
+
+    monkeypatch.setattr(video_editor, "_render_with_ffmpeg", failing_render)
+    job_id = render_jobs.submit_render_job("missing.mp4", [{"start_time": 0.0, "end_time": 1.0}], "out.mp4", renditions=["original", "review"])
+    render_jobs._jobs[job_id]["_future"].result(timeout=30)
+
+    job = render_jobs.get_render_job(job_id)
+    assert job["status"] == "failed"
+    assert "Unable to open subtitles file" in job["error"]
+    assert not os.path.exists("out_original.mp4") and not os.path.exists("out_review.mp4")
@@ -0,0 +1,82 @@
+import copy
+import os
+import subprocess
+
+import pytest
+
+from modules import ffmpeg_tools, storage_manager, video_editor
+from modules.disk_cache import DiskCache
+
+FPS = 25
+
+@pytest.fixture
+def cache(workdir, monkeypatch):
+    monkeypatch.setattr(storage_manager, "_pinned", {})
+    monkeypatch.setattr(storage_manager, "_leases", {})
+    return DiskCache(str(workdir / "segments"), max_bytes=2048, suffix=".mp4")
+
+def _put(cache, key: str, size: int = 1024) -> str:
+    source = f"{key}.src"
+    with open(source, "wb") as f:
+        f.write(b"\0" * size)
+    return cache.put_file(key, source, move=True)
+
+def test_pinned_entry_survives_eviction(cache):
+    oldest = _put(cache, "a")
+    os.utime(oldest, (1, 1))
+    storage_manager.pin(oldest)
+    try:
+        _put(cache, "b")
+        newest = _put(cache, "c")
+        # 最も古いエントリは使用中のため残し、次に古いエントリを削除する
+        assert os.path.exists(oldest)
+        assert not os.path.exists(cache.path_for("b"))
+        assert os.path.exists(newest)
+    finally:
+        storage_manager.unpin(oldest)
+    _put(cache, "d")
+    assert not os.path.exists(oldest)
+
+@pytest.fixture
+def source_video(workdir):
+    path = str(workdir / "source.mp4")
+    proc = subprocess.run([
+        ffmpeg_tools.get_ffmpeg_binary(), "-hide_banner", "-nostdin", "-loglevel", "error", "-y",
+        "-f", "lavfi", "-i", f"testsrc2=size=160x90:rate={FPS}", "-t", "8", "-g", str(FPS),
+        "-c:v", "libx264", "-pix_fmt", "yuv420p", path,
+    ], capture_output=True, text=True)
+    assert proc.returncode == 0, proc.stderr
+    return path
+
+def test_rerender_only_encodes_edited_segments(source_video, workdir, monkeypatch):
+    moviepy_editor = pytest.importorskip("moviepy.editor")
+    monkeypatch.setattr(video_editor, "segment_cache", DiskCache(str(workdir / "segments"), suffix=".mp4"))
+    rendered = []
+    render_segment = video_editor._render_segment
+    monkeypatch.setattr(video_editor, "_render_segment", lambda video_path, segment, *args: rendered.append(segment) or render_segment(video_path, segment, *args))
+
+    clips = [
+        {"start_time": 0.0, "end_time": 2.0, "text_params": None},
+        {"start_time": 2.5, "end_time": 5.0, "text_params": {"text": "テロップ", "font_size": 16, "font_color": "white"}},
+        {"start_time": 5.0, "end_time": 8.0, "text_params": None},
+    ]
+
+    def render(clips):
+        rendered.clear()
+        source_clip = moviepy_editor.VideoFileClip(source_video)
+        try:
+            assert video_editor.render_video(source_video, clips, "output.mp4", smart_render=True, workers=1, content_hash="hash-a", source_clip=source_clip)
+        finally:
+            source_clip.close()
+        return [(segment["mode"], segment["start_time"], segment["end_time"]) for segment in rendered]
+
+    first = render(clips)
+    assert any(mode == "copy" for mode, _, _ in first) and any(mode == "encode" for mode, _, _ in first)
+    assert render(clips) == []
+
+    # テロップを変更したクリップのセグメントだけを再エンコードし、他はキャッシュから結合する
+    edited = copy.deepcopy(clips)
+    edited[1]["text_params"]["text"] = "変更後のテロップ"
+    second = render(edited)
+    assert second == [(mode, start, end) for mode, start, end in first if start >= 2.5 and end <= 5.0]
+    assert second and all(mode == "encode" for mode, _, _ in second)
@@ -0,0 +1,75 @@
+import re
+import subprocess
+
+import pytest
+
+from modules import ffmpeg_tools, video_editor
+
+moviepy_editor = pytest.importorskip("moviepy.editor")
+
+FPS = 25
+
+def _ffmpeg(*args) -> subprocess.CompletedProcess:
+    return subprocess.run([ffmpeg_tools.get_ffmpeg_binary(), "-hide_banner", "-nostdin", *args], capture_output=True, text=True)
+
+@pytest.fixture
+def source_video(workdir):
+    """
+    48kHz・モノラルのAAC音声と、Bフレームを含む1秒間隔のキーフレームを持つH.264 (Main) のテスト用ソースを作成します。
+    """
+    path = str(workdir / "source.mp4")
+    proc = _ffmpeg(
+        "-loglevel", "error", "-y",
+        "-f", "lavfi", "-i", f"testsrc2=size=320x180:rate={FPS}",
+        "-f", "lavfi", "-i", "sine=frequency=440:sample_rate=48000",
+        "-t", "12", "-c:v", "libx264", "-profile:v", "main", "-g", str(FPS), "-bf", "2", "-pix_fmt", "yuv420p",
+        "-c:a", "aac", "-ac", "1", "-ar", "48000", path,
+    )
+    assert proc.returncode == 0, proc.stderr
+    return path
+
+def _stream_end_times(path: str) -> dict:
+    """
+    出力ファイルのパケットを読み出し、ストリームごとの最後のパケットの終了時刻（秒）を返します。
+    """
+    table = _ffmpeg("-i", path, "-map", "0", "-c", "copy", "-f", "framecrc", "-").stdout
+    time_bases = {int(stream): int(denominator) for stream, denominator in re.findall(r"#tb (\d+): 1/(\d+)", table)}
+    ends = {}
+    for line in table.splitlines():
+        if line.startswith("#"):
+            continue
+        columns = [c.strip() for c in line.split(",")]
+        stream = int(columns[0])
+        ends[stream] = max(ends.get(stream, 0.0), (int(columns[2]) + int(columns[3])) / time_bases[stream])
+    return ends
+
+def test_smart_render_keeps_source_audio_and_av_sync(source_video, monkeypatch):
+    copied = []
+    stream_copy_segment = ffmpeg_tools.stream_copy_segment
+    monkeypatch.setattr(ffmpeg_tools, "stream_copy_segment", lambda *args, **kwargs: copied.append(args) or stream_copy_segment(*args, **kwargs))
+    clips = [
+        {"start_time": 0.3, "end_time": 4.1, "text_params": {"text": "テロップ", "font_size": 24, "font_color": "white"}},
+        {"start_time": 5.0, "end_time": 11.8, "text_params": None},
+    ]
+
+    source_clip = moviepy_editor.VideoFileClip(source_video)
+    try:
+        output_path = video_editor.render_video(source_video, clips, "output.mp4", smart_render=True, source_clip=source_clip)
+    finally:
+        source_clip.close()
+
+    assert output_path
+    assert copied, "キーフレーム間がストリームコピーされていない（通常レンダリングに切り替わった）"
+
+    info = _ffmpeg("-i", output_path).stderr
+    assert re.search(r"Audio: aac.*48000 Hz, mono", info), info
+
+    decode = _ffmpeg("-loglevel", "warning", "-i", output_path, "-f", "null", "-")
+    assert decode.returncode == 0
+    assert "non monotonically increasing dts" not in decode.stderr
+    assert not re.search(r"error", decode.stderr, re.IGNORECASE), decode.stderr
+
+    ends = _stream_end_times(output_path)
+    expected = sum(c["end_time"] - c["start_time"] for c in clips)
+    assert abs(ends[0] - ends[1]) <= 1.5 / FPS
+    assert abs(ends[0] - expected) <= 1.5 / FPS
@@ -0,0 +1,74 @@
+import os
+
+import pytest
+
+from modules import storage_manager
+
+@pytest.fixture
+def storage(workdir, monkeypatch):
+    monkeypatch.setattr(storage_manager, "_pinned", {})
+    monkeypatch.setattr(storage_manager, "_leases", {})
+    return workdir
+
+def _write(path: str, size: int = 1024) -> str:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(b"\0" * size)
+    return path
+
+def test_pressure_eviction_keeps_sources_and_leased_outputs(storage):
+    source = _write(os.path.join(storage_manager.area_path("sources"), "abc.mp4"))
+    leased_output = _write(storage_manager.new_output_path("mine.mp4"))
+    other_output = _write(storage_manager.new_output_path("other.mp4"))
+    preview = _write(os.path.join(storage_manager.area_path("previews"), "preview.mp4"))
+    storage_manager.lease(leased_output)
+
+    # 確保できない空き容量を要求し、削除できるものをすべて削除させる
+    assert storage_manager.ensure_free_space(required_bytes=1 << 62) is False
+    assert os.path.exists(source)
+    assert os.path.exists(leased_output)
+    assert not os.path.exists(other_output)
+    assert not os.path.exists(preview)
+
+def test_expired_lease_no_longer_protects(storage, monkeypatch):
+    output = _write(storage_manager.new_output_path("mine.mp4"))
+    storage_manager.lease(output, seconds=60)
+    now = storage_manager.time.time()
+    monkeypatch.setattr(storage_manager.time, "time", lambda: now + 61)
+    storage_manager.ensure_free_space(required_bytes=1 << 62)
+    assert not os.path.exists(output)
+
+def test_sources_still_expire_by_ttl(storage):
+    source = _write(os.path.join(storage_manager.area_path("sources"), "old.mp4"))
+    old = storage_manager.time.time() - storage_manager.STORAGE_AREAS["sources"]["ttl"] - 60
+    os.utime(source, (old, old))
+    storage_manager.enforce_area("sources")
+    assert not os.path.exists(source)
+
+def test_static_serving_limit_is_raised(storage, monkeypatch):
+    app_static_file_handler = pytest.importorskip("streamlit.web.server.app_static_file_handler")
+    monkeypatch.setattr(app_static_file_handler, "MAX_APP_STATIC_FILE_SIZE", 200 * storage_manager.MB)
+    monkeypatch.setattr(storage_manager, "_static_max_bytes", 200 * storage_manager.MB)
+    output = storage_manager.new_output_path("large.mp4")
+    with open(output, "wb") as f:
+        f.truncate(300 * storage_manager.MB)
+    assert storage_manager.static_url(output) is None
+    assert storage_manager.configure_static_serving() == storage_manager.STATIC_SERVING_MAX_BYTES
+    assert app_static_file_handler.MAX_APP_STATIC_FILE_SIZE == storage_manager.STATIC_SERVING_MAX_BYTES
+    assert storage_manager.static_url(output).startswith("app/static/outputs/")
+
+def test_static_serving_limit_warns_when_streamlit_changes(storage, monkeypatch, capsys):
+    app_static_file_handler = pytest.importorskip("streamlit.web.server.app_static_file_handler")
+    monkeypatch.delattr(app_static_file_handler, "MAX_APP_STATIC_FILE_SIZE")
+    monkeypatch.setattr(storage_manager, "_static_max_bytes", 200 * storage_manager.MB)
+    assert storage_manager.configure_static_serving() == 200 * storage_manager.MB
+    assert "変更できませんでした" in capsys.readouterr().out
+
+def test_touched_entry_is_evicted_last(storage):
+    first = _write(os.path.join(storage_manager.area_path("previews"), "first.mp4"))
+    second = _write(os.path.join(storage_manager.area_path("previews"), "second.mp4"))
+    os.utime(first, (1, 1))
+    os.utime(second, (2, 2))
+    storage_manager.touch(first)
+    entries = sorted(storage_manager._area_entries("previews"))
+    assert [path for _, _, path in entries] == [second, first]
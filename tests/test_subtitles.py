@@ -0,0 +1,50 @@
+import subprocess
+
+from modules import ffmpeg_tools, subtitles
+
+CLIPS = [
+    {"start_time": 1.0, "end_time": 3.5, "text_params": {"text": "一行目\n二行目", "font_size": 20, "font_color": "white", "bg_color": "#FF8000"}},
+    {"start_time": 5.0, "end_time": 6.0, "text_params": None},
+    {"start_time": 10.0, "end_time": 12.25, "text_params": {"text": "{強調}", "font_size": 20, "font_color": "white", "text_position": (0.1, 0.2)}},
+    {"start_time": 20.0, "end_time": 21.0, "text_params": {"text": "同じ見た目", "font_size": 20, "font_color": "white", "bg_color": "#FF8000"}},
+]
+
+def test_build_srt():
+    # 時刻はソースではなく、クリップを結合した出力動画上の時刻
+    assert subtitles.build_srt(CLIPS) == (
+        "1\n00:00:00,000 --> 00:00:02,500\n一行目\n二行目\n\n"
+        "2\n00:00:03,500 --> 00:00:05,750\n{強調}\n\n"
+        "3\n00:00:05,750 --> 00:00:06,750\n同じ見た目\n"
+    )
+
+def test_build_ass():
+    lines = subtitles.build_ass(CLIPS, (640, 360)).splitlines()
+    assert "PlayResX: 640" in lines and "PlayResY: 360" in lines
+    styles = [line for line in lines if line.startswith("Style: ")]
+    dialogues = [line for line in lines if line.startswith("Dialogue: ")]
+    # 同じ見た目のテロップは1つのスタイルを共有する
+    assert len(styles) == 2
+    caption1 = dict(zip(subtitles._ASS_STYLE_FIELDS, styles[0][len("Style: "):].split(",")))
+    assert caption1["Name"] == "Caption1" and caption1["Fontname"] == subtitles.DEFAULT_FONT_NAME
+    assert caption1["BackColour"] == "&H000080FF" and caption1["BorderStyle"] == "3"
+    assert caption1["Alignment"] == "2"
+    assert dialogues == [
+        "Dialogue: 0,0:00:00.00,0:00:02.50,Caption1,,0,0,0,,一行目\\N二行目",
+        "Dialogue: 0,0:00:03.50,0:00:05.75,Caption2,,0,0,0,,{\\pos(68,76)}\\{強調\\}",
+        "Dialogue: 0,0:00:05.75,0:00:06.75,Caption1,,0,0,0,,同じ見た目",
+    ]
+
+def test_ass_filter_escapes_colon_and_quote(workdir):
+    directory = workdir / "it's: subs"
+    directory.mkdir()
+    ass_path = directory / "captions.ass"
+    subtitles.write_subtitles(CLIPS, str(ass_path), (64, 36))
+
+    # オプションの区切り (:) と引用符 (') をオプションとフィルタグラフの2段階でエスケープする
+    assert subtitles.ass_filter(str(ass_path)) == "ass=filename=" + str(ass_path).replace("'", "\\\\\\'").replace(":", "\\\\:")
+    proc = subprocess.run([
+        ffmpeg_tools.get_ffmpeg_binary(), "-hide_banner", "-nostdin", "-loglevel", "error",
+        "-f", "lavfi", "-i", "color=c=black:size=64x36:rate=25:duration=1",
+        "-vf", subtitles.ass_filter(str(ass_path), str(directory)), "-f", "null", "-",
+    ], capture_output=True, text=True)
+    assert proc.returncode == 0, proc.stderr
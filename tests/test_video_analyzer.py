@@ -0,0 +1,345 @@
+import asyncio
+import http.server
+import json
+import os
+import re
+import subprocess
+import threading
+import time
+import uuid
+
+import pytest
+
+from modules import ffmpeg_tools, media_index, metrics, video_analyzer
+from modules.disk_cache import DiskCache
+
+# 擬似エンドポイントが返すシーン（動画の先頭からの秒数）
+SCENES = [(0.0, 3.0), (3.0, 6.0), (6.0, 9.0), (9.0, 12.0)]
+WINDOW_PATTERN = re.compile(r"この動画の ([\d.]+)秒 〜 ([\d.]+)秒")
+
+def _find(value, *keys):
+    """
+    JSONの中から指定したキーの値をすべて取り出します（RESTのフィールド名はcamelCase・snake_caseのどちらもありえるため）。
+    """
+    if isinstance(value, dict):
+        for key, item in value.items():
+            if key in keys:
+                yield item
+            else:
+                yield from _find(item, *keys)
+    elif isinstance(value, list):
+        for item in value:
+            yield from _find(item, *keys)
+
+class FakeGemini:
+    """
+    File API（探索ドキュメント・再開可能アップロード・get_file）と generateContent だけを持つ、プロセス内の擬似Gemini APIです。
+    アップロードされた区間（表示名に含まれる窓の開始時刻）と指示の時間窓から、SCENES のうち窓と重なるものを返します。
+    """
+
+    def __init__(self):
+        self.url = None
+        self.files = {}
+        self.sessions = {}
+        self.uploads = []
+        self.generate_requests = []
+        self.fail_next = 0
+        self._lock = threading.Lock()
+
+    def discovery(self):
+        return {
+            "kind": "discovery#restDescription", "discoveryVersion": "v1", "id": "generativelanguage:v1beta",
+            "name": "generativelanguage", "version": "v1beta", "rootUrl": self.url + "/", "servicePath": "", "batchPath": "batch",
+            "parameters": {"key": {"type": "string", "location": "query"}},
+            "schemas": {"CreateFileRequest": {"id": "CreateFileRequest", "type": "object", "properties": {"file": {"type": "object"}}}},
+            "resources": {"media": {"methods": {"upload": {
+                "id": "generativelanguage.media.upload", "path": "v1beta/files", "flatPath": "v1beta/files", "httpMethod": "POST",
+                "parameters": {}, "parameterOrder": [], "request": {"$ref": "CreateFileRequest"}, "response": {"$ref": "CreateFileRequest"},
+                "supportsMediaUpload": True,
+                "mediaUpload": {"accept": ["*/*"], "protocols": {
+                    "simple": {"multipart": True, "path": "/upload/v1beta/files"},
+                    "resumable": {"multipart": True, "path": "/resumable/upload/v1beta/files"},
+                }},
+            }}}},
+        }
+
+    def create_file(self, display_name: str, data: bytes) -> dict:
+        with self._lock:
+            name = f"files/fake-{len(self.files) + 1}"
+            self.uploads.append((display_name, len(data)))
+            self.files[name] = {
+                "name": name, "displayName": display_name, "mimeType": "video/mp4", "sizeBytes": str(len(data)),
+                "uri": f"{self.url}/v1beta/{name}", "state": "ACTIVE",
+                "createTime": "2026-01-01T00:00:00Z", "updateTime": "2026-01-01T00:00:00Z", "expirationTime": "2099-01-01T00:00:00Z",
+            }
+            return self.files[name]
+
+    def generate(self, body: dict) -> tuple:
+        with self._lock:
+            if self.fail_next:
+                self.fail_next -= 1
+                return 429, {"error": {"code": 429, "message": "Resource has been exhausted", "status": "RESOURCE_EXHAUSTED"}}
+            self.generate_requests.append(body)
+        texts = "\n".join(_find(body, "text"))
+        window = WINDOW_PATTERN.search(texts)
+        uris = list(_find(body, "fileUri", "file_uri"))
+        display_name = next(f["displayName"] for f in self.files.values() if f["uri"] == uris[0]) if uris else ""
+        clip = re.search(r"_(\d+)-(\d+)\.mp4$", display_name)
+        # 切り出した区間は窓の開始時刻（テスト動画ではキーフレーム上）から始まる
+        offset = float(clip.group(1)) if clip else 0.0
+        start, end = (float(window.group(1)), float(window.group(2))) if window else (0.0, SCENES[-1][1])
+        scenes = [
+            {"start_time": max(s - offset, start), "end_time": min(e - offset, end), "caption": f"scene-{s:.0f}"}
+            for s, e in SCENES if min(e - offset, end) > max(s - offset, start)
+        ]
+        return 200, {
+            "candidates": [{"content": {"parts": [{"text": json.dumps(scenes)}], "role": "model"}, "finishReason": "STOP", "index": 0}],
+            "usageMetadata": {"promptTokenCount": 10, "candidatesTokenCount": 5, "totalTokenCount": 15},
+        }
+
+class FakeGeminiHandler(http.server.BaseHTTPRequestHandler):
+    def _send_json(self, status: int, body: dict, headers: dict = None):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _read_body(self) -> bytes:
+        return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+    def do_GET(self):
+        gemini = self.server.gemini
+        path = self.path.split("?")[0]
+        if path == "/$discovery/rest":
+            self._send_json(200, gemini.discovery())
+        elif path.startswith("/v1beta/files/") and path[len("/v1beta/"):] in gemini.files:
+            self._send_json(200, gemini.files[path[len("/v1beta/"):]])
+        else:
+            self._send_json(404, {"error": {"code": 404, "message": "not found", "status": "NOT_FOUND"}})
+
+    def do_POST(self):
+        gemini = self.server.gemini
+        path = self.path.split("?")[0]
+        body = self._read_body()
+        if path == "/upload/v1beta/files" and "uploadType=resumable" in self.path:
+            session = uuid.uuid4().hex
+            gemini.sessions[session] = json.loads(body or b"{}").get("file", {}).get("displayName")
+            self._send_json(200, {}, {"Location": f"{gemini.url}/upload-session/{session}"})
+        elif path.endswith(":generateContent"):
+            self._send_json(*gemini.generate(json.loads(body)))
+        else:
+            self._send_json(404, {"error": {"code": 404, "message": "not found", "status": "NOT_FOUND"}})
+
+    def do_PUT(self):
+        gemini = self.server.gemini
+        session = self.path.rsplit("/", 1)[-1]
+        data = self._read_body()
+        self._send_json(200, {"file": gemini.create_file(gemini.sessions.pop(session), data)})
+
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture
+def gemini(workdir, monkeypatch):
+    """
+    GEMINI_API_ENDPOINT をプロセス内の擬似サーバーに向け、SDKの設定・レート制限・キャッシュを初期化します。
+    """
+    from google.generativeai import client
+
+    fake = FakeGemini()
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), FakeGeminiHandler)
+    server.gemini = fake
+    fake.url = f"http://127.0.0.1:{server.server_address[1]}"
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    monkeypatch.setattr(client, "GENAI_API_DISCOVERY_URL", client.GENAI_API_DISCOVERY_URL)
+    monkeypatch.setattr(video_analyzer, "GEMINI_API_ENDPOINT", fake.url)
+    monkeypatch.setattr(video_analyzer, "_genai", None)
+    monkeypatch.setattr(video_analyzer, "_gemini_api_key", "test-key")
+    monkeypatch.setattr(video_analyzer, "gemini_rate_limiter", video_analyzer.TokenBucket(6000, burst=4))
+    monkeypatch.setattr(video_analyzer, "GEMINI_RETRY_BASE_DELAY", 0.01)
+    monkeypatch.setattr(video_analyzer, "analysis_cache", DiskCache(str(workdir / "analysis")))
+    monkeypatch.setattr(video_analyzer, "ANALYSIS_WINDOW_SECONDS", 5.0)
+    monkeypatch.setattr(video_analyzer, "ANALYSIS_WINDOW_OVERLAP", 1.0)
+    # ショット検出は使わず、動画を送るモードで解析する
+    monkeypatch.setattr(video_analyzer, "get_shot_index", lambda video_path, content_hash: None)
+    monkeypatch.setattr(media_index, "_loaded", {})
+    monkeypatch.setattr(media_index, "_failed", {})
+    monkeypatch.setattr(media_index, "_index_futures", {})
+    yield fake
+    server.shutdown()
+    server.server_close()
+
+@pytest.fixture
+def source_video(workdir):
+    path = str(workdir / "source.mp4")
+    proc = subprocess.run([
+        ffmpeg_tools.get_ffmpeg_binary(), "-hide_banner", "-nostdin", "-loglevel", "error", "-y",
+        "-f", "lavfi", "-i", "testsrc2=size=160x90:rate=25", "-t", "12", "-g", "25",
+        "-c:v", "libx264", "-pix_fmt", "yuv420p", path,
+    ], capture_output=True, text=True)
+    assert proc.returncode == 0, proc.stderr
+    return path
+
+def analyze(video_path: str, content_hash: str = "hash-a", keyframes_only: bool = False, model_name: str = "gemini-test"):
+    result = asyncio.run(video_analyzer.extract_scenes_for_videos_async(
+        [{"file_id": "files/unused", "content_hash": content_hash, "video_path": video_path}], "全部", model_name, keyframes_only
+    ))[0]
+    if isinstance(result, BaseException):
+        raise result
+    return result
+
+def test_detect_scene_cuts_finds_hard_cuts(workdir, monkeypatch):
+    path = str(workdir / "cuts.mp4")
+    # 3秒ごとに絵柄の異なるソースへ切り替わる（カットは 3・6・9 秒）
+    sources = ["testsrc2=size=160x90", "smptebars=size=160x90", "color=c=navy:size=160x90", "rgbtestsrc=size=160x90"]
+    inputs = [arg for source in sources for arg in ("-f", "lavfi", "-i", f"{source}:rate=25:duration=3")]
+    proc = subprocess.run([
+        ffmpeg_tools.get_ffmpeg_binary(), "-hide_banner", "-nostdin", "-loglevel", "error", "-y", *inputs,
+        "-filter_complex", "concat=n=4:v=1:a=0", "-c:v", "libx264", "-pix_fmt", "yuv420p", path,
+    ], capture_output=True, text=True)
+    assert proc.returncode == 0, proc.stderr
+    monkeypatch.setattr(video_analyzer, "shot_index_cache", DiskCache(str(workdir / "shots")))
+
+    shot_index = video_analyzer.get_shot_index(path, "hash-cuts")
+    # カットはサンプリング間隔（1 / SHOT_DETECTION_FPS 秒）の精度で検出する
+    assert shot_index["cuts"] == pytest.approx([3.0, 6.0, 9.0], abs=1 / video_analyzer.SHOT_DETECTION_FPS)
+    assert shot_index["duration"] == pytest.approx(12.0, abs=0.5)
+    assert len(shot_index["shots"]) == 4
+
+    # 2回目はキャッシュから返し、再デコードしない
+    monkeypatch.setattr(ffmpeg_tools, "read_raw_frames", lambda *args: pytest.fail("再デコードしました"))
+    assert video_analyzer.get_shot_index(path, "hash-cuts") == shot_index
+
+def test_plan_analysis_windows():
+    assert video_analyzer.plan_analysis_windows(12.0, 5.0, 1.0) == [(0.0, 5.0), (4.0, 9.0), (8.0, 12.0)]
+    assert video_analyzer.plan_analysis_windows(4.0, 5.0, 1.0) == [(0.0, 4.0)]
+    assert video_analyzer.plan_analysis_windows(0.0, 5.0, 1.0) == []
+
+def test_merge_window_scenes_dedups_overlaps():
+    windows = [
+        [{"start_time": 0.0, "end_time": 3.0, "caption": "a"}, {"start_time": 3.0, "end_time": 5.0, "caption": "b"}],
+        [{"start_time": 4.0, "end_time": 6.0, "caption": "b-long"}, {"start_time": 6.0, "end_time": 9.0, "caption": "c"}],
+    ]
+    merged = video_analyzer.merge_window_scenes(windows)
+    assert [(s["start_time"], s["end_time"]) for s in merged] == [(0.0, 3.0), (3.0, 6.0), (6.0, 9.0)]
+
+def test_windows_are_uploaded_as_clips_and_merged(gemini, source_video):
+    scenes = analyze(source_video)
+
+    assert [(s["start_time"], s["end_time"], s["caption"]) for s in scenes] == [
+        (0.0, 3.0, "scene-0"), (3.0, 6.0, "scene-3"), (6.0, 9.0, "scene-6"), (9.0, 12.0, "scene-9"),
+    ]
+    # 動画全体ではなく、窓ごとに切り出した区間をアップロードして送る
+    assert sorted(name.rsplit("_", 1)[1] for name, _ in gemini.uploads) == ["0-5.mp4", "4-9.mp4", "8-12.mp4"]
+    assert all(size < len(open(source_video, "rb").read()) for _, size in gemini.uploads)
+    assert len(gemini.generate_requests) == 3
+    for body in gemini.generate_requests:
+        assert len(list(_find(body, "fileUri", "file_uri"))) == 1
+
+def test_rerun_hits_per_window_cache(gemini, source_video):
+    analyze(source_video)
+    assert len(gemini.generate_requests) == 3
+
+    analyze(source_video)
+    assert len(gemini.generate_requests) == 3
+    assert len(gemini.uploads) == 3
+
+    # 1つの窓の結果だけを消すと、その窓だけを解析し直す（登録済みの区間は再アップロードしない）
+    key = video_analyzer._analysis_cache_key("hash-a", "全部", "gemini-test/video/window:4.000-9.000")
+    assert video_analyzer.analysis_cache.get_json(key) is not None
+    os.remove(video_analyzer.analysis_cache.path_for(key))
+    scenes = analyze(source_video)
+    assert len(gemini.generate_requests) == 4
+    assert len(gemini.uploads) == 3
+    assert len(scenes) == 4
+
+def test_cache_key_depends_on_model_and_mode(gemini, source_video, monkeypatch):
+    analyze(source_video)
+    assert len(gemini.generate_requests) == 3
+    # モデルが変わると、同じ動画・プロンプトでも解析し直す
+    analyze(source_video, model_name="gemini-other")
+    assert len(gemini.generate_requests) == 6
+    analyze(source_video)
+    assert len(gemini.generate_requests) == 6
+
+    # ショット情報を添えるモード・キーフレームのみのモードは、それぞれ別のキーでキャッシュする
+    shots = [[float(i), float(i + 1)] for i in range(12)]
+    monkeypatch.setattr(video_analyzer, "get_shot_index", lambda video_path, content_hash: {"duration": 12.0, "cuts": [float(i) for i in range(1, 12)], "shots": shots})
+    analyze(source_video)
+    assert len(gemini.generate_requests) == 9
+    analyze(source_video, keyframes_only=True)
+    assert len(gemini.generate_requests) == 12
+    analyze(source_video, keyframes_only=True)
+    analyze(source_video)
+    assert len(gemini.generate_requests) == 12
+
+def test_analysis_cache_expires_and_evicts_oldest(workdir):
+    cache = DiskCache(str(workdir / "analysis"), max_bytes=100, ttl=60)
+    cache.put_json("aa-old", ["x" * 40])
+    cache.put_json("bb-mid", ["x" * 40])
+    os.utime(cache.path_for("aa-old"), (time.time() - 30, time.time() - 30))
+    # TTLを過ぎたエントリは読み出し時に削除する
+    os.utime(cache.path_for("bb-mid"), (time.time() - 120, time.time() - 120))
+    assert cache.get_json("bb-mid") is None
+    assert not os.path.exists(cache.path_for("bb-mid"))
+
+    # 合計サイズが上限を超えると、最も古いエントリから削除する
+    cache.put_json("cc-new", ["x" * 40])
+    cache.put_json("dd-new", ["x" * 40])
+    assert cache.get_json("aa-old") is None
+    assert cache.get_json("cc-new") == ["x" * 40]
+    assert cache.get_json("dd-new") == ["x" * 40]
+
+def test_rate_limited_requests_are_retried(gemini, source_video, monkeypatch):
+    pauses = []
+    limiter = video_analyzer.gemini_rate_limiter
+    pause = limiter.pause
+    monkeypatch.setattr(limiter, "pause", lambda seconds: (pauses.append(seconds), pause(seconds)))
+    gemini.fail_next = 2
+
+    scenes = analyze(source_video)
+
+    assert len(scenes) == 4
+    assert len(gemini.generate_requests) == 3
+    # 429を受けるたびに共有のレート制限を止める
+    assert len(pauses) == 2
+    assert all(0 < seconds <= video_analyzer.GEMINI_RETRY_MAX_DELAY for seconds in pauses)
+
+def test_span_labels_do_not_include_window_or_attempt(gemini, source_video, monkeypatch):
+    monkeypatch.setattr(metrics, "METRICS_ENABLED", True)
+    monkeypatch.setattr(metrics, "_spans", {})
+    monkeypatch.setattr(metrics, "_counters", {})
+    records = []
+    monkeypatch.setattr(metrics, "_log", records.append)
+    gemini.fail_next = 1
+
+    analyze(source_video)
+
+    label_keys = {labels for name, labels in metrics._spans if name == "gemini_generate"}
+    assert label_keys == {(("keyframes_only", "False"), ("model", "gemini-test"))}
+    logged = [record for record in records if record.get("span") == "gemini_generate"]
+    assert sorted(record["window_start"] for record in logged if "error" not in record) == [0.0, 4.0, 8.0]
+    assert {record["attempt"] for record in logged} == {0, 1}
+
+def test_keyframes_are_extracted_in_one_ffmpeg_run_per_window(gemini, source_video, monkeypatch):
+    shots = [[float(i), float(i + 1)] for i in range(12)]
+    monkeypatch.setattr(video_analyzer, "get_shot_index", lambda video_path, content_hash: {"duration": 12.0, "cuts": [float(i) for i in range(1, 12)], "shots": shots})
+    calls = []
+    extract_frames_jpeg = ffmpeg_tools.extract_frames_jpeg
+    monkeypatch.setattr(ffmpeg_tools, "extract_frames_jpeg", lambda video_path, times: (calls.append(times), extract_frames_jpeg(video_path, times))[1])
+
+    scenes = analyze(source_video, keyframes_only=True)
+
+    assert len(scenes) == 4
+    assert gemini.uploads == []
+    # 窓ごとに1回だけffmpegを実行し、窓内の各ショットの代表フレームを送る
+    assert len(calls) == 3
+    frames_per_request = sorted(len(list(_find(body, "inlineData", "inline_data"))) for body in gemini.generate_requests)
+    assert frames_per_request == sorted(len(times) for times in calls)
+    assert sum(frames_per_request) >= len(shots)